@@ -28,6 +28,8 @@ celery = Celery(
     broker=config[FLASK_ENV].CELERY_BROKER_URL,
 )
 
+# 返回bytes的连接，用于保存二进制数据(如app.utils.related中紧凑编码的相似文章)
+binary_redis = redis.from_url(config[FLASK_ENV].REDIS_URL)
 redis = redis.from_url(config[FLASK_ENV].REDIS_URL, decode_responses=True)
 
 # HACK: get the flask app logger
@@ -68,6 +70,9 @@ def create_app(config_name):
     login_manager.init_app(app)
     pagedown.init_app(app)
 
+    from .utils import tokenizer
+    tokenizer.init_app(app)
+
     # HACK: update celery
     global celery
     update_celery(celery, app)
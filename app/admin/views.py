@@ -11,7 +11,7 @@ from app.decorators import admin_required
 from app.admin import admin
 from app.admin.forms import EditProfileAdminForm
 from app.email import send_email
-from app.tasks import add_together, long_task
+from app.tasks import add_together, long_task, refresh_search_snapshot
 
 
 @admin.route('/')
@@ -83,6 +83,8 @@ def delete_md(article_name):
 def delete_html(article_name):
     article = Article.query.filter_by(name=article_name).first()
     flash(article.delete())
+    db.session.commit()
+    refresh_search_snapshot()
     return redirect(url_for('admin.index'))
 
 
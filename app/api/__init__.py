@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from app.api import errors, article, users, comments, token
+from app.api import errors, article, users, comments, token, search
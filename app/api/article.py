@@ -1,12 +1,14 @@
 from flask import jsonify, request, url_for, current_app
 from flask_login import current_user
 
-from app import db, redis
+from app import db
 from app.models import Permission, Article
 from app.api import api
 from app.api.decorators import permission_required, login_required
 from app.api.errors import forbidden, ValidationError
+from app.exceptions import DuplicateError
 from app.tasks import build_index, rebuild_index
+from app.utils import related
 
 
 @api.route('/articles/<int:id>')
@@ -70,6 +72,19 @@ def edit_article():
 def sync_article():
     try:
         article = Article.from_jekyll_json(request.json)
+    except DuplicateError as exp:
+        # 内容重复，409 - 冲突
+        current_app.logger.warning(str(exp))
+        return (
+            jsonify({
+                'message': str(exp),
+                'duplicates': [
+                    {'url': url_for('api.get_article', id=article_id, _external=True), 'distance': distance}
+                    for article_id, distance in exp.duplicates
+                ],
+            }),
+            409
+        )
     except ValidationError as exp:
         # 无内容，412 - 未满足前提条件
         current_app.logger.warning(str(exp))
@@ -113,13 +128,13 @@ def modify_article(article_id):
 @api.route('/articles/<int:id>/similarities/')
 def get_similarities(id):
     article = Article.query.get_or_404(id)
-    similarities = redis.zrevrange(article.title, 0, 4, withscores=True)
     result = [
         {
-            'title': similarity[0],
-            'url': url_for('article.article', title=similarity[0]),
-            'similarity': similarity[1]
-        } for similarity in similarities
+            'id': similar_article.id,
+            'title': similar_article.title,
+            'url': url_for('article.article', title=similar_article.title),
+            'similarity': similarity
+        } for similar_article, similarity in related.similar_articles(article.id)
     ]
     return jsonify(result)
 
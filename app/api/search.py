@@ -0,0 +1,55 @@
+from flask import jsonify, request, url_for, current_app
+
+from app.api import api
+from app.utils.facets import Filters
+from app.utils.searcher import paginate
+from app.utils.suggester import suggest
+from app.utils.tokenizer import startup_metrics
+
+
+# 每次补全返回的最大数量
+MAX_SUGGESTIONS = 20
+
+
+@api.route('/search/')
+def search():
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    filters = Filters.from_args(request.args)
+    pagination = paginate(q, page, current_app.config['SEARCH_RESULTS_PER_PAGE'], filters)
+    prev = None
+    if pagination.has_prev:
+        prev = url_for('api.search', q=q, page=page - 1, **filters.to_args())
+    next = None
+    if pagination.has_next:
+        next = url_for('api.search', q=q, page=page + 1, **filters.to_args())
+    return jsonify({
+        'results': [
+            {
+                'id': article.id,
+                'title': article.title,
+                'url': url_for('article.article', title=article.title),
+                'timestamp': article.timestamp,
+                'score': score,
+            } for article, score in pagination.items
+        ],
+        'facets': pagination.facets,
+        'prev': prev,
+        'next': next,
+        'count': pagination.total
+    })
+
+
+@api.route('/search/suggest')
+def search_suggest():
+    q = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), MAX_SUGGESTIONS)
+    return jsonify({
+        'query': q,
+        'suggestions': suggest(q, limit),
+    })
+
+
+@api.route('/search/tokenizer')
+def search_tokenizer():
+    return jsonify(startup_metrics())
@@ -1,12 +1,10 @@
-# import json
-from collections import defaultdict
-
 from flask import jsonify, request, current_app, url_for
-from app.models import User, Article, Rating
+from app.models import User, Article
 
 from app.api import api
 from app.api.decorators import login_required
-from app.utils.recommender import get_recommended_items, calculate_similar_items
+from app.tasks import build_item_model
+from app.utils import item_model
 
 
 @api.route('/users/<int:id>')
@@ -42,35 +40,27 @@ def get_user_articles(id):
 
 @api.route('/users/<int:id>/recommendation/')
 def get_recommendation(id):
-    """ 获取推荐信息，依赖 person_prefs 和 item_prefs 字段"""
-    # TODO: 缓存中间结果
-    # with open('person_prefs.json', 'r') as fd:
-    #     person_prefs = json.load(fd)
-    # with open('item_prefs.json', 'r') as fd:
-    #     item_prefs = json.load(fd)
-    person_prefs = defaultdict(dict)
-    item_prefs = defaultdict(dict)
-    for rating in Rating.query.all():
-        username = rating.user.username
-        title = rating.article.title
-        rating_value = rating.value
-        person_prefs[username][title] = rating_value
-        item_prefs[title][username] = rating_value
-
-        # person_prefs.hset(username, article_name, rating_value)
-        # item_prefs.hset(article_name, username, rating_value)
-
-        print(f'Cache rattings of {title} & {username} := {rating_value}')
-
+    """ 获取推荐信息，使用预先计算的物品相似度模型(`app.utils.item_model`)
+    结果在服务端按用户缓存，并带有ETag，浏览器可以用If-None-Match验证后直接使用本地结果
+    """
     user = User.query.get_or_404(id)
-
-    item_match = calculate_similar_items(item_prefs)
-    recommendations = get_recommended_items(person_prefs, item_match, user.username)[:5]
+    if not item_model.version() and item_model.acquire_build_lock():
+        # 模型还没有计算过，由后台任务计算，计算期间的其他请求不再重复提交
+        build_item_model.delay()
+    recommendations = item_model.cached_recommend(user.id)
+    articles = {article.id: article for article in
+                Article.query.filter(Article.id.in_([article_id for _, article_id in recommendations]))} \
+        if recommendations else {}
     result = [
         {
-            'title': recommendation[1],
-            'url': url_for('article.article', title=recommendation[1]),
-            'price': recommendation[0]
-        } for recommendation in recommendations
+            'id': article_id,
+            'title': articles[article_id].title,
+            'url': url_for('article.article', title=articles[article_id].title),
+            'price': score
+        } for score, article_id in recommendations if article_id in articles
     ]
-    return jsonify(result)
+    response = jsonify(result)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
@@ -2,12 +2,13 @@ from flask import flash, render_template, redirect, url_for, request, abort
 from flask_login import current_user, login_required
 
 
-from app import db, redis
+from app import db
 from app.models import Article, Comment, Permission, Rating
 from app.decorators import permission_required, author_required
 from app.article import article as article_blueprint
 from app.article.forms import EditArticleForm, ModifyArticleForm
-from app.tasks import build_index, rebuild_index
+from app.tasks import build_index, rebuild_index, refresh_search_snapshot, update_item_model
+from app.utils import related, item_model
 
 
 @article_blueprint.route('/<title>', methods=['GET'])
@@ -16,7 +17,7 @@ def article(title):
     article = Article.query.filter_by(title=title).first_or_404()
 
     # 相似文章
-    sim_articles = redis.zrevrange(article.title, 0, 4, withscores=True)
+    sim_articles = related.similar_articles(article.id)
 
     # 获取评分情况
     ratings = article.ratings.all()
@@ -73,6 +74,8 @@ def delete(title):
         abort(403)
     else:
         flash(article.delete())
+        db.session.commit()
+        refresh_search_snapshot()
         return (redirect(request.args.get('next')
                 or url_for('user.user', username=current_user.username)))
 
@@ -123,6 +126,9 @@ def rating():
     else:  # 更改
         rating.value = rating_value
     db.session.add(rating)
+    db.session.commit()
+    item_model.invalidate(user_id)
+    update_item_model.delay(article_id, user_id)
     return "Rating done."
 
 
@@ -1,3 +1,11 @@
 class ValidationError(ValueError):
     """生成文章、评论时body为空时触发"""
     pass
+
+
+class DuplicateError(ValidationError):
+    """同步的文章与已有文章内容重复时触发"""
+
+    def __init__(self, message, duplicates):
+        super().__init__(message)
+        self.duplicates = duplicates  # [(article_id, distance), ...]
@@ -3,7 +3,9 @@ from flask_login import current_user
 
 from app.main import main
 # from app.utils.similarity import similarity
-from app.utils.searcher import query as searcher_query
+from app.utils.searcher import paginate as searcher_paginate
+from app.utils.snippets import make_snippets
+from app.utils.facets import Filters
 from app.models import Category, Tag, Article, Permission, AnonymousUser
 
 
@@ -69,7 +71,9 @@ def archives():
 
 @main.route('/search')
 def search():
-    query = request.args.get('query')
+    query = request.args.get('query', '')
+    page = request.args.get('page', 1, type=int)
+    filters = Filters.from_args(request.args)
 
     # Via similarity
     # article_scores = []
@@ -78,8 +82,14 @@ def search():
     #     article_scores.append((article, score))
     # article_scores.sort(key=lambda x: x[1], reverse=True)
 
-    # Via utils.searcher.query
-    article_scores = searcher_query(query)
+    # Via utils.searcher.paginate
+    pagination = searcher_paginate(
+        query,
+        page,
+        per_page=current_app.config['SEARCH_RESULTS_PER_PAGE'],
+        filters=filters,
+    )
+    snippets = make_snippets(query, [article.id for article, _ in pagination.items])
 
     archives_anchor = []
     for index, ((year, month), articls) in enumerate(Article.archives()):
@@ -90,7 +100,11 @@ def search():
     return render_template(
         'search.html',
         query=query,
-        article_scores=article_scores[:8],
+        article_scores=pagination.items,
+        snippets=snippets,
+        pagination=pagination,
+        filters=filters,
+        facets=pagination.facets,
         archives_anchor=archives_anchor,
     )
 
@@ -3,6 +3,35 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 
 
+def chunked(items, size):
+    """将items按size大小切分，用于控制单条SQL语句中的参数数量，items可以是生成器"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_insert(table, rows, max_params=900):
+    """使用多行`INSERT ... VALUES (...), (...)`批量插入rows
+
+    每条语句携带的参数数量不超过max_params(SQLite默认上限为999)，
+    相比逐行`INSERT`可以把数据库往返次数减少几百倍
+    Args:
+        table: sqlalchemy.Table
+        rows: 由{column: value}组成的list
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    size = max(1, max_params // len(rows[0]))
+    for chunk in chunked(rows, size):
+        db.session.execute(table.insert().values(chunk))
+
+
 from app.models.permission import Permission
 from app.models.role import Role
 from app.models.user import User, AnonymousUser
@@ -18,7 +47,12 @@ belong_to = db.Table(
               primary_key=True)
 )
 from app.models.words import Words
-from app.models.wordlocation import WordLocation
+from app.models.posting import Posting
+from app.models.articlestats import ArticleStats
+from app.models.corpusstats import CorpusStats
+from app.models.tombstone import Tombstone
+from app.models.segment import Segment
+from app.models.fingerprint import Fingerprint
 from app.models.article import Article
 from app.models.comment import Comment
 from app.models.rating import Rating
@@ -32,5 +66,7 @@ __all__ = [
     Words,
     Article,
     Comment, Rating,
-    WordLocation,
+    Posting, ArticleStats, CorpusStats,
+    Segment, Tombstone,
+    Fingerprint,
 ]
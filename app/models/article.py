@@ -3,17 +3,19 @@ import hashlib
 from itertools import groupby
 from datetime import datetime
 
-import jieba
 from flask import url_for
 from sqlalchemy import desc
 
-from app import redis, logger
+from app import logger
 from config import Config
 from app.utils.markdown import MD
 from app.utils.convert import todatetime
-from app.utils.similarity import similarity
-from app.exceptions import ValidationError
-from app.models import db, belong_to, User, Role, Words, WordLocation, Tag, Category
+from app.utils.postings import encode_positions
+from app.utils.simhash import fingerprint
+from app.utils import search_cache, token_cache
+from app.exceptions import ValidationError, DuplicateError
+from app.models import (db, belong_to, User, Role, Words, Posting, Segment, Tombstone,
+                        ArticleStats, CorpusStats, Fingerprint, Tag, Category)
 
 
 class Article(db.Model):
@@ -38,7 +40,7 @@ class Article(db.Model):
     )
     comments = db.relationship('Comment', backref='article', lazy='dynamic')
     ratings = db.relationship('Rating', backref='article', lazy='dynamic')
-    wordlocations = db.relationship('WordLocation', backref='article', lazy='dynamic')
+    postings = db.relationship('Posting', backref='article', lazy='dynamic')
 
     # ForeignKey
     # backref='category'
@@ -65,62 +67,137 @@ class Article(db.Model):
                            + [tag.name for tag in self.tags] * 3)
         return content
 
+    @property
+    def fields(self):
+        """按字段返回需要建立索引的文本，字段权重见`app.utils.analyzer.FIELD_BOOSTS`"""
+        return self.index_fields(self.title, self.category.name,
+                                 [tag.name for tag in self.tags], self.body)
+
+    @staticmethod
+    def index_fields(title, category, tags, body):
+        """标签按名称排序，与读取顺序无关，逐篇与批量建立索引时位置与分词缓存key相同"""
+        return [
+            ('title', title),
+            ('category', category),
+            ('tags', " ".join(sorted(tags))),
+            ('body', body),
+        ]
+
     @property
     def words(self):
-        """对自身的markdown格式内容进行中文分词并返回结果"""
-        words = [word.lower() for word in jieba.cut_for_search(self.content)]
-        return words
+        """文章中的词，按在各字段中出现的顺序排列(分词结果来自app.utils.token_cache)"""
+        terms, _, _ = token_cache.analyze(self.fields)
+        return [word for _, word in sorted(
+            (position, word) for word, (_, positions) in terms.items() for position in positions
+        )]
+
+    @property
+    def term_weights(self):
+        """按字段加权的词频{word: weight}，与`content`的词频相同，用于相似度计算"""
+        return self.weights_of(token_cache.analyze(self.fields))
+
+    @staticmethod
+    def weights_of(analysis):
+        terms, _, _ = analysis
+        return {word: weight for word, (weight, _) in terms.items()}
 
     def _is_indexed(self):
-        """如果文章已经在WordLocation中建立索引，则返回True"""
-        return WordLocation.query.filter_by(article=self).first() is not None
+        """如果文章已经建立有效的索引，则返回True"""
+        return ArticleStats.query.get(self.id) is not None
 
     def _build_index(self):
-        """为文章建立索引"""
+        """为文章建立索引，已经建立时跳过"""
         if self._is_indexed():
             return
+        self._write_index()
+
+    def _rebuild_index(self):
+        """重新为文章建立索引"""
+        self._write_index()
+
+    def _write_index(self):
+        """为文章建立索引，替换之前的索引
+
+        只分词一次，用一次`IN`查询得到所有词的id，缺失的词批量插入，
+        每个词的位置列表编码为一条Posting并以多行INSERT批量追加到当前索引段，
+        之前的索引在封存段中时只写入墓碑，文档频率只更新新旧两个版本中不同的词，
+        同时增量更新文章/语料的长度统计，整个过程只提交一次
+        """
         logger.info(f'Indexing {self.title}...')
 
-        for loc, word_value in enumerate(self.words):
-            if Words._should_ignore(word_value):
-                continue
-            word = Words.query.filter_by(value=word_value).first()
-            if word is None:
-                word = Words(value=word_value)
-                db.session.add(word)
-                db.session.commit()
-            wordlocation = WordLocation(article=self, word=word, location=loc)
-            db.session.add(wordlocation)
-            db.session.commit()
+        terms, length, spans = token_cache.analyze(self.fields)
+        word_ids = Words.get_ids(terms)
+        segment = Segment.current()
+
+        old_word_ids = set()
+        stats = ArticleStats.query.get(self.id)
+        if stats is not None:
+            old_word_ids = set(self._remove_postings(stats.segment_id, segment.id))
+            CorpusStats.update(-1, -stats.length)
+        else:
+            stats = ArticleStats(article_id=self.id)
+            db.session.add(stats)
+
+        Posting.bulk_insert(
+            {
+                'word_id': word_ids[word_value],
+                'article_id': self.id,
+                'segment_id': segment.id,
+                'frequency': len(locs),
+                'weight': weight,
+                'positions': encode_positions(locs),
+            } for word_value, (weight, locs) in terms.items()
+        )
+        new_word_ids = set(word_ids.values())
+        Words.update_df(new_word_ids - old_word_ids, 1)
+        Words.update_df(old_word_ids - new_word_ids, -1)
+        Segment.update(segment.id, 1, 1)
+
+        body_position, body_spans = spans['body']
+        stats.segment_id = segment.id
+        stats.length = length
+        stats.body_position = body_position
+        stats.offsets = encode_positions([offset for span in body_spans for offset in span])
+        CorpusStats.update(1, length)
+        db.session.commit()
+        search_cache.bump_generation()
 
     def _delete_index(self):
         """删除文章索引"""
-        if self.wordlocations:
-            for wordlocation in self.wordlocations:
-                db.session.delete(wordlocation)
-            db.session.commit()
-
-    def _rebuild_index(self):
-        """重新为文章建立索引"""
-        self._delete_index()
-        self._build_index()
+        stats = ArticleStats.query.get(self.id)
+        if stats is None:
+            return
+        latest = Segment.latest()
+        word_ids = self._remove_postings(stats.segment_id, latest.id if latest else None)
+        Words.update_df(word_ids, -1)
+        CorpusStats.update(-1, -stats.length)
+        db.session.delete(stats)
+        db.session.commit()
+        search_cache.bump_generation()
+
+    def _remove_postings(self, segment_id, current_segment_id):
+        """ 使文章在segment_id段中的posting失效
+        在当前段中时直接删除(当前段较小)，在封存段中时只写入墓碑，由Segment.compact清理
+        Returns:
+            失效的posting的词id
+        """
+        word_ids = Posting.word_ids(self.id, segment_id)
+        if segment_id == current_segment_id:
+            Posting.query.filter_by(article_id=self.id, segment_id=segment_id) \
+                .delete(synchronize_session=False)
+        else:
+            db.session.add(Tombstone(segment_id=segment_id, article_id=self.id))
+        Segment.update(segment_id, 0, -1)
+        return word_ids
 
     def _cache_similar(self):
-        logger.info(f"Cache: {self.title}")
-        for other in Article.query.all():
-            if self == other:
-                continue
-            sim = similarity(self.content, other.content)
-            redis.zadd(self.title, {other.title: sim})
-            redis.zadd(other.title, {self.title: sim})
+        """增量更新文章与其他文章的相似度缓存"""
+        from app.utils import related
+        related.update(self)
 
     def _delete_cache(self):
-        logger.info(f"Delete Cache: {self.title}")
-        redis.delete(self.title)
-        for other in Article.query.all():
-            if self == other:
-                continue
-            redis.zrem(other.title, self.title)
+        from app.utils import related
+        related.remove(self)
 
     def add_tags(self, tag_names):
         """增加文章的tags
@@ -159,6 +236,10 @@ class Article(db.Model):
         """删除存在的文章记录"""
         self.delete_tags()
         self._delete_index()
+        # 文章记录删除后posting与墓碑不再需要，直接清除
+        Posting.query.filter_by(article_id=self.id).delete(synchronize_session=False)
+        Tombstone.query.filter_by(article_id=self.id).delete(synchronize_session=False)
+        Fingerprint.query.filter_by(article_id=self.id).delete(synchronize_session=False)
         self._delete_cache()
         db.session.delete(self)
         return "[article] %s is deleted" % self.title
@@ -224,6 +305,9 @@ class Article(db.Model):
         if content is None or content == '':
             raise ValidationError('Article does not have a body ')
 
+        # 在渲染与写入数据库之前检查内容是否重复
+        content_fingerprint = Article.check_duplicate(content)
+
         article = Article()
         article.body = content  # 必须
         article.body_html = MD.convert(content)
@@ -246,6 +330,8 @@ class Article(db.Model):
             article.set_category(category_name)
             article.add_tags(tag_names)
             db.session.add(article)
+            db.session.flush()
+            Fingerprint.save(article.id, content_fingerprint)
             db.session.commit()
         except Exception:
             db.session.rollback()
@@ -253,6 +339,20 @@ class Article(db.Model):
         else:
             return article
 
+    @staticmethod
+    def check_duplicate(content):
+        """如果已有文章与content内容重复，触发DuplicateError，否则返回content的指纹"""
+        content_fingerprint = fingerprint(content)
+        duplicates = Fingerprint.near_duplicates(content_fingerprint)
+        if duplicates:
+            raise DuplicateError(f'Article is a near-duplicate of article {duplicates[0][0]}', duplicates)
+        return content_fingerprint
+
+    def _save_fingerprint(self):
+        """保存正文的指纹"""
+        Fingerprint.save(self.id, fingerprint(self.body))
+        db.session.commit()
+
     def __repr__(self):
         return '<Article %r>' % self.title
 
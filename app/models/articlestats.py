@@ -0,0 +1,33 @@
+from app.models import db, chunked
+
+
+class ArticleStats(db.Model):
+    """已索引文章的统计信息，用于BM25F评分"""
+    __tablename__ = 'article_stats'
+
+    # ForeignKey
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id'), primary_key=True)
+
+    # 文章当前有效的索引所在的段
+    segment_id = db.Column(db.Integer, db.ForeignKey('segments.id'))
+
+    length = db.Column(db.Float)  # 按字段加权后的文章长度
+
+    # 正文第一个词的位置，与正文各位置的字符区间(start, end)依次展开后用encode_positions编码，
+    # 生成摘要时根据位置直接截取正文，不需要读取整篇文章
+    body_position = db.Column(db.Integer)
+    offsets = db.Column(db.LargeBinary)
+
+    @classmethod
+    def lengths(cls, article_ids):
+        """批量查询文章长度
+        Returns:
+            {article_id: length}
+        """
+        lengths = {}
+        for chunk in chunked(article_ids, 500):
+            lengths.update(db.session.query(cls.article_id, cls.length).filter(cls.article_id.in_(chunk)))
+        return lengths
+
+    def __repr__(self):
+        return f"<ArticleStats {self.article_id} {self.length}>"
@@ -0,0 +1,37 @@
+from app.models import db
+
+
+class CorpusStats(db.Model):
+    """所有已索引文章的统计信息，只有一行，由建立/删除索引时增量维护"""
+    __tablename__ = 'corpus_stats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    doc_count = db.Column(db.Integer)  # 已索引的文章数
+    total_length = db.Column(db.Float)  # 已索引文章的长度之和
+
+    @property
+    def avg_length(self):
+        if not self.doc_count:
+            return 0.0
+        return self.total_length / self.doc_count
+
+    @classmethod
+    def get(cls):
+        stats = cls.query.get(1)
+        if stats is None:
+            stats = cls(id=1, doc_count=0, total_length=0.0)
+            db.session.add(stats)
+            db.session.flush()
+        return stats
+
+    @classmethod
+    def update(cls, doc_count, length):
+        """以`UPDATE ... SET x = x + delta`增量更新，避免并发的索引任务互相覆盖"""
+        cls.get()
+        cls.query.filter_by(id=1).update({
+            cls.doc_count: cls.doc_count + doc_count,
+            cls.total_length: cls.total_length + length,
+        }, synchronize_session=False)
+
+    def __repr__(self):
+        return f"<CorpusStats {self.doc_count} {self.total_length}>"
@@ -0,0 +1,54 @@
+from app.models import db
+from app.utils import simhash
+
+
+class Fingerprint(db.Model):
+    """文章正文的SimHash指纹，用于发现内容重复的文章"""
+    __tablename__ = 'article_fingerprints'
+
+    # ForeignKey
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id'), primary_key=True)
+
+    value = db.Column(db.BigInteger)  # 64位指纹，按有符号整数保存
+
+    # 指纹的4段，每段16位，分别建立索引
+    block_0 = db.Column(db.Integer, index=True)
+    block_1 = db.Column(db.Integer, index=True)
+    block_2 = db.Column(db.Integer, index=True)
+    block_3 = db.Column(db.Integer, index=True)
+
+    @property
+    def fingerprint(self):
+        return simhash.to_unsigned(self.value)
+
+    @classmethod
+    def save(cls, article_id, fingerprint):
+        """保存(或更新)文章的指纹，需要调用者提交"""
+        row = cls.query.get(article_id) or cls(article_id=article_id)
+        row.value = simhash.to_signed(fingerprint)
+        row.block_0, row.block_1, row.block_2, row.block_3 = simhash.blocks(fingerprint)
+        db.session.add(row)
+        return row
+
+    @classmethod
+    def near_duplicates(cls, fingerprint, exclude=None):
+        """与fingerprint的汉明距离不超过simhash.MAX_DISTANCE的文章
+        每段各查一次索引得到候选文章，只对候选文章计算汉明距离
+        Args:
+            exclude: 不包含的文章id
+        Returns:
+            [(article_id, distance), ...]，按距离从小到大排列
+        """
+        b0, b1, b2, b3 = simhash.blocks(fingerprint)
+        rows = db.session.query(cls.article_id, cls.value).filter(db.or_(
+            cls.block_0 == b0, cls.block_1 == b1, cls.block_2 == b2, cls.block_3 == b3,
+        ))
+        duplicates = []
+        for article_id, value in rows:
+            distance = simhash.distance(fingerprint, simhash.to_unsigned(value))
+            if article_id != exclude and distance <= simhash.MAX_DISTANCE:
+                duplicates.append((article_id, distance))
+        return sorted(duplicates, key=lambda item: item[1])
+
+    def __repr__(self):
+        return f"<Fingerprint {self.article_id} {self.fingerprint:016x}>"
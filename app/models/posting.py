@@ -0,0 +1,48 @@
+from app.models import db, bulk_insert
+from app.utils.postings import decode_positions
+
+
+class Posting(db.Model):
+    """倒排索引，每个(词, 文章, 索引段)一条记录，positions为delta+varint编码的位置列表"""
+    __tablename__ = 'postings'
+
+    # ForeignKey
+    # backref='word'
+    word_id = db.Column(db.Integer, db.ForeignKey('words.id'), primary_key=True)
+    # backref='article'
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id'), primary_key=True, index=True)
+    segment_id = db.Column(db.Integer, db.ForeignKey('segments.id'), primary_key=True)
+
+    frequency = db.Column(db.Integer)  # 词在文章中出现的次数
+    weight = db.Column(db.Float)  # 按字段权重加权的词频(BM25F)
+    positions = db.Column(db.LargeBinary)
+
+    @property
+    def locations(self):
+        """解码后的位置列表"""
+        return decode_positions(self.positions)
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        """批量写入索引
+        Args:
+            rows: 由{'word_id': .., 'article_id': .., 'segment_id': .., 'frequency': .., 'weight': .., 'positions': ..}
+                组成的可迭代对象
+        """
+        bulk_insert(cls.__table__, rows)
+
+    @classmethod
+    def word_ids(cls, article_id, segment_id):
+        """文章在一个索引段中的所有词id"""
+        return [word_id for word_id, in db.session.query(cls.word_id)
+                .filter_by(article_id=article_id, segment_id=segment_id)]
+
+    @classmethod
+    def clear(cls):
+        """清除所有索引"""
+        for posting in cls.query.all():
+            db.session.delete(posting)
+        db.session.commit()
+
+    def __repr__(self):
+        return f"<Posting {self.article.title} {self.word.value} {self.locations}>"
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from app.models import db, chunked, Posting, ArticleStats, Tombstone
+
+
+class Segment(db.Model):
+    """索引段
+
+    新建立或重建的索引追加到当前段(最新且未写满的段)，段中追加过SEGMENT_SIZE篇文章后封存。
+    封存段中的文章被修改或删除时不删除其posting，只写入一条墓碑(Tombstone)，
+    查询时跳过墓碑对应的posting，由后台任务`compact`清理墓碑并合并变小的段
+    """
+    __tablename__ = 'segments'
+
+    SEGMENT_SIZE = 64  # 每段最多追加的文章数
+
+    id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.Integer, default=0)  # 追加过的文章数
+    doc_count = db.Column(db.Integer, default=0)  # 仍然有效的文章数
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def sealed(self):
+        return self.size >= self.SEGMENT_SIZE
+
+    @classmethod
+    def latest(cls):
+        return cls.query.order_by(cls.id.desc()).first()
+
+    @classmethod
+    def current(cls):
+        """返回当前段，最新的段已经封存时新建一段"""
+        segment = cls.latest()
+        if segment is None or segment.sealed:
+            segment = cls(size=0, doc_count=0)
+            db.session.add(segment)
+            db.session.flush()
+        return segment
+
+    @classmethod
+    def update(cls, segment_id, size, doc_count):
+        """以`UPDATE ... SET x = x + delta`增量更新，避免并发的索引任务互相覆盖"""
+        cls.query.filter_by(id=segment_id).update({
+            cls.size: cls.size + size,
+            cls.doc_count: cls.doc_count + doc_count,
+        }, synchronize_session=False)
+
+    @classmethod
+    def compact(cls):
+        """ 清理墓碑并合并变小的封存段
+        1. 删除墓碑对应的posting与墓碑
+        2. 删除没有有效文章的封存段
+        3. 有效文章数不足SEGMENT_SIZE一半的封存段合并为一段
+        当前段不参与合并，整个过程在一个事务中完成，查询结果不变
+        Returns:
+            (清理的墓碑数, 删除或合并的段数)
+        """
+        latest = cls.latest()
+        if latest is None:
+            return 0, 0
+        tombstones = 0
+        for segment_id, article_ids in Tombstone.by_segment().items():
+            for chunk in chunked(article_ids, 500):
+                Posting.query.filter(Posting.segment_id == segment_id,
+                                     Posting.article_id.in_(chunk)) \
+                    .delete(synchronize_session=False)
+                Tombstone.query.filter(Tombstone.segment_id == segment_id,
+                                       Tombstone.article_id.in_(chunk)) \
+                    .delete(synchronize_session=False)
+                tombstones += len(chunk)
+
+        sealed = cls.query.filter(cls.id != latest.id).order_by(cls.id).all()
+        empty = [segment for segment in sealed if segment.doc_count <= 0]
+        small = [segment for segment in sealed
+                 if 0 < segment.doc_count < cls.SEGMENT_SIZE // 2]
+        for segment in empty:
+            db.session.delete(segment)
+        merged = len(empty)
+        if len(small) > 1:
+            target, sources = small[0], [segment.id for segment in small[1:]]
+            for model in (Posting, ArticleStats, Tombstone):
+                model.query.filter(model.segment_id.in_(sources)) \
+                    .update({model.segment_id: target.id}, synchronize_session=False)
+            target.size = target.doc_count = sum(segment.doc_count for segment in small)
+            for segment in small[1:]:
+                db.session.delete(segment)
+            merged += len(sources)
+        db.session.commit()
+        return tombstones, merged
+
+    def __repr__(self):
+        return f"<Segment {self.id} {self.doc_count}/{self.size}>"
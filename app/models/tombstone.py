@@ -0,0 +1,26 @@
+from app.models import db
+
+
+class Tombstone(db.Model):
+    """索引段中已经失效的文章，查询时跳过这些(段, 文章)的posting"""
+    __tablename__ = 'tombstones'
+
+    # ForeignKey
+    segment_id = db.Column(db.Integer, db.ForeignKey('segments.id'), primary_key=True)
+    article_id = db.Column(db.Integer, primary_key=True)
+
+    @classmethod
+    def all(cls):
+        """ Returns: {(segment_id, article_id), ...} """
+        return set(db.session.query(cls.segment_id, cls.article_id))
+
+    @classmethod
+    def by_segment(cls):
+        """ Returns: {segment_id: [article_id, ...]} """
+        segments = {}
+        for segment_id, article_id in db.session.query(cls.segment_id, cls.article_id):
+            segments.setdefault(segment_id, []).append(article_id)
+        return segments
+
+    def __repr__(self):
+        return f"<Tombstone {self.segment_id} {self.article_id}>"
@@ -1,5 +1,5 @@
 from app.utils.similarity import should_ignore
-from app.models import db
+from app.models import db, chunked, bulk_insert
 
 
 class Words(db.Model):
@@ -7,14 +7,51 @@ class Words(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.String(64), unique=True, index=True)
+    df = db.Column(db.Integer, default=0)  # 含有该词的文章数
 
     # Relationship
-    wordlocations = db.relationship('WordLocation', backref='word', lazy='dynamic')
+    postings = db.relationship('Posting', backref='word', lazy='dynamic')
 
     @staticmethod
     def _should_ignore(word):
         return should_ignore(word)
 
+    @classmethod
+    def lookup(cls, values):
+        """批量查询词的id
+        Args:
+            values: 词组成的可迭代对象
+        Returns:
+            {value: id}，不存在的词不会出现在结果中
+        """
+        ids = {}
+        for chunk in chunked(set(values), 500):
+            ids.update(db.session.query(cls.value, cls.id).filter(cls.value.in_(chunk)))
+        return ids
+
+    @classmethod
+    def get_ids(cls, values):
+        """批量查询词的id，不存在的词先批量插入
+        Args:
+            values: 词组成的可迭代对象
+        Returns:
+            {value: id}，包含values中的所有词
+        """
+        values = set(values)
+        ids = cls.lookup(values)
+        missing = values - ids.keys()
+        if missing:
+            bulk_insert(cls.__table__, [{'value': value, 'df': 0} for value in missing])
+            ids.update(cls.lookup(missing))
+        return ids
+
+    @classmethod
+    def update_df(cls, ids, delta):
+        """将ids对应的词的文档频率增加delta"""
+        for chunk in chunked(ids, 500):
+            cls.query.filter(cls.id.in_(chunk)) \
+                .update({cls.df: cls.df + delta}, synchronize_session=False)
+
     @classmethod
     def clear(cls):
         """清除所有索引"""
@@ -24,4 +61,3 @@ class Words(db.Model):
 
     def __repr__(self):
         return "<Word %s>" % self.value
-
@@ -25,5 +25,29 @@ $(function() {
     }
     footerPosition();
     $(window).resize(footerPosition);
+
+    // 搜索框补全最后一个词
+    let searchInput = $('nav input[name="query"]');
+    let suggestions = $('<datalist id="search-suggestions"></datalist>').insertAfter(searchInput);
+    let suggestTimer = null;
+    searchInput.attr('list', 'search-suggestions');
+    searchInput.on('input', function () {
+        clearTimeout(suggestTimer);
+        let value = this.value;
+        let head = value.replace(/\S*$/, '');
+        let prefix = value.slice(head.length);
+        if (!prefix) {
+            suggestions.empty();
+            return;
+        }
+        suggestTimer = setTimeout(function () {
+            $.getJSON('/api/search/suggest', {q: prefix}, function (data) {
+                suggestions.empty();
+                data.suggestions.forEach(function (word) {
+                    $('<option>').attr('value', head + word).appendTo(suggestions);
+                });
+            });
+        }, 100);
+    });
 });
 
@@ -15,7 +15,7 @@ class ArticleList extends React.Component {
         $.ajax({
             url: this.props.url,
             dataType: 'json',
-            cache: false,
+            cache: Boolean(this.props.cache),
             success: (data) => {
                 this.setState({articles: data})
             },
@@ -7,7 +7,8 @@ const recommendArticles = document.getElementById('recommend-articles')
 const userId = recommendArticles.dataset.userId
 const url = `/api/users/${userId}/recommendation/`
 
+// 推荐结果在服务端按用户缓存并带有ETag，不加时间戳参数，以便浏览器验证后复用
 ReactDOM.render(
-    e(ArticleList, {url: url, title: '推荐文章', emptyTip: ''}),
+    e(ArticleList, {url: url, title: '推荐文章', emptyTip: '', cache: true}),
     recommendArticles
 )
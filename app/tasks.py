@@ -1,8 +1,11 @@
 import time
 import random
 
-from app import celery
-from app.models import Article
+from flask import current_app
+
+from app import celery, logger
+from app.models import Article, Segment
+from app.utils import snapshot, item_model
 
 
 @celery.task
@@ -13,28 +16,74 @@ def add_together(a, b):
 @celery.task()
 def build_index(id):
     """为文章建立索引与相似度缓存"""
-    # XXX: jieba分词每次都会重新加载一次
     article = Article.query.get_or_404(id)
     article._build_index()
+    article._save_fingerprint()
     article._cache_similar()
+    refresh_search_snapshot()
 
 
 @celery.task
 def rebuild_index(id):
     """为文章重新建立索引与相似度缓存"""
-    # XXX: jieba分词每次都会重新加载一次
     article = Article.query.get_or_404(id)
     article._rebuild_index()
+    article._save_fingerprint()
     article._cache_similar()
+    refresh_search_snapshot()
 
 
 @celery.task
 def delete_index(id):
     """删除文章的索引与相似度缓存"""
-    # XXX: jieba分词每次都会重新加载一次
     article = Article.query.get_or_404(id)
     article._delete_index()
     article._delete_cache()
+    refresh_search_snapshot()
+
+
+@celery.task
+def compact_index():
+    """清理索引段中的墓碑并合并变小的段"""
+    tombstones, segments = Segment.compact()
+    logger.info(f'Compacted index: {tombstones} tombstones, {segments} segments')
+
+
+@celery.task
+def build_item_model():
+    """重新计算推荐使用的物品相似度模型"""
+    item_model.build()
+
+
+@celery.task
+def update_item_model(article_id, user_id=None):
+    """文章的评分改变后，更新推荐模型中它与其他文章的相似度，并删除评分用户的推荐缓存"""
+    item_model.update(article_id)
+    if user_id is not None:
+        item_model.invalidate(user_id)
+
+
+@celery.on_after_finalize.connect
+def setup_periodic_tasks(sender, **kwargs):
+    # celery.conf由update_celery从flask配置更新
+    sender.add_periodic_task(sender.conf['SEARCH_COMPACT_INTERVAL'], compact_index.s(),
+                             name='compact search index')
+    sender.add_periodic_task(sender.conf['RECOMMEND_REBUILD_INTERVAL'], build_item_model.s(),
+                             name='rebuild item model')
+
+
+@celery.task
+def build_search_snapshot():
+    """重新生成搜索索引快照"""
+    path = current_app.config['SEARCH_SNAPSHOT_PATH']
+    if path:
+        snapshot.build_snapshot(path)
+
+
+def refresh_search_snapshot():
+    """索引改变后，配置了快照时异步重新生成"""
+    if current_app.config['SEARCH_SNAPSHOT_PATH']:
+        build_search_snapshot.delay()
 
 
 @celery.task(bind=True)
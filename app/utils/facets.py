@@ -0,0 +1,200 @@
+"""
+搜索结果分面
+============
+
+每个分类、标签与年份对应一个文章id的位图(Python int，第i位为1表示id为i的文章属于该分面)。
+多个过滤条件先在位图上求交集，得到的文章id集合在求posting list交集时作为初始候选，
+过滤在检索过程中完成，不会丢弃排好序的结果；
+各分面的数量由匹配文章的位图与各分面位图求交集后计数得到。
+
+位图常驻内存，索引版本号(app.utils.search_cache)改变后重新从数据库加载。
+"""
+
+import json
+from collections import namedtuple
+
+from app import db
+from app.models import Article, Category, Tag, belong_to
+from app.utils import search_cache
+
+
+def to_bitmap(ids):
+    """ 文章id集合转换为位图
+
+    Example:
+        >>> bin(to_bitmap([0, 3, 4]))
+        '0b11001'
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def from_bitmap(bitmap):
+    """ 位图转换为文章id集合
+
+    Example:
+        >>> sorted(from_bitmap(0b11001))
+        [0, 3, 4]
+    """
+    return {i for i, bit in enumerate(reversed(bin(bitmap)[2:])) if bit == '1'}
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+class Filters(namedtuple('Filters', ['category', 'tags', 'year_from', 'year_to'])):
+    """ 搜索的过滤条件，category为分类名，tags为标签名(同时满足)，年份区间包含两端 """
+
+    __slots__ = ()
+
+    def __new__(cls, category=None, tags=(), year_from=None, year_to=None):
+        return super().__new__(cls, category or None, tuple(sorted(set(tags))), year_from, year_to)
+
+    @classmethod
+    def from_args(cls, args):
+        """从请求参数读取：category, tag(可重复), year或year_from/year_to"""
+        year = args.get('year', type=int)
+        return cls(
+            category=args.get('category'),
+            tags=[tag for tag in args.getlist('tag') if tag],
+            year_from=args.get('year_from', year, type=int),
+            year_to=args.get('year_to', year, type=int),
+        )
+
+    @property
+    def active(self):
+        return any((self.category, self.tags, self.year_from, self.year_to))
+
+    def to_args(self):
+        """转换为url参数"""
+        args = {'category': self.category, 'tag': list(self.tags),
+                'year_from': self.year_from, 'year_to': self.year_to}
+        return {key: value for key, value in args.items() if value}
+
+    def selected(self, facet, value):
+        """value是否为已选中的分面"""
+        if facet == 'category':
+            return self.category == value
+        if facet == 'tag':
+            return value in self.tags
+        return self.year_from == self.year_to == value
+
+    def toggle(self, facet, value):
+        """ 选中或取消一个分面后的url参数
+
+        Example:
+            >>> Filters(tags=['redis']).toggle('tag', 'flask')
+            {'tag': ['flask', 'redis']}
+            >>> Filters(category='Program', year_from=2019, year_to=2019).toggle('year', 2019)
+            {'category': 'Program'}
+        """
+        selected = self.selected(facet, value)
+        if facet == 'category':
+            filters = self._replace(category=None if selected else value)
+        elif facet == 'tag':
+            tags = set(self.tags) ^ {value}
+            filters = self._replace(tags=tuple(sorted(tags)))
+        else:
+            year = None if selected else value
+            filters = self._replace(year_from=year, year_to=year)
+        return filters.to_args()
+
+    def key(self):
+        return json.dumps(self, ensure_ascii=False, separators=(',', ':'))
+
+
+class FacetIndex:
+    """ 各分面的文章位图
+
+    Example:
+        >>> facets = FacetIndex({'Program': to_bitmap([1, 2])}, {'redis': to_bitmap([2, 3])},
+        ...                     {2018: to_bitmap([1]), 2019: to_bitmap([2, 3])})
+        >>> sorted(from_bitmap(facets.bitmap(Filters(tags=['redis'], year_to=2019))))
+        [2, 3]
+        >>> facets.bitmap(Filters()) is None
+        True
+        >>> facets.counts([1, 2])['year']
+        [[2019, 1], [2018, 1]]
+    """
+
+    def __init__(self, categories, tags, years):
+        self.categories = categories
+        self.tags = tags
+        self.years = years
+
+    def bitmap(self, filters):
+        """ 满足过滤条件的文章位图，没有过滤条件时返回None """
+        if not filters.active:
+            return None
+        bitmaps = []
+        if filters.category:
+            bitmaps.append(self.categories.get(filters.category, 0))
+        for tag in filters.tags:
+            bitmaps.append(self.tags.get(tag, 0))
+        if filters.year_from or filters.year_to:
+            year_bitmap = 0
+            for year, bitmap in self.years.items():
+                if (filters.year_from or year) <= year <= (filters.year_to or year):
+                    year_bitmap |= bitmap
+            bitmaps.append(year_bitmap)
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result &= bitmap
+        return result
+
+    def counts(self, article_ids):
+        """ 各分面中的文章数量
+        Returns:
+            {'category': [[name, count], ...], 'tag': [...], 'year': [...]}，
+            只包含数量大于0的分面，分类与标签按数量从多到少排列，年份从近到远排列
+        """
+        matched = to_bitmap(article_ids)
+
+        def count(bitmaps):
+            counts = ([name, popcount(bitmap & matched)] for name, bitmap in bitmaps.items())
+            return [item for item in counts if item[1]]
+
+        return {
+            'category': sorted(count(self.categories), key=lambda item: (-item[1], item[0])),
+            'tag': sorted(count(self.tags), key=lambda item: (-item[1], item[0])),
+            'year': sorted(count(self.years), reverse=True),
+        }
+
+    @classmethod
+    def load(cls):
+        categories, years = {}, {}
+        rows = db.session.query(Article.id, Category.name, Article.timestamp) \
+            .outerjoin(Category, Article.category_id == Category.id) \
+            .order_by(None)
+        for article_id, category, timestamp in rows:
+            if category is not None:
+                categories.setdefault(category, []).append(article_id)
+            if timestamp is not None:
+                years.setdefault(timestamp.year, []).append(article_id)
+
+        tags = {}
+        rows = db.session.query(Tag.name, belong_to.c.article_id) \
+            .join(belong_to, Tag.id == belong_to.c.tag_id) \
+            .order_by(None)
+        for tag, article_id in rows:
+            tags.setdefault(tag, []).append(article_id)
+
+        return cls(
+            {name: to_bitmap(ids) for name, ids in categories.items()},
+            {name: to_bitmap(ids) for name, ids in tags.items()},
+            {year: to_bitmap(ids) for year, ids in years.items()},
+        )
+
+
+facet_index = search_cache.GenerationCache(FacetIndex.load)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,186 @@
+"""
+批量建立索引
+============
+
+用于`flask build index`，为所有尚未建立索引的文章建立索引：
+
+1. 分词结果优先从app.utils.token_cache读取，未命中的文章在multiprocessing进程池中分词，
+   每个进程只加载一次jieba词典，分词结果写回缓存
+2. 每处理RUN_SIZE篇文章，将得到的posting按(word_id, article_id)排序后写入临时文件(一个有序段)
+3. 所有文章处理完后多路归并各有序段，按主键顺序以多行INSERT写入，
+   词的文档频率、文章与语料统计同样批量更新，整个过程只提交一次
+
+所有文章写入同一个新的索引段。
+"""
+
+import heapq
+import pickle
+import tempfile
+import multiprocessing
+from collections import Counter
+
+from flask import current_app
+
+from app import db
+from app.models import (Article, Category, Tag, belong_to, Words, Posting,
+                        ArticleStats, CorpusStats, Segment, chunked, bulk_insert)
+from app.utils import search_cache, token_cache
+from app.utils.analyzer import analyze
+from app.utils.postings import encode_positions
+from app.utils.tokenizer import init_tokenizer
+
+
+RUN_SIZE = 500  # 每个有序段包含的文章数
+INSERT_SIZE = 5000  # 每次批量写入的posting数
+
+
+def _init_worker(cache_dir):
+    init_tokenizer(cache_dir, role='indexer-worker')
+
+
+def _analyze(item):
+    """在子进程中分词"""
+    key, fields = item
+    return key, analyze(fields)
+
+
+def _encode(article_id, analysis):
+    """编码位置列表与正文字符区间"""
+    terms, length, spans = analysis
+    body_position, body_spans = spans['body']
+    terms = {
+        word: (len(locations), weight, encode_positions(locations))
+        for word, (weight, locations) in terms.items()
+    }
+    offsets = encode_positions([offset for span in body_spans for offset in span])
+    return article_id, terms, length, body_position, offsets
+
+
+def _unindexed_articles():
+    """依次返回尚未建立索引的文章的(id, fields)，标签用一次查询读取"""
+    rows = db.session.query(Article.id, Article.title, Category.name, Article.body) \
+        .outerjoin(Category, Article.category_id == Category.id) \
+        .outerjoin(ArticleStats, ArticleStats.article_id == Article.id) \
+        .filter(ArticleStats.article_id.is_(None)) \
+        .order_by(Article.id) \
+        .all()
+    tags = {}
+    for article_id, name in db.session.query(belong_to.c.article_id, Tag.name) \
+            .join(Tag, Tag.id == belong_to.c.tag_id):
+        tags.setdefault(article_id, []).append(name)
+    for article_id, title, category, body in rows:
+        yield article_id, Article.index_fields(title, category or '', tags.get(article_id, []), body or '')
+
+
+def _write_run(rows):
+    """将排好序的posting写入临时文件"""
+    run = tempfile.TemporaryFile()
+    for row in sorted(rows):
+        pickle.dump(row, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            run.close()
+            return
+
+
+def build_index(workers=None, progress=None):
+    """ 为所有尚未建立索引的文章建立索引
+    Args:
+        workers: 分词的进程数，默认为CPU核数，为1时在当前进程中分词
+        progress: progress(done, total)，每处理完一批文章后调用
+    Returns:
+        建立索引的文章数
+    """
+    items = list(_unindexed_articles())
+    total = len(items)
+    if not total:
+        return 0
+
+    segment = Segment(size=total, doc_count=total)
+    db.session.add(segment)
+    db.session.flush()
+
+    runs = []
+    batch = []
+    df = Counter()
+    stats = []
+    total_length = 0.0
+
+    def flush(batch):
+        """为一批文章分配词id并写入一个有序段"""
+        word_ids = Words.get_ids({word for _, terms, *_ in batch for word in terms})
+        rows = []
+        for article_id, terms, length, body_position, offsets in batch:
+            for word, (frequency, weight, positions) in terms.items():
+                rows.append((word_ids[word], article_id, segment.id, frequency, weight, positions))
+            df.update(word_ids[word] for word in terms)
+            stats.append({
+                'article_id': article_id, 'segment_id': segment.id, 'length': length,
+                'body_position': body_position, 'offsets': offsets,
+            })
+        runs.append(_write_run(rows))
+
+    def analyses():
+        """依次返回(article_id, analysis)，缓存未命中的文章在进程池中分词"""
+        keys = {article_id: token_cache.cache_key(fields) for article_id, fields in items}
+        cached = token_cache.get_many(set(keys.values()))
+        missing = {}
+        for article_id, fields in items:
+            if keys[article_id] in cached:
+                yield article_id, cached[keys[article_id]]
+            else:
+                missing.setdefault(keys[article_id], (fields, []))[1].append(article_id)
+        if not missing:
+            return
+
+        tasks = [(key, fields) for key, (fields, _) in missing.items()]
+        pool = None
+        if workers != 1:
+            pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                        initargs=(current_app.config['JIEBA_CACHE_DIR'],))
+            results = pool.imap_unordered(_analyze, tasks, chunksize=8)
+        else:
+            results = map(_analyze, tasks)
+        try:
+            for key, analysis in results:
+                token_cache.set_many({key: analysis})
+                for article_id in missing[key][1]:
+                    yield article_id, analysis
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    for done, (article_id, analysis) in enumerate(analyses(), 1):
+        result = _encode(article_id, analysis)
+        batch.append(result)
+        total_length += result[2]
+        if len(batch) >= RUN_SIZE or done == total:
+            flush(batch)
+            batch = []
+            if progress is not None:
+                progress(done, total)
+
+    columns = ('word_id', 'article_id', 'segment_id', 'frequency', 'weight', 'positions')
+    merged = (dict(zip(columns, row)) for row in heapq.merge(*map(_read_run, runs)))
+    for chunk in chunked(merged, INSERT_SIZE):
+        Posting.bulk_insert(chunk)
+
+    by_delta = {}
+    for word_id, count in df.items():
+        by_delta.setdefault(count, []).append(word_id)
+    for delta, word_ids in by_delta.items():
+        Words.update_df(word_ids, delta)
+    bulk_insert(ArticleStats.__table__, stats)
+    CorpusStats.update(total, total_length)
+    db.session.commit()
+    search_cache.bump_generation()
+    return total
+
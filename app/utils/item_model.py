@@ -0,0 +1,189 @@
+"""
+物品相似度模型
+==============
+
+基于物品的协同过滤(`app.utils.recommender`)中，与每篇文章最相似的文章(物品相似字典item_match)
+只与评分有关，预先计算后保存在Redis的散列ITEM_MATCH_KEY中，field为文章id，
+value为按相似度从大到小排列的(文章id, 相似度)，以uint32与float32编码(`app.utils.neighbours.pack`)。
+为用户推荐时只需读取该用户的评分与所评文章的相似文章，再做一次加权求和(`recommend`)。
+
+1. `build`读取所有评分计算整个模型(`app.utils.recommender.calculate_similar_items`)，
+   写入临时key后原子地替换ITEM_MATCH_KEY，同时将VERSION_KEY加1，
+   部署时(boot.sh)运行`flask build item-model`，之后由celery任务`app.tasks.build_item_model`定期执行；
+   模型还没有计算过时，请求推荐的接口持有BUILD_LOCK_KEY才提交任务(`acquire_build_lock`)
+2. 用户评分后(`article.rating`)由`app.tasks.update_item_model`调用`update`，
+   两篇文章的相似度只与同时评价过它们的用户有关，因此只重新计算被评分文章与其他文章的相似度：
+   读取评价过这篇文章的用户的所有评分，得到这篇文章的相似文章，
+   并修改之前或现在包含这篇文章的相似文章；读取与写入在WATCH ITEM_MATCH_KEY的事务中完成，
+   其他进程同时修改或`build`替换了模型时重新读取并合并
+3. 增量更新过的文章同时记录在PENDING_KEY中，`build`在读取评分前清空，替换模型后重新更新其中的文章，
+   计算期间的评分不会被旧的结果覆盖
+
+增量更新不改变版本号；截断后被挤出的文章不会再补回，由定期的`build`重新计算。
+
+每个用户的推荐结果缓存在USER_CACHE_KEY中(`cached_recommend`)，过期时间为RECOMMEND_CACHE_TTL，
+缓存中记录计算时模型的版本号，版本号改变后不再使用；用户评分后删除该用户的缓存(`invalidate`)。
+"""
+
+import json
+from collections import defaultdict
+
+import numpy as np
+from flask import current_app
+
+from app import db, redis, binary_redis, logger
+from app.models import Rating
+from app.utils import neighbours
+from app.utils.recommender import RatingMatrix, calculate_similar_items, get_recommended_items
+
+
+ITEM_MATCH_KEY = 'recommend:items'
+VERSION_KEY = 'recommend:version'
+USER_CACHE_KEY = 'recommend:user:{}'
+PENDING_KEY = 'recommend:pending'
+BUILD_LOCK_KEY = 'recommend:build:lock'
+PIPELINE_SIZE = 500  # build每条HSET包含的文章数
+
+ITEM_DTYPE = np.dtype([('id', '<u4'), ('score', '<f4')])
+
+
+def pack(similar):
+    """ 将[(article_id, similarity), ...]编码为bytes """
+    return neighbours.pack(similar, ITEM_DTYPE)
+
+
+def unpack(data):
+    """ pack的逆操作，data为None时返回[] """
+    return neighbours.unpack(data, ITEM_DTYPE)
+
+
+def version():
+    """ 当前模型的版本号，从未计算过时为0 """
+    return int(redis.get(VERSION_KEY) or 0)
+
+
+def acquire_build_lock():
+    """ 用SET NX EX占用BUILD_LOCK_KEY，RECOMMEND_BUILD_LOCK_TTL秒内只有第一次调用返回True """
+    return bool(redis.set(BUILD_LOCK_KEY, 1, nx=True, ex=current_app.config['RECOMMEND_BUILD_LOCK_TTL']))
+
+
+def load_item_prefs(user_ids=None):
+    """ 用一次查询读取评分
+    Args:
+        user_ids: 只读取这些用户的评分，为None时读取所有评分
+    Returns:
+        {article_id: {user_id: rating}}
+    """
+    query = db.session.query(Rating.article_id, Rating.user_id, Rating.value)
+    if user_ids is not None:
+        query = query.filter(Rating.user_id.in_(user_ids))
+    item_prefs = defaultdict(dict)
+    for article_id, user_id, value in query:
+        item_prefs[article_id][user_id] = value
+    return item_prefs
+
+
+def build():
+    """ 计算整个模型并替换之前的模型
+    Returns:
+        新的版本号
+    """
+    limit = current_app.config['RECOMMEND_SIMILAR_ITEMS']
+    binary_redis.delete(PENDING_KEY)
+    item_match = calculate_similar_items(load_item_prefs(), n=limit)
+    building = f'{ITEM_MATCH_KEY}:building'
+    pipe = binary_redis.pipeline(transaction=False)
+    pipe.delete(building)
+    pipe.execute()
+    lists = {article_id: [(other_id, score) for score, other_id in similar if score > 0]
+             for article_id, similar in item_match.items()}
+    neighbours.write_batches(pipe, building, lists, ITEM_DTYPE, PIPELINE_SIZE)
+
+    pipe = binary_redis.pipeline()
+    if lists:
+        pipe.rename(building, ITEM_MATCH_KEY)
+    else:
+        pipe.delete(ITEM_MATCH_KEY)
+    pipe.incr(VERSION_KEY)
+    pipe.smembers(PENDING_KEY)
+    pipe.delete(PENDING_KEY)
+    new_version, pending, _ = pipe.execute()[-3:]
+    # 读取评分之后增量更新过的文章，其结果已被替换，重新计算
+    for article_id in pending:
+        update(int(article_id))
+    logger.info(f'Item model v{new_version}: {len(lists)} articles, {len(pending)} updated during build')
+    return new_version
+
+
+def update(article_id):
+    """ 文章的评分改变后，更新它与其他文章的相似度 """
+    limit = current_app.config['RECOMMEND_SIMILAR_ITEMS']
+    raters = [user_id for user_id, in db.session.query(Rating.user_id).filter_by(article_id=article_id)]
+    matrix = RatingMatrix.build(load_item_prefs(raters)) if raters else None
+    similar = []
+    if matrix is not None and article_id in matrix.labels:
+        row = matrix.labels.index(article_id)
+        scores = matrix.similarities([row])[0]
+        similar = [(matrix.labels[other], float(scores[other])) for other in np.flatnonzero(scores > 0)
+                   if other != row]
+        similar.sort(key=lambda item: (item[1], item[0]), reverse=True)
+
+    def write(pipe):
+        before = unpack(pipe.hget(ITEM_MATCH_KEY, article_id))
+        changed = dict.fromkeys(other_id for other_id, _ in before)
+        changed.update(similar)
+        mapping = {}
+        others = list(changed)
+        if others:
+            for other_id, data in zip(others, pipe.hmget(ITEM_MATCH_KEY, others)):
+                mapping[other_id] = pack(neighbours.merge(unpack(data), article_id, changed[other_id], limit))
+        mapping[article_id] = pack(similar[:limit])
+        pipe.multi()
+        pipe.hset(ITEM_MATCH_KEY, mapping=mapping)
+        pipe.sadd(PENDING_KEY, article_id)
+
+    binary_redis.transaction(write, ITEM_MATCH_KEY)
+    logger.info(f'Item model: article {article_id}, {len(similar)} similar articles')
+
+
+def recommend(user_id, limit=5):
+    """ 为用户推荐的文章
+    Returns:
+        [(预测评分, article_id), ...]，从高到低排列
+    """
+    ratings = dict(db.session.query(Rating.article_id, Rating.value).filter_by(user_id=user_id))
+    if not ratings:
+        return []
+    article_ids = list(ratings)
+    item_match = {
+        article_id: [(score, other_id) for other_id, score in unpack(data)]
+        for article_id, data in zip(article_ids, binary_redis.hmget(ITEM_MATCH_KEY, article_ids))
+    }
+    return get_recommended_items({user_id: ratings}, item_match, user_id)[:limit]
+
+
+def cached_recommend(user_id):
+    """ 与recommend相同，结果缓存RECOMMEND_CACHE_TTL秒，模型版本号改变或用户评分后重新计算
+    Returns:
+        [(预测评分, article_id), ...]，最多RECOMMEND_ITEMS项
+    """
+    key = USER_CACHE_KEY.format(user_id)
+    current, data = redis.mget(VERSION_KEY, key)
+    current = int(current or 0)
+    if data:
+        cached = json.loads(data)
+        if cached['version'] == current:
+            return [(score, article_id) for score, article_id in cached['items']]
+    items = recommend(user_id, current_app.config['RECOMMEND_ITEMS'])
+    redis.set(key, json.dumps({'version': current, 'items': items}), ex=current_app.config['RECOMMEND_CACHE_TTL'])
+    return items
+
+
+def invalidate(user_id):
+    """ 删除用户的推荐结果缓存 """
+    redis.delete(USER_CACHE_KEY.format(user_id))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,205 @@
+"""
+近似相似文章(MinHash + LSH)
+===========================
+
+所有文章两两计算相似度的代价为O(n^2)，文章很多时先用LSH找出候选文章，
+只对候选文章计算精确的余弦相似度：
+
+1. 文章的shingle集合为其分词结果中的词(与相似度计算使用相同的分词)，
+   用NUM_PERM个哈希函数h(x) = (a * x + b) mod PRIME计算MinHash签名，
+   两篇文章签名中相同的项所占的比例是它们shingle集合Jaccard相似度的无偏估计
+2. 签名分为BANDS段，每段ROWS个值，任意一段完全相同的两篇文章互为候选，
+   Jaccard相似度为s的两篇文章成为候选的概率为1 - (1 - s^ROWS)^BANDS，
+   ROWS=2时s=0.3的文章对约99.6%成为候选，s=0.01的约0.6%
+3. 只对候选文章对计算`app.utils.tfidf.TfidfMatrix`中的余弦相似度，再按相似度排序
+
+`BandIndex`在进程中保存每段签名的桶，增量计算一篇文章的相似文章时(`app.utils.related.update`)，
+只需查找与它至少有一段相同的文章作为候选，不必与所有文章计算相似度。
+"""
+
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from app.utils.tfidf import TfidfMatrix
+
+
+NUM_PERM = 128
+BANDS = 64
+ROWS = NUM_PERM // BANDS
+PRIME = 4294967291  # 小于2^32的最大素数，a * x + b不会超过uint64
+SEED = 1
+
+
+_random = np.random.RandomState(SEED)
+_A = _random.randint(1, PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _random.randint(0, PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingle_hashes(shingles):
+    """ shingle的32位哈希值，与进程无关(不使用hash())
+
+    Example:
+        >>> shingle_hashes(['进程', '调度']).tolist()
+        [52063040, 709393193]
+    """
+    return np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype=np.uint64)
+
+
+def signature(shingles):
+    """ shingle集合的MinHash签名，长度为NUM_PERM，空集合的签名各项均为PRIME
+
+    Example:
+        >>> a = signature(['进程', '调度', '算法', '内存'])
+        >>> b = signature(['进程', '调度', '算法', '网络'])
+        >>> 0.4 < float(np.mean(a == b)) < 0.8
+        True
+    """
+    hashes = shingle_hashes(set(shingles))
+    if not len(hashes):
+        return np.full(NUM_PERM, PRIME, dtype=np.uint64)
+    return ((np.outer(hashes, _A) + _B) % PRIME).min(axis=0)
+
+
+def band_keys(signatures):
+    """ 每段签名的ROWS个值合并为一个uint64作为桶
+    Args:
+        signatures: shape为(文章数, NUM_PERM)的数组
+    Returns:
+        shape为(文章数, BANDS)的数组
+    """
+    bands = np.asarray(signatures, dtype=np.uint64).reshape(len(signatures), BANDS, ROWS)
+    keys = np.zeros((len(signatures), BANDS), dtype=np.uint64)
+    for row in range(ROWS):
+        keys = keys * np.uint64(PRIME) + bands[:, :, row]
+    return keys
+
+
+def candidate_pairs(signatures):
+    """ 至少有一段签名完全相同的文章对
+    Args:
+        signatures: shape为(文章数, NUM_PERM)的数组，第i行为第i篇文章的签名
+    Returns:
+        (rows, others)：两个等长的数组，每对只出现一次
+
+    Example:
+        >>> signatures = np.array([signature(['进程', '调度', '算法']),
+        ...                        signature(['网络', '协议']),
+        ...                        signature(['进程', '调度', '算法', '实现'])])
+        >>> [pair.tolist() for pair in candidate_pairs(signatures)]
+        [[0], [2]]
+    """
+    count = len(signatures)
+    keys = band_keys(signatures) if count else np.zeros((0, BANDS), dtype=np.uint64)
+    codes = []
+    for band in range(BANDS):
+        # 按桶排序后同一个桶中的文章相邻
+        buckets = keys[:, band]
+        order = np.argsort(buckets, kind='stable')
+        buckets = buckets[order]
+        distance = 1
+        while distance < count:
+            same = np.flatnonzero(buckets[:-distance] == buckets[distance:])
+            if not len(same):
+                break
+            codes.append(order[same] * count + order[same + distance])
+            distance += 1
+    if not codes:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    codes = np.concatenate(codes)
+    first, second = codes // count, codes % count
+    codes = np.unique(np.minimum(first, second) * count + np.maximum(first, second))
+    return codes // count, codes % count
+
+
+class BandIndex:
+    """ 增量维护的LSH桶
+
+    Example:
+        >>> bands = BandIndex.build({1: ['进程', '调度', '算法'], 2: ['网络', '协议'],
+        ...                          3: ['进程', '调度', '算法', '实现']})
+        >>> bands.candidates(1), bands.candidates(2)
+        ({3}, set())
+        >>> bands.remove(3)
+        >>> bands.candidates(1)
+        set()
+    """
+
+    def __init__(self):
+        self.buckets = [defaultdict(set) for _ in range(BANDS)]
+        self.keys = {}  # {article_id: 各段的桶}
+
+    @classmethod
+    def build(cls, shingles):
+        """ shingles: {article_id: 文章的shingle集合} """
+        index = cls()
+        for article_id, article_shingles in shingles.items():
+            index.add(article_id, article_shingles)
+        return index
+
+    def add(self, article_id, shingles):
+        """加入(或更新)一篇文章"""
+        self.remove(article_id)
+        keys = band_keys([signature(shingles)])[0].tolist()
+        for band, key in enumerate(keys):
+            self.buckets[band][key].add(article_id)
+        self.keys[article_id] = keys
+
+    def remove(self, article_id):
+        keys = self.keys.pop(article_id, None)
+        if keys is None:
+            return
+        for band, key in enumerate(keys):
+            bucket = self.buckets[band][key]
+            bucket.discard(article_id)
+            if not bucket:
+                del self.buckets[band][key]
+
+    def candidates(self, article_id):
+        """ 与文章至少有一段签名相同的其他文章 """
+        keys = self.keys.get(article_id)
+        if keys is None:
+            return set()
+        result = set().union(*(self.buckets[band][key] for band, key in enumerate(keys)))
+        result.discard(article_id)
+        return result
+
+
+def approximate_similar_articles(weights, k):
+    """ 与`app.utils.tfidf.similar_articles`相同，但只计算LSH找出的候选文章对的相似度
+    Args:
+        weights: {article_id: {word: weight}}
+        k: 每篇文章保留的数量
+    Returns:
+        {article_id: [(other_article_id, similarity), ...]}
+    """
+    ids = list(weights)
+    result = {article_id: [] for article_id in ids}
+    if not ids:
+        return result
+    matrix = TfidfMatrix.build([weights[article_id] for article_id in ids]).matrix
+    signatures = np.array([signature(weights[article_id]) for article_id in ids])
+    first, second = candidate_pairs(signatures)
+    scores = np.asarray(matrix[first].multiply(matrix[second]).sum(axis=1)).ravel()
+
+    # 每对文章在两篇文章中各出现一次，按文章、相似度从大到小排序后每篇取前k项
+    rows = np.concatenate([first, second])
+    others = np.concatenate([second, first])
+    scores = np.concatenate([scores, scores])
+    order = np.lexsort((-scores, rows))
+    rows, others, scores = rows[order], others[order], scores[order]
+    bounds = np.flatnonzero(np.diff(rows)) + 1
+    for begin, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(rows)]])):
+        if begin == end:
+            continue
+        result[ids[rows[begin]]] = [
+            (ids[other], float(score))
+            for other, score in zip(others[begin:end][:k], scores[begin:end][:k]) if score > 0
+        ]
+    return result
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
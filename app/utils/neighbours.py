@@ -0,0 +1,78 @@
+"""
+相似列表的存储
+==============
+
+相似文章(`app.utils.related`)与推荐模型(`app.utils.item_model`)都在Redis的散列中
+为每个id保存按相似度从大到小排列的[(id, 相似度), ...]，以numpy结构化数组紧凑编码，
+dtype由调用者决定(如相似度用float16或float32)。
+"""
+
+import numpy as np
+
+
+def pack(similar, dtype):
+    """ 将[(id, similarity), ...]编码为bytes
+
+    Example:
+        >>> dtype = np.dtype([('id', '<u4'), ('score', '<f2')])
+        >>> data = pack([(3, 0.75), (12, 0.125)], dtype)
+        >>> len(data)
+        12
+        >>> unpack(data, dtype)
+        [(3, 0.75), (12, 0.125)]
+    """
+    return np.array(similar, dtype=dtype).tobytes()
+
+
+def unpack(data, dtype):
+    """ pack的逆操作，data为None时返回[] """
+    if not data:
+        return []
+    return [(int(item_id), float(score)) for item_id, score in np.frombuffer(data, dtype=dtype)]
+
+
+def floor(similar, limit):
+    """ 截断后的列表中第limit项的相似度，不足limit项时为0
+
+    Example:
+        >>> floor([(3, 0.75), (12, 0.125)], 2), floor([(3, 0.75)], 2)
+        (0.125, 0)
+    """
+    return similar[limit - 1][1] if len(similar) >= limit else 0
+
+
+def merge(similar, item_id, score, limit):
+    """ 将item_id以相似度score加入(score为None时移除)，保持有序并截断
+
+    Example:
+        >>> merge([(3, 0.75), (12, 0.125)], 5, 0.5, 2)
+        [(3, 0.75), (5, 0.5)]
+        >>> merge([(3, 0.75), (12, 0.125)], 3, None, 2)
+        [(12, 0.125)]
+    """
+    similar = [(other_id, other_score) for other_id, other_score in similar if other_id != item_id]
+    if score is not None:
+        similar.append((item_id, score))
+        similar.sort(key=lambda item: item[1], reverse=True)
+    return similar[:limit]
+
+
+def write_batches(pipe, key, lists, dtype, batch_size, floors_key=None, limit=None):
+    """ 分批写入所有列表，每批合并为一条HSET并执行一次pipeline
+    Args:
+        pipe: 不使用事务的pipeline
+        lists: {id: [(other_id, similarity), ...]}
+        floors_key: 不为None时同时在该散列中写入各列表第limit项的相似度
+    """
+    items = list(lists.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        pipe.hset(key, mapping={item_id: pack(similar, dtype) for item_id, similar in batch})
+        if floors_key is not None:
+            pipe.hset(floors_key, mapping={item_id: floor(similar, limit) for item_id, similar in batch})
+        pipe.execute()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
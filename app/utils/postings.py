@@ -0,0 +1,80 @@
+"""
+Posting list 编码
+=================
+
+每个(词, 文章)只保存一条记录，词在文章中出现的位置列表先做差分(delta)，
+再以varint(LEB128)编码为bytes。位置递增且相邻位置差值通常很小，
+大多数位置只占用1个字节。
+
+Example:
+    >>> data = encode_positions([3, 10, 11, 300])
+    >>> data
+    b'\\x03\\x07\\x01\\xa1\\x02'
+    >>> decode_positions(data)
+    [3, 10, 11, 300]
+"""
+
+
+def encode_varint(value):
+    """将非负整数编码为varint
+
+    Example:
+        >>> encode_varint(1)
+        b'\\x01'
+        >>> encode_varint(300)
+        b'\\xac\\x02'
+    """
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def iter_varints(data):
+    """依次解码data中的varint"""
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+def encode_positions(positions):
+    """将递增的位置列表以delta+varint编码
+
+    Args:
+        positions: 递增的非负整数序列
+    Returns:
+        bytes
+    """
+    out = bytearray()
+    prev = 0
+    for position in positions:
+        out += encode_varint(position - prev)
+        prev = position
+    return bytes(out)
+
+
+def decode_positions(data):
+    """解码encode_positions的结果，返回位置列表
+
+    Example:
+        >>> decode_positions(b'')
+        []
+    """
+    positions = []
+    position = 0
+    for delta in iter_varints(data):
+        position += delta
+        positions.append(position)
+    return positions
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
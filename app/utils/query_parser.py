@@ -0,0 +1,128 @@
+"""
+查询解析
+========
+
+支持的语法：
+
+    进程 调度            所有词都需要出现
+    "进程 调度"          短语，词按顺序相邻出现
+    内存 NEAR/3 分页     两侧的词(或短语)相距不超过3个位置，顺序不限
+
+短语与NEAR中词的相对位置按`app.utils.analyzer.tokenize`的规则计算，
+与建立索引时保存的位置一致。
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from app.utils.analyzer import tokenize
+
+
+TOKEN_PATTERN = re.compile(r'"([^"]*)"|(?<!\S)NEAR/(\d+)(?!\S)|(\S+)', re.IGNORECASE)
+
+# terms: 需要出现的所有词，按查询中的顺序去重
+# phrases: [[(word, offset), ...], ...]，只保存含有两个以上词的短语
+# nears: [(left, right, k), ...]，left与right为[(word, offset), ...]
+ParsedQuery = namedtuple('ParsedQuery', ['terms', 'phrases', 'nears'])
+
+
+def parse(q):
+    """ 解析查询
+
+    Example:
+        >>> parse('内存 NEAR/2 分页').nears
+        [([('内存', 0)], [('分页', 0)], 2)]
+        >>> parse('"进程的调度"').phrases
+        [[('进程', 0), ('调度', 2)]]
+    """
+    items = []  # [(tokens, quoted) 或 int(k)]
+    for match in TOKEN_PATTERN.finditer(q):
+        phrase, near, text = match.groups()
+        if near is not None:
+            items.append(int(near))
+        else:
+            items.append((_phrase_tokens(phrase if phrase is not None else text),
+                          phrase is not None))
+
+    terms, phrases, nears = [], [], []
+    for i, item in enumerate(items):
+        if isinstance(item, int):
+            left = items[i - 1] if i > 0 else None
+            right = items[i + 1] if i + 1 < len(items) else None
+            if isinstance(left, tuple) and isinstance(right, tuple) and left[0] and right[0]:
+                nears.append((left[0], right[0], item))
+            continue
+        tokens, quoted = item
+        for word, _ in tokens:
+            if word not in terms:
+                terms.append(word)
+        if len(tokens) > 1 and (quoted or _is_near_operand(items, i)):
+            phrases.append(tokens)
+    return ParsedQuery(terms, phrases, nears)
+
+
+def _phrase_tokens(text):
+    """ 短语中的词与相对位置，长词切出的子词不参与位置匹配 """
+    tokens = []
+    for word, position in tokenize(text):
+        if tokens and tokens[-1][1] == position:
+            tokens[-1] = (word, position)  # 同一位置的最后一个词是完整的词
+        else:
+            tokens.append((word, position))
+    if tokens:
+        first = tokens[0][1]
+        tokens = [(word, position - first) for word, position in tokens]
+    return tokens
+
+
+def _is_near_operand(items, i):
+    return (i > 0 and isinstance(items[i - 1], int)) \
+        or (i + 1 < len(items) and isinstance(items[i + 1], int))
+
+
+def phrase_spans(tokens, positions):
+    """ 短语在一篇文章中出现的位置
+    Args:
+        tokens: [(word, offset), ...]
+        positions: {word: [position, ...]}
+    Returns:
+        排好序的短语开始位置列表，短语结束位置为开始位置加上最后一个词的offset
+
+    Example:
+        >>> phrase_spans([('a', 0), ('b', 2)], {'a': [1, 5, 9], 'b': [3, 8, 11]})
+        [1, 9]
+    """
+    starts = None
+    for word, offset in tokens:
+        word_starts = {position - offset for position in positions.get(word, ())}
+        starts = word_starts if starts is None else starts & word_starts
+        if not starts:
+            return []
+    return sorted(starts)
+
+
+def is_near(left_starts, left_length, right_starts, right_length, k):
+    """ 两组位置中是否存在间隔不超过k的一对
+    Args:
+        left_starts, right_starts: 排好序的开始位置
+        left_length, right_length: 结束位置与开始位置的差
+
+    Example:
+        >>> is_near([1, 20], 0, [5, 40], 1, 3)
+        False
+        >>> is_near([1, 20], 0, [5, 17], 1, 3)
+        True
+    """
+    for start in left_starts:
+        # right的开始位置满足 start - k - right_length <= right_start <= start + left_length + k
+        lo = bisect_left(right_starts, start - k - right_length)
+        hi = bisect_right(right_starts, start + left_length + k)
+        if lo < hi:
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -59,11 +59,17 @@ Example:
     >>> # 物品和其用户对其的评价
     ...
     >>> item_prefs = transform_prefs(person_prefs)
+
+物品很多时逐对比较的代价为O(物品数^2 * 用户数)，`RatingMatrix`将评价构造成稀疏矩阵，
+用几次矩阵乘法得到所有物品两两之间的sim_distance/sim_pearson，`calculate_similar_items`使用它计算。
 """
 
 from math import sqrt
 from collections import defaultdict
 
+import numpy as np
+from scipy import sparse
+
 person_prefs = {
     'Lisa Rose': {
         'Lady in the Water': 2.5,
@@ -274,6 +280,112 @@ def _get_recommended_items(prefs, person, similarity=sim_pearson):
     return rankings
 
 
+BLOCK_SIZE = 1024  # RatingMatrix每次计算的行数
+
+
+class RatingMatrix:
+    """ 评价字典对应的稀疏矩阵，每行一个用户(或物品)，每列一个物品(或用户)
+
+    第i、j两行共同评价过的列数、各自在这些列上的评分和与平方和、评分乘积和，
+    都可以由评分矩阵R与指示矩阵M(有评分的位置为1)的乘积得到，例如n = M * M.T，
+    sum1 = R * M.T，pSum = R * R.T，再按sim_distance/sim_pearson中的公式逐项计算。
+    评分为整数或0.5的倍数时各项的和都是精确的，结果与逐对计算完全相同。
+
+    Attributes:
+        labels: 第i行的用户名(或物品名)
+        ratings: scipy.sparse.csr_matrix，评分
+        rated: 与ratings形状相同，有评分的位置为1
+
+    Example:
+        >>> matrix = RatingMatrix.build(person_prefs)
+        >>> similarities = matrix.similarities(similarity=sim_pearson)
+        >>> all(similarities[i, j] == sim_pearson(person_prefs, p1, p2)
+        ...     for i, p1 in enumerate(matrix.labels) for j, p2 in enumerate(matrix.labels) if i != j)
+        True
+        >>> similarities = matrix.similarities()
+        >>> all(similarities[i, j] == sim_distance(person_prefs, p1, p2)
+        ...     for i, p1 in enumerate(matrix.labels) for j, p2 in enumerate(matrix.labels) if i != j)
+        True
+        >>> matrix.top_matches(n=2)['Toby'] == get_top_matche_persons(person_prefs, 'Toby', n=2, similarity=sim_distance)
+        True
+    """
+
+    def __init__(self, labels, ratings):
+        self.labels = labels
+        self.ratings = ratings
+        self.rated = ratings.copy()
+        self.rated.data = np.ones_like(self.rated.data)
+        self._squares = ratings.multiply(ratings).tocsr()
+
+    @classmethod
+    def build(cls, prefs):
+        """ prefs: {label: {column: rating}} """
+        labels = list(prefs)
+        columns = {}
+        indptr, indices, data = [0], [], []
+        for label in labels:
+            for column, rating in prefs[label].items():
+                indices.append(columns.setdefault(column, len(columns)))
+                data.append(rating)
+            indptr.append(len(indices))
+        ratings = sparse.csr_matrix((data, indices, indptr),
+                                    shape=(len(labels), len(columns)), dtype=np.float64)
+        return cls(labels, ratings)
+
+    def similarities(self, rows=None, similarity=sim_distance):
+        """ 第rows行与所有行的相似度
+        Args:
+            rows: 行号列表，为None时计算所有行
+            similarity: sim_distance或sim_pearson
+        Returns:
+            numpy数组，shape为(len(rows), 行数)，没有共同评价的为0
+        """
+        rows = slice(None) if rows is None else rows
+        ratings, rated, squares = self.ratings[rows], self.rated[rows], self._squares[rows]
+        n = (rated @ self.rated.T).toarray()
+        shared = n > 0
+        result = np.zeros(n.shape)
+        if similarity is sim_distance:
+            sum_of_squares = (squares @ self.rated.T + rated @ self._squares.T).toarray() \
+                - 2 * (ratings @ self.ratings.T).toarray()
+            result[shared] = 1 / (1 + np.sqrt(np.maximum(sum_of_squares[shared], 0)))
+        elif similarity is sim_pearson:
+            n = n[shared]
+            sum1 = (ratings @ self.rated.T).toarray()[shared]
+            sum2 = (rated @ self.ratings.T).toarray()[shared]
+            sum1Sq = (squares @ self.rated.T).toarray()[shared]
+            sum2Sq = (rated @ self._squares.T).toarray()[shared]
+            pSum = (ratings @ self.ratings.T).toarray()[shared]
+            num = pSum - sum1 * sum2 / n
+            den = np.sqrt(np.maximum((sum1Sq - sum1 ** 2 / n) * (sum2Sq - sum2 ** 2 / n), 0))
+            nonzero = den != 0
+            scores = np.zeros(len(num))
+            scores[nonzero] = num[nonzero] / den[nonzero]
+            result[shared] = scores
+        else:
+            raise ValueError(f'Unsupported similarity: {similarity!r}')
+        return result
+
+    def top_matches(self, n=10, similarity=sim_distance):
+        """ 与get_top_matche_persons相同的结果，按BLOCK_SIZE行分块计算
+        Returns:
+            {label: [(similarity, other_label), ...]}，相似度相同时按名称从大到小排列
+        """
+        count = len(self.labels)
+        # 各名称在排序后的位置，用于相似度相同时的排序
+        ranks = np.empty(count, dtype=np.int64)
+        ranks[sorted(range(count), key=self.labels.__getitem__)] = np.arange(count)
+        result = {}
+        for start in range(0, count, BLOCK_SIZE):
+            block = list(range(start, min(start + BLOCK_SIZE, count)))
+            scores = self.similarities(block, similarity=similarity)
+            for i, row in enumerate(block):
+                others = np.delete(np.arange(count), row)
+                order = np.lexsort((ranks[others], scores[i, others]))[::-1][:n]
+                result[self.labels[row]] = [(float(scores[i, others[j]]), self.labels[others[j]]) for j in order]
+        return result
+
+
 def calculate_similar_items(item_prefs, n=10):
     """
     Create a dictionary of items showing which other items they are
@@ -288,8 +400,9 @@ def calculate_similar_items(item_prefs, n=10):
 
     Example:
         >>> # Invert the preference matrix to be item-centric
+        >>> from pprint import pprint
         >>> item_prefs = transform_prefs(person_prefs)
-        >>> calculate_similar_items(item_prefs)
+        >>> pprint(calculate_similar_items(item_prefs))  # doctest: +NORMALIZE_WHITESPACE
         {'Just My Luck': [(0.3483314773547883, 'Lady in the Water'),
           (0.32037724101704074, 'You, Me and Dupree'),
           (0.2989350844248255, 'The Night Listener'),
@@ -321,15 +434,8 @@ def calculate_similar_items(item_prefs, n=10):
           (0.1918253663634734, 'Superman Returns'),
           (0.1886378647726465, 'Snakes on a Plane')]}
     """
-    result = {}
-    for c, item in enumerate(item_prefs.keys(), start=1):
-        # Status updates for large datasets
-        if c % 100 == 0:
-            print('%d / %d' % (c, len(item_prefs)))
-        # Find the most similar items to this one
-        scores = get_top_matche_persons(item_prefs, item, n=n, similarity=sim_distance)
-        result[item] = scores
-    return result
+    # Find the most similar items to each one with a few matrix products
+    return RatingMatrix.build(item_prefs).top_matches(n=n, similarity=sim_distance)
 
 
 def get_recommended_items(person_prefs, item_match, person):
@@ -344,7 +450,7 @@ def get_recommended_items(person_prefs, item_match, person):
         返回为person推荐的物品及其评分的列表
 
     Example:
-        >>> item_perfs = transform_prefs(person_prefs)
+        >>> item_prefs = transform_prefs(person_prefs)
         >>> item_match = calculate_similar_items(item_prefs)
         >>> get_recommended_items(person_prefs, item_match, 'Toby')
         [(3.1667425234070894, 'The Night Listener'), (2.9366294028444346, 'Just My Luck'), (2.868767392626467, 'Lady in the Water')]
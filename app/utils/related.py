@@ -0,0 +1,241 @@
+"""
+相似文章缓存
+============
+
+每篇文章最相似的SIMILAR_ARTICLES篇文章保存在Redis的散列RELATED_KEY中，
+field为文章id，value为按相似度从大到小排列的(文章id, 相似度)，
+以uint32与float16紧凑编码(`app.utils.neighbours.pack`)，每篇相似文章只占6字节，修改文章标题也不受影响。
+`similar_articles`读取并返回文章对象，文章页面与`/api/articles/<id>/similarities/`共用。
+
+`flask build similarity`一次计算所有文章(`app.utils.tfidf.similar_articles`)，
+多篇文章的相似文章合并为一条HSET，分批通过pipeline发送(`store`)；
+建立、重建或删除一篇文章的索引时，只计算这篇文章与其他文章的相似度(`update`、`remove`)：
+
+1. 进程内缓存所有文章的TF-IDF矩阵(`app.utils.tfidf.SimilarityIndex`)，
+   Redis中的SIMILARITY_KEYS记录每篇文章计算相似度时所用内容的分词缓存key，
+   其他进程修改过的文章，按key从分词结果缓存中读取后替换对应的行，不必重新读取所有文章；
+   文章数超过SIMILARITY_LSH_THRESHOLD时同时缓存LSH桶(`app.utils.minhash.BandIndex`)，
+   只计算与候选文章的相似度
+2. FLOORS_KEY记录每篇文章第SIMILAR_ARTICLES篇相似文章的相似度(不足时为0，key中包含SIMILAR_ARTICLES)，
+   只修改之前包含这篇文章(之前的相似度不低于其记录值)、或者新的相似度高于其记录值的文章，
+   每篇文章的相似文章都截断为最相似的SIMILAR_ARTICLES篇；
+   读取与写入在WATCH/MULTI事务中完成，多个worker同时修改同一篇文章的相似文章时不会丢失修改
+
+增量更新时idf保持不变，其他文章之间的相似度也不会重新计算，
+修改的文章数超过REWEIGH_RATIO后重新读取所有文章建立矩阵；
+截断后被挤出的文章不会再补回，需要时可以运行`flask build similarity`重新计算。
+
+之前以文章标题为key的有序集合可以用`flask build related-backfill`转换。
+"""
+
+import threading
+
+import numpy as np
+from flask import current_app
+
+from app import db, redis, binary_redis, logger
+from app.models import Article
+from app.utils import neighbours, token_cache
+from app.utils.tfidf import SimilarityIndex
+from app.utils.minhash import BandIndex
+
+
+RELATED_KEY = 'related:articles'
+SIMILARITY_KEYS = 'similarity:keys'
+FLOORS_KEY = 'related:floors:{}'
+PIPELINE_SIZE = 500  # store每条HSET包含的文章数
+REWEIGH_RATIO = 0.1  # 建立矩阵后修改的文章数超过该比例时重新建立
+
+RELATED_DTYPE = np.dtype([('id', '<u4'), ('score', '<f2')])
+
+_index = None
+_lock = threading.Lock()
+
+
+def _load_index():
+    """读取所有文章，建立新的相似度索引"""
+    articles = Article.query.all()
+    fields = [article.fields for article in articles]
+    weights = [Article.weights_of(analysis) for analysis in token_cache.analyze_many(fields)]
+    keys = {article.id: token_cache.cache_key(f) for article, f in zip(articles, fields)}
+    weights = dict(zip(keys, weights))
+    # 文章很多时用LSH找出候选文章，与`flask build similarity`相同
+    bands = BandIndex.build(weights) if len(articles) > current_app.config['SIMILARITY_LSH_THRESHOLD'] else None
+    return SimilarityIndex.build(weights, keys, bands)
+
+
+def _sync_index():
+    """ 返回进程内缓存的相似度索引，按SIMILARITY_KEYS更新其他进程修改过的文章 """
+    global _index
+    keys = {int(article_id): key for article_id, key in redis.hgetall(SIMILARITY_KEYS).items()}
+    if _index is None or not keys or _index.tfidf.changed > REWEIGH_RATIO * max(len(_index.ids), 1):
+        _index = _load_index()
+        if _index.keys:
+            redis.hset(SIMILARITY_KEYS, mapping=_index.keys)
+        return _index
+
+    for article_id in set(_index.keys) - keys.keys():
+        _index.remove(article_id)
+    changed = {article_id: key for article_id, key in keys.items() if _index.keys.get(article_id) != key}
+    if changed:
+        cached = token_cache.get_many(list(changed.values()))
+        for article_id, key in changed.items():
+            analysis = cached.get(key)
+            if analysis is None:
+                article = Article.query.get(article_id)
+                if article is None:
+                    continue
+                analysis = token_cache.analyze(article.fields)
+            _index.update(article_id, Article.weights_of(analysis), key)
+    return _index
+
+
+def pack(similar):
+    """ 将[(article_id, similarity), ...]编码为bytes，每篇相似文章6字节 """
+    return neighbours.pack(similar, RELATED_DTYPE)
+
+
+def unpack(data):
+    """ pack的逆操作，data为None时返回[] """
+    return neighbours.unpack(data, RELATED_DTYPE)
+
+
+def get(article_id, limit=None):
+    """ 文章的相似文章[(article_id, similarity), ...] """
+    return unpack(binary_redis.hget(RELATED_KEY, article_id))[:limit]
+
+
+def similar_articles(article_id, limit=5):
+    """ 文章的相似文章[(Article, similarity), ...]，用一次查询读取文章 """
+    similar = get(article_id, limit)
+    articles = {article.id: article for article in
+                Article.query.filter(Article.id.in_([other_id for other_id, _ in similar]))} if similar else {}
+    return [(articles[other_id], score) for other_id, score in similar if other_id in articles]
+
+
+def _changed_neighbours(before, after, floors):
+    """ 相似度改变后需要修改的文章
+    Args:
+        before: {other_id: score}，之前的相似度
+        after: {other_id: score}，现在的相似度，文章删除时为{}
+        floors: {other_id: floor}，其他文章第SIMILAR_ARTICLES篇的相似度，没有记录时为0
+    Returns:
+        {other_id: score}，score为None时从other_id的相似文章中移除
+    """
+    return {
+        other_id: after.get(other_id)
+        for other_id, other_floor in floors.items()
+        if before.get(other_id, 0) >= other_floor or after.get(other_id, 0) > other_floor
+    }
+
+
+def _write_neighbours(article_id, before, similar, key):
+    """ 写入文章自身的相似文章，并修改其他文章的相似文章中article_id的相似度
+
+    读取、合并与写入在一个事务中完成：WATCH相似文章与记录值的散列，
+    提交前其他进程修改过时重新读取并合并，不会覆盖其他进程的修改。
+    Args:
+        before: {other_id: score}，修改前的相似度
+        similar: 文章现在的相似文章，为None时删除文章
+        key: 文章内容的分词缓存key
+    """
+    limit = current_app.config['SIMILAR_ARTICLES']
+    floors_key = FLOORS_KEY.format(limit)
+    after = dict(similar or [])
+    others = list(before.keys() | after.keys())
+
+    def write(pipe):
+        floors = dict(zip(others, (float(value or 0) for value in pipe.hmget(floors_key, others)))) if others else {}
+        changed = _changed_neighbours(before, after, floors)
+        lists = {}
+        if changed:
+            for other_id, data in zip(changed, pipe.hmget(RELATED_KEY, list(changed))):
+                lists[other_id] = neighbours.merge(unpack(data), article_id, changed[other_id], limit)
+        pipe.multi()
+        if similar is None:
+            pipe.hdel(RELATED_KEY, article_id)
+            pipe.hdel(floors_key, article_id)
+            pipe.hdel(SIMILARITY_KEYS, article_id)
+        else:
+            lists[article_id] = similar[:limit]
+            pipe.hset(SIMILARITY_KEYS, article_id, key)
+        if lists:
+            pipe.hset(RELATED_KEY, mapping={other_id: pack(other) for other_id, other in lists.items()})
+            pipe.hset(floors_key, mapping={other_id: neighbours.floor(other, limit) for other_id, other in lists.items()})
+
+    binary_redis.transaction(write, RELATED_KEY, floors_key)
+
+
+def update(article):
+    """ 文章内容改变后，更新它与其他文章的相似度 """
+    fields = article.fields
+    key = token_cache.cache_key(fields)
+    weights = Article.weights_of(token_cache.analyze(fields))
+    with _lock:
+        index = _sync_index()
+        before = dict(index.similar(article.id))
+        index.update(article.id, weights, key)
+        similar = index.similar(article.id)
+
+    _write_neighbours(article.id, before, similar, key)
+    logger.info(f'Cache: {article.title}, {len(similar)} similar articles')
+
+
+def remove(article):
+    """ 文章删除后，从其他文章的相似文章中移除 """
+    with _lock:
+        index = _sync_index()
+        similar = index.similar(article.id)
+        index.remove(article.id)
+
+    _write_neighbours(article.id, dict(similar), None, None)
+    logger.info(f'Delete Cache: {article.title}')
+
+
+def store(lists, keys=None, client=None, key=RELATED_KEY, floors_key=None):
+    """ 批量写入所有文章的相似文章，替换之前的结果
+    Args:
+        lists: {article_id: [(other_article_id, similarity), ...]}，每篇最多SIMILAR_ARTICLES篇
+        keys: {article_id: key}，计算相似度时各文章内容的分词缓存key，为None时不更新
+        client: 不解码返回值的Redis连接，默认为app.binary_redis
+        key: 保存相似文章的散列
+        floors_key: 保存各文章第SIMILAR_ARTICLES篇相似度的散列，默认为FLOORS_KEY
+    """
+    client = client or binary_redis
+    limit = current_app.config['SIMILAR_ARTICLES']
+    floors_key = floors_key or FLOORS_KEY.format(limit)
+    pipe = client.pipeline(transaction=False)
+    if keys is not None:
+        pipe.delete(SIMILARITY_KEYS)
+        if keys:
+            pipe.hset(SIMILARITY_KEYS, mapping=keys)
+    pipe.delete(key, floors_key)
+    pipe.execute()
+    neighbours.write_batches(pipe, key, lists, RELATED_DTYPE, PIPELINE_SIZE, floors_key, limit)
+
+
+def backfill():
+    """ 将以文章标题为key的有序集合转换为RELATED_KEY中的记录，并删除有序集合
+    Returns:
+        转换的文章数
+    """
+    ids = {title: article_id for article_id, title in db.session.query(Article.id, Article.title)}
+    lists = {}
+    for title, article_id in ids.items():
+        similar = redis.zrevrange(title, 0, -1, withscores=True)
+        if similar:
+            lists[article_id] = [(ids[other], score) for other, score in similar if other in ids]
+    if lists:
+        pipe = binary_redis.pipeline(transaction=False)
+        limit = current_app.config['SIMILAR_ARTICLES']
+        neighbours.write_batches(pipe, RELATED_KEY, lists, RELATED_DTYPE, PIPELINE_SIZE, FLOORS_KEY.format(limit), limit)
+        for title, article_id in ids.items():
+            if article_id in lists:
+                pipe.delete(title)
+        pipe.execute()
+    return len(lists)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,152 @@
+"""
+查询结果缓存
+============
+
+查询结果以索引版本号(generation)、规范化后的查询及分页参数为key，
+先查进程内的LRU缓存，再查Redis，都未命中时才进行分词和查询。
+
+建立、重建或删除索引时版本号加1，之前版本的缓存不会再被命中，
+Redis中的旧缓存过期后自动清除，进程内的旧缓存由LRU淘汰。
+Redis不可用时不使用缓存，以免返回过期的结果。
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+from redis.exceptions import RedisError
+
+from app import redis, logger
+
+
+GENERATION_KEY = 'search:generation'
+CACHE_TIMEOUT = 60 * 60  # Redis中缓存的过期时间(秒)
+LOCAL_CACHE_SIZE = 1024  # 进程内缓存的条目数
+
+
+class LRUCache:
+    """线程安全的LRU缓存
+
+    Example:
+        >>> cache = LRUCache(2)
+        >>> cache.set('a', 1)
+        >>> cache.set('b', 2)
+        >>> cache.get('a')
+        1
+        >>> cache.set('c', 3)
+        >>> cache.get('b') is None
+        True
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LRUCache(LOCAL_CACHE_SIZE)
+
+
+def normalize(q):
+    """ 规范化查询：转为小写并合并空白
+
+    Example:
+        >>> normalize('  Redis   进程 ')
+        'redis 进程'
+    """
+    return ' '.join(q.lower().split())
+
+
+def get_generation():
+    """ 返回当前的索引版本号，Redis不可用时返回None """
+    try:
+        return int(redis.get(GENERATION_KEY) or 0)
+    except RedisError as exc:
+        logger.warning(f'Search cache is disabled: {exc}')
+        return None
+
+
+def bump_generation():
+    """ 索引改变后调用，使之前的查询缓存全部失效 """
+    try:
+        redis.incr(GENERATION_KEY)
+    except RedisError as exc:
+        logger.warning(f'Failed to bump search generation: {exc}')
+
+
+class GenerationCache:
+    """ 常驻内存的数据(词典、facet等)，索引版本号改变后调用load()重新加载，
+    Redis不可用时沿用已加载的数据
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._loaded = (None, None)  # (generation, value)
+        self._lock = threading.Lock()
+
+    def get(self):
+        generation = get_generation()
+        loaded_generation, value = self._loaded
+        if value is not None and (generation is None or generation == loaded_generation):
+            return value
+        with self._lock:
+            loaded_generation, value = self._loaded
+            if value is None or (generation is not None and generation != loaded_generation):
+                value = self._load()
+                self._loaded = (generation, value)
+            return value
+
+
+def cached(q, limit, offset, compute, filters=None):
+    """ 返回查询结果，优先使用缓存
+    Args:
+        q: 查询
+        limit, offset: 分页参数
+        compute: compute(q, limit, offset, filters)，缓存未命中时计算查询结果，
+            返回值为(ranked, ...)，需要可以json序列化
+        filters: app.utils.facets.Filters，为None时不过滤
+    """
+    q = normalize(q)
+    generation = get_generation()
+    if generation is None:
+        return compute(q, limit, offset, filters)
+
+    filters_key = filters.key() if filters is not None else ''
+    key = f'search:{generation}:{offset}:{limit}:{filters_key}:{q}'
+    result = local_cache.get(key)
+    if result is not None:
+        return result
+
+    try:
+        value = redis.get(key)
+    except RedisError:
+        value = None
+    if value is not None:
+        ranked, *rest = json.loads(value)
+        result = ([tuple(item) for item in ranked], *rest)
+    else:
+        result = compute(q, limit, offset, filters)
+        try:
+            redis.set(key, json.dumps(result), ex=CACHE_TIMEOUT)
+        except RedisError as exc:
+            logger.warning(f'Failed to cache search result: {exc}')
+    local_cache.set(key, result)
+    return result
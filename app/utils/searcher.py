@@ -1,156 +1,309 @@
-import jieba
-from collections import defaultdict
+import math
+import heapq
+
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy.orm import joinedload, defer
 
 from app import db, create_app
-from app.models import Words, Article
-
-
-def build_query(word_values):
-    """ 构造查询字符串
-    假设word_values为一个单词，单词id为10
-    则fullquery为：
-        select w0.article_id, w0.location
-        from wordlocation w0
-        where w0.word_id=10
-
-    假设word_values为两个单词，单词id分别为10和17
-    则fullquery为：
-        select w0.article_id, w0.location, w1.location
-        from wordlocation w0, wordlocation w1
-        where w0.word_id=10
-              and w0.article_id=w1.article_id
-              and w1.word_id=17
-    即返回同时含有这两个单词的titleid
-    """
-    fieldlist = 'w0.article_id'
-    tablelist = ''
-    clauselist = ''
-    wordids = []
-
-    table_number = 0
-
-    for word_value in word_values:
-        word = Words.query.filter_by(value=word_value).first()
-        if word is not None:
-            word_id = word.id
-            wordids.append(word_id)
-            if table_number > 0:
-                tablelist += ','
-                clauselist += ' and w%d.article_id=w%d.article_id and ' % (table_number - 1, table_number)
-            fieldlist += ',w%d.location' % table_number
-            tablelist += 'wordlocation w%d' % table_number
-            clauselist += 'w%d.word_id=%d' % (table_number, word_id)
-            table_number += 1
-
-    # 根据各个组分，建立查询
-    fullquery = 'select %s from %s where %s' % (fieldlist, tablelist, clauselist)
-    # print(fullquery)
-    return fullquery, wordids
-
-
-def get_match_rows(query):
-    """
-    Returns:
-        rows: [(article_id, word1location, word2location, ...), ....]
-        wordids: [word_id_1, word_id_2, ...]
-    """
-    # 拆分查询关键词
-    word_values = [value.lower() for value in jieba.cut(query) if not Words._should_ignore(value)]
-    # print(word_values)
+from app.utils import search_cache, snapshot, facets
+from app.utils.postings import decode_positions
+from app.utils.query_parser import parse, phrase_spans, is_near
+from app.models import Words, Posting, Tombstone, Article, ArticleStats, CorpusStats
 
-    # 构造查询的字符串
-    fullquery, wordids = build_query(word_values)
-    if len(wordids) > 0:
-        cur = db.session.execute(fullquery).cursor
 
-        articleid_locations = [row for row in cur]
+# 候选文章数量不超过该值时，读取posting list时使用`article_id IN (...)`过滤
+MAX_CANDIDATES_IN_QUERY = 500
 
-        # print(wordids)
-        # print(articleid_locations[:10])
-        return articleid_locations, wordids
-    else:
-        return None, None
+# BM25参数
+K1 = 1.2
+B = 0.75
 
 
-def normalize_scores(scores, smallIsBetter=False):
-    """
-    scores为一个包含title_id与对应评价值的字典，
-    函数根据smallIsBetter是否，返回一个带有相同ID，
-    而评价值介于0和1之间的新字典(最佳结果的对应值为1)
+class SqlIndex:
+    """ 直接查询数据库中的索引，接口与app.utils.snapshot.SnapshotIndex相同
+    posting分布在多个索引段中，读取时跳过墓碑对应的posting，每篇文章只有一个有效的版本
     """
-    vsmall = 0.00001  # 避免被零整除
-    if smallIsBetter:
-        minscore = min(scores.values())
+
+    def __init__(self):
+        self._tombstones = None
+
+    @property
+    def tombstones(self):
+        """墓碑数量很少(由后台任务定期清理)，每次查询只读取一次"""
+        if self._tombstones is None:
+            self._tombstones = Tombstone.all()
+        return self._tombstones
+
+    def _live(self, query):
+        """跳过墓碑对应的行，query的前两列为article_id与segment_id"""
+        tombstones = self.tombstones
+        if not tombstones:
+            return query
+        return (row for row in query if (row[1], row[0]) not in tombstones)
+
+    def lookup(self, values):
+        """ 查找词
+        Returns:
+            {value: (word_id, df)}，不存在的词被忽略
+        """
         return {
-            u: float(minscore) / max(vsmall, l) for u, l in scores.items()
+            value: (word_id, df) for value, word_id, df in
+            db.session.query(Words.value, Words.id, Words.df).filter(Words.value.in_(set(values)))
         }
-    else:
-        maxscore = max(scores.values())
-        if maxscore == 0:
-            maxscore = vsmall
+
+    def posting_list(self, word_id, article_ids=None):
+        """ 读取一个词的posting list
+        Args:
+            word_id: 词id
+            article_ids: 候选文章id集合，不为None时只读取这些文章的posting
+        Returns:
+            {article_id: weight}，weight为按字段加权的词频
+        """
+        query = db.session.query(Posting.article_id, Posting.segment_id, Posting.weight) \
+            .filter(Posting.word_id == word_id)
+        if article_ids is not None:
+            query = query.filter(Posting.article_id.in_(article_ids))
+        return {article_id: weight for article_id, _, weight in self._live(query)}
+
+    def positions(self, word_id, article_ids=None):
+        """ 读取一个词在文章中出现的位置
+        Returns:
+            {article_id: [position, ...]}
+        """
+        query = db.session.query(Posting.article_id, Posting.segment_id, Posting.positions) \
+            .filter(Posting.word_id == word_id)
+        if article_ids is not None and len(article_ids) <= MAX_CANDIDATES_IN_QUERY:
+            query = query.filter(Posting.article_id.in_(article_ids))
         return {
-            u: float(c) / maxscore for u, c in scores.items()
+            article_id: decode_positions(positions) for article_id, _, positions in self._live(query)
+            if article_ids is None or article_id in article_ids
         }
 
+    def corpus(self):
+        """ Returns: (doc_count, avg_length) """
+        corpus = CorpusStats.get()
+        return corpus.doc_count, corpus.avg_length
 
-def frequency_score(rows):
-    """
-    根据词频对每个网页进行打分，词频越大分值越高
+    def lengths(self, article_ids):
+        """ Returns: {article_id: length} """
+        return ArticleStats.lengths(article_ids)
+
+
+def get_index():
+    """ 返回查询使用的索引
+    配置了SEARCH_SNAPSHOT_PATH且快照文件存在时使用内存映射的快照，否则直接查询数据库
     """
-    counts = defaultdict(int)
-    for row in rows:
-        counts[row[0]] += 1
-    return normalize_scores(counts)
+    path = current_app.config.get('SEARCH_SNAPSHOT_PATH')
+    if path:
+        index = snapshot.load(path)
+        if index is not None:
+            return index
+    return SqlIndex()
 
 
-def location_score(rows):
+def get_query_words(q, index):
+    """ 对查询进行分词
+    Returns:
+        [(word_id, df), ...]，按查询中的顺序去重，不存在的词被忽略
     """
-    根据词在网页中出现的位置对网页进行打分，越靠前分值越高
+    return lookup_words(parse(q).terms, index)
+
+
+def lookup_words(values, index):
+    if not values:
+        return []
+    found = index.lookup(values)
+    return [found[value] for value in values if value in found]
+
+
+def get_matches(words, index, allowed=None):
+    """ 找出同时含有所有词的文章
+    按文档频率从小到大依次读取每个词的posting list，并与已有的候选文章求交集，
+    候选集合为空时立即返回，后续的词不再读取
+    Args:
+        words: [(word_id, df), ...]
+        allowed: 满足过滤条件的文章id集合，作为初始的候选文章，为None时不过滤
+    Returns:
+        {article_id: [word1_weight, word2_weight, ...]}，顺序与words一致
     """
-    locations = {row[0]: 100000 for row in rows}
-    for row in rows:
-        loc = sum(row[1:])
-        if loc < locations[row[0]]:
-            locations[row[0]] = loc
-    return normalize_scores(locations, smallIsBetter=True)
+    if not words or any(df <= 0 for _, df in words) or allowed == set():
+        return {}
+
+    postings = {}
+    candidates = allowed
+    for word_id, _ in sorted(words, key=lambda word: word[1]):
+        restrict = None
+        if candidates is not None and len(candidates) <= MAX_CANDIDATES_IN_QUERY:
+            restrict = candidates
+        posting_list = index.posting_list(word_id, restrict)
+        postings[word_id] = posting_list
+        if candidates is None:
+            candidates = set(posting_list)
+        else:
+            candidates &= posting_list.keys()
+        if not candidates:
+            return {}
 
+    return {
+        article_id: [postings[word_id][article_id] for word_id, _ in words]
+        for article_id in candidates
+    }
 
-def distance_score(rows):
+
+def filter_positions(matches, parsed, index):
+    """ 只保留满足短语与NEAR条件的文章
+    位置只对get_matches得到的候选文章读取，且只读取短语与NEAR中的词
+    Args:
+        matches: get_matches的返回值
+        parsed: ParsedQuery
     """
-    根据词与词之间的距离对网页进行打分，距离越小分值越高
+    if not matches or not (parsed.phrases or parsed.nears):
+        return matches
+    operands = parsed.phrases + [tokens for left, right, _ in parsed.nears for tokens in (left, right)]
+    values = {word for tokens in operands for word, _ in tokens}
+    found = index.lookup(values)
+    if len(found) < len(values):
+        return {}
+
+    candidates = set(matches)
+    positions = {}  # {word: {article_id: [position, ...]}}
+    for value in sorted(values, key=lambda value: found[value][1]):
+        positions[value] = index.positions(found[value][0], candidates)
+        candidates &= positions[value].keys()
+        if not candidates:
+            return {}
+
+    def spans(tokens, article_id):
+        return phrase_spans(tokens, {word: positions[word][article_id] for word, _ in tokens})
+
+    def accept(article_id):
+        for tokens in parsed.phrases:
+            if not spans(tokens, article_id):
+                return False
+        for left, right, k in parsed.nears:
+            if not is_near(spans(left, article_id), left[-1][1],
+                           spans(right, article_id), right[-1][1], k):
+                return False
+        return True
+
+    return {article_id: matches[article_id] for article_id in candidates if accept(article_id)}
+
+
+def idf(df, doc_count):
+    """ BM25的逆文档频率，始终为正
+
+    Example:
+        >>> round(idf(1, 10), 4)
+        1.9924
     """
-    # 如果仅有一个单词，则得分都一样
-    if len(rows[0]) <= 2:
-        return {row[0]: 1.0 for row in rows}
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
 
-    mindistance = {row[0]: 1000000 for row in rows}
 
-    for row in rows:
-        dist = sum([abs(row[i] - row[i - 1]) for i in range(2, len(row))])
-        if dist < mindistance[row[0]]:
-            mindistance[row[0]] = dist
-    return normalize_scores(mindistance, smallIsBetter=True)
+def bm25(idfs, weights, length, avg_length):
+    """ 一篇文章的BM25F得分
+    词频与文章长度已在建立索引时按字段加权，文档频率与平均长度从预先统计的表中读取，
+    因此不需要对本次查询的结果做归一化
+    """
+    norm = K1 * (1 - B + B * length / avg_length)
+    return sum(
+        word_idf * weight * (K1 + 1) / (weight + norm)
+        for word_idf, weight in zip(idfs, weights)
+    )
 
 
-def get_scored_list(rows, wordids):
-    total_scores = {row[0]: 0 for row in rows}
+def top_k(matches, words, k, index, batch_size=100):
+    """ 返回得分最高的k篇文章
 
-    # 此处是稍后放置评价函数的地方
-    weights = [
-        (1.0, frequency_score(rows)),
-        (1.0, location_score(rows)),
-        (1.0, distance_score(rows)),
+    每个词的得分在文章长度取最小值时最大，以此得到每篇文章得分的上界(不需要读取文章长度)。
+    按上界从高到低分批读取文章长度并计算准确得分，保存在大小为k的最小堆中，
+    当剩余文章的上界不超过堆中第k高的得分时提前结束，不再读取剩余文章的长度
+    Args:
+        matches: get_matches的返回值
+        words: [(word_id, df), ...]
+        k: 返回结果的数量
+    Returns:
+        [(article_id, score), ...]，按得分从高到低排列
+    """
+    if k <= 0 or not matches:
+        return []
+    doc_count, avg_length = index.corpus()
+    avg_length = avg_length or 1.0
+    idfs = [idf(df, max(doc_count, df)) for _, df in words]
+
+    min_norm = K1 * (1 - B)
+    bounds = [
+        (-sum(word_idf * weight * (K1 + 1) / (weight + min_norm)
+              for word_idf, weight in zip(idfs, weights)), article_id)
+        for article_id, weights in matches.items()
     ]
-
-    for weight, scores in weights:
-        for title in total_scores:
-            total_scores[title] += weight * scores[title]
-
-    return total_scores
+    heapq.heapify(bounds)
+
+    heap = []  # 最小堆，保存当前得分最高的k篇文章
+    while bounds:
+        if len(heap) == k and -bounds[0][0] <= heap[0][0]:
+            break
+        batch = [heapq.heappop(bounds) for _ in range(min(batch_size, len(bounds)))]
+        lengths = index.lengths([article_id for _, article_id in batch])
+        for neg_bound, article_id in batch:
+            if len(heap) == k and -neg_bound <= heap[0][0]:
+                break
+            length = lengths.get(article_id, avg_length)
+            score = bm25(idfs, matches[article_id], length, avg_length)
+            if len(heap) < k:
+                heapq.heappush(heap, (score, article_id))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, article_id))
+
+    return [(article_id, score) for score, article_id in sorted(heap, reverse=True)]
+
+
+def with_articles(ranked):
+    """ 用一次查询读取排名结果中的文章，同时加载作者与分类，不读取正文
+    Args:
+        ranked: [(article_id, score), ...]
+    Returns:
+        [(article, score), ...]
+    """
+    if not ranked:
+        return []
+    articles = Article.query \
+        .options(joinedload(Article.author), joinedload(Article.category),
+                 defer(Article.body), defer(Article.body_html)) \
+        .filter(Article.id.in_([article_id for article_id, _ in ranked])) \
+        .all()
+    articles = {article.id: article for article in articles}
+    return [(articles[article_id], score) for article_id, score in ranked if article_id in articles]
+
+
+def search(q, limit=8, offset=0, filters=None):
+    """进行一次查询，结果缓存在app.utils.search_cache中
+    Args:
+        q (str): 查询的关键词
+        limit (int): 返回查询结果的最大数量
+        offset (int): 返回查询结果的开始偏移
+        filters (Filters): 分面过滤条件，为None时不过滤也不统计分面
+    Return:
+        query_result (List[Tuple[int, float]]): 返回查询得到的`article_id,score`列表
+        total (int): 匹配的文章总数
+        facets (dict): 匹配文章的分面统计，见FacetIndex.counts，filters为None时为None
+    """
+    return search_cache.cached(q, limit, offset, _search, filters)
 
 
-def get_title(article_id):
-    return Article.query.get(article_id).title
+def _search(q, limit, offset, filters):
+    index = get_index()
+    parsed = parse(q)
+    words = lookup_words(parsed.terms, index)
+    allowed = None
+    if filters is not None:
+        bitmap = facets.facet_index.get().bitmap(filters)
+        if bitmap is not None:
+            allowed = facets.from_bitmap(bitmap)
+    matches = filter_positions(get_matches(words, index, allowed), parsed, index)
+    ranked = top_k(matches, words, offset + limit, index)
+    facet_counts = facets.facet_index.get().counts(matches) if filters is not None else None
+    return ranked[offset:offset + limit], len(matches), facet_counts
 
 
 def query(q, limit=8, offset=0):
@@ -160,23 +313,22 @@ def query(q, limit=8, offset=0):
         limit (int): 返回查询结果的最大数量
         offset (int): 返回查询结果的开始偏移
     Return:
-        query_result (List[Tuple[str, float]]): 返回查询得到的`title,score`列表
+        query_result (List[Tuple[Article, float]]): 返回查询得到的`article,score`列表
     """
-    query_result = []
-    articleid_locations, wordids = get_match_rows(q)
-    if articleid_locations and wordids:
-        articleid_scores = get_scored_list(articleid_locations, wordids)
-        # print(articleid_scores)
-
-        ranked_articleid_scores = sorted(articleid_scores.items(), key=lambda x: x[1], reverse=True)
-        for articleid, score in ranked_articleid_scores[offset:limit]:
-            article = Article.query.get(articleid)
-            # print("%f\t%s" % (score, article.title))
-            query_result.append((article, score))
-    else:
-        pass
-        # print("你的查询 - '%s' - 没有匹配到任何文章" % q)
-    return query_result
+    ranked, _, _ = search(q, limit, offset)
+    return with_articles(ranked)
+
+
+def paginate(q, page=1, per_page=8, filters=None):
+    """进行一次分页查询
+    Return:
+        Pagination: items为`article,score`列表，facets为分面统计(见search)
+    """
+    page = max(page, 1)
+    ranked, total, facet_counts = search(q, per_page, (page - 1) * per_page, filters)
+    pagination = Pagination(None, page, per_page, total, with_articles(ranked))
+    pagination.facets = facet_counts
+    return pagination
 
 
 if __name__ == '__main__':
@@ -187,11 +339,5 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     with create_app('development').app_context():
-        name_scores = query(args.query)
-        if len(name_scores) > 0:
-            article_scores = [
-                (Article.query.filter_by(name=name).first(), score)
-                for name, score in name_scores
-            ]
-        else:
-            article_scores = []
+        for article, score in query(args.query):
+            print("%f\t%s" % (score, article.title))
@@ -0,0 +1,96 @@
+"""
+文章指纹(SimHash)
+=================
+
+正文分词后，每个词的64位哈希按词频加权投票：哈希的第i位为1时第i维加上词频，否则减去词频，
+最后每一维大于0的位为1，得到64位的指纹。内容相近的文章指纹只有少数位不同，
+汉明距离不超过MAX_DISTANCE的两篇文章视为重复。
+
+指纹分为BLOCKS段，每段16位；汉明距离不超过3时至少有一段完全相同，
+因此只需按各段分别查找(`app.models.Fingerprint.near_duplicates`)，再计算候选文章的汉明距离。
+"""
+
+import hashlib
+from collections import Counter
+
+from app.utils.analyzer import tokenize
+
+
+BITS = 64
+BLOCKS = 4
+BLOCK_BITS = BITS // BLOCKS
+MAX_DISTANCE = BLOCKS - 1
+
+
+def word_hash(word):
+    """ 词的64位哈希，与进程无关 """
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(weights):
+    """ 由词频计算64位指纹
+    Args:
+        weights: {word: weight}
+
+    Example:
+        >>> a = simhash({'进程': 3, '调度': 2, '算法': 1, '内存': 1, '分页': 1})
+        >>> b = simhash({'进程': 3, '调度': 2, '算法': 1, '内存': 1, '分段': 1})
+        >>> distance(a, b) < distance(a, simhash({'网络': 3, '协议': 2}))
+        True
+        >>> simhash({})
+        0
+    """
+    vector = [0] * BITS
+    for word, weight in weights.items():
+        value = word_hash(word)
+        for bit in range(BITS):
+            if value >> bit & 1:
+                vector[bit] += weight
+            else:
+                vector[bit] -= weight
+    return sum(1 << bit for bit in range(BITS) if vector[bit] > 0)
+
+
+def fingerprint(text):
+    """ 文本的指纹，使用与建立索引相同的分词(忽略停用词) """
+    return simhash(Counter(word for word, _ in tokenize(text)))
+
+
+def distance(a, b):
+    """ 汉明距离
+
+    Example:
+        >>> distance(0b1011, 0b0001)
+        2
+    """
+    return bin(a ^ b).count('1')
+
+
+def blocks(value):
+    """ 将指纹分为BLOCKS段，从低位开始
+
+    Example:
+        >>> blocks(0x0004000300020001)
+        [1, 2, 3, 4]
+    """
+    mask = (1 << BLOCK_BITS) - 1
+    return [value >> (BLOCK_BITS * i) & mask for i in range(BLOCKS)]
+
+
+def to_signed(value):
+    """ 无符号64位整数转为有符号，用于保存在BIGINT列中
+
+    Example:
+        >>> to_signed(2 ** 64 - 1), to_unsigned(-1)
+        (-1, 18446744073709551615)
+    """
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << BITS) if value < 0 else value
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -9,8 +9,11 @@ from collections import Counter
 import jieba
 import jieba.analyse
 
+from app.utils.tokenizer import STOP_WORDS, load_user_dict
 
-IGNORE_WORDS = set(['是', '的'])
+
+# 停用词表见配置项STOP_WORDS_PATH
+IGNORE_WORDS = STOP_WORDS
 IGNORE_PATTERN = re.compile(r'(\W+|\s+|_+)')
 
 
@@ -31,7 +34,8 @@ def get_words_weight(string):
     Return:
         返回词与词频信息字典(collections.Counter)，格式为{word1: weight, word2: weight, ...}
     """
-    words = [word.lower() for word in jieba.cut_for_search(string) if not_should_ignore(word)]
+    load_user_dict()
+    words = [word for word in map(str.lower, jieba.cut_for_search(string)) if not_should_ignore(word)]
     return Counter(words)
 
 
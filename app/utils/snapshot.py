@@ -0,0 +1,218 @@
+"""
+搜索索引快照
+============
+
+将整个倒排索引(词典、posting list、文章长度与语料统计)写入一个文件，
+各个gunicorn worker以只读方式`mmap`该文件，通过操作系统的page cache共享同一份内存，
+查询时不再访问数据库中的postings表。
+
+文件格式(小端序)：
+
+    header     HEADER
+    positions  每条posting的位置列表(delta+varint编码，同postings.positions)
+    postings   每个词df条POSTING，按article_id排序
+    strings    词的utf-8编码
+    terms      term_count条TERM，按词的utf-8编码排序，用于二分查找
+    docs       doc_count条DOC
+
+重新生成快照时先写入同一目录下的临时文件，再用`os.replace`原子替换，
+正在使用旧文件的worker不受影响，下次查询时发现文件改变后重新加载。
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+
+from app import db
+from app.utils import search_cache
+from app.utils.postings import decode_positions
+from app.models import Words, Posting, Tombstone, ArticleStats, CorpusStats
+
+
+MAGIC = b'HISNAP01'
+
+# magic, doc_count, total_length, term_count, terms_offset, docs_offset
+HEADER = struct.Struct('<8sIdIQQ')
+# strings_offset, length, df, postings_offset
+TERM = struct.Struct('<QIIQ')
+# article_id, weight, positions_offset, positions_length
+POSTING = struct.Struct('<IdQI')
+# article_id, length
+DOC = struct.Struct('<Id')
+
+
+class SnapshotIndex:
+    """只读的快照索引，接口与app.utils.searcher.SqlIndex相同，word_id为词在词典中的序号"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            self._mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.doc_count, self.total_length, self.term_count, \
+            self._terms_offset, docs_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a search snapshot')
+        # 文章数量较少，直接读入内存
+        self._lengths = dict(DOC.iter_unpack(
+            self._mm[docs_offset:docs_offset + self.doc_count * DOC.size]
+        ))
+
+    def _term(self, i):
+        """返回第i个词的(value, df, postings_offset)"""
+        strings_offset, length, df, postings_offset = \
+            TERM.unpack_from(self._mm, self._terms_offset + i * TERM.size)
+        return self._mm[strings_offset:strings_offset + length], df, postings_offset
+
+    def _find(self, value):
+        """二分查找词，返回词的序号，不存在时返回None"""
+        target = value.encode('utf-8')
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.term_count and self._term(lo)[0] == target:
+            return lo
+        return None
+
+    def _postings(self, word_id):
+        """依次返回词的(article_id, weight, positions_offset, positions_length)"""
+        _, df, offset = self._term(word_id)
+        return POSTING.iter_unpack(self._mm[offset:offset + df * POSTING.size])
+
+    def lookup(self, values):
+        words = {}
+        for value in set(values):
+            i = self._find(value)
+            if i is not None:
+                words[value] = (i, self._term(i)[1])
+        return words
+
+    def posting_list(self, word_id, article_ids=None):
+        return {
+            article_id: weight
+            for article_id, weight, _, _ in self._postings(word_id)
+            if article_ids is None or article_id in article_ids
+        }
+
+    def positions(self, word_id, article_ids=None):
+        return {
+            article_id: decode_positions(self._mm[offset:offset + length])
+            for article_id, _, offset, length in self._postings(word_id)
+            if article_ids is None or article_id in article_ids
+        }
+
+    def corpus(self):
+        avg_length = self.total_length / self.doc_count if self.doc_count else 0.0
+        return self.doc_count, avg_length
+
+    def lengths(self, article_ids):
+        return {
+            article_id: self._lengths[article_id]
+            for article_id in article_ids if article_id in self._lengths
+        }
+
+
+def write_snapshot(path, doc_count, total_length, docs, terms, postings):
+    """ 写入快照文件，写完后原子替换path
+    Args:
+        doc_count, total_length: 语料统计
+        docs: [(article_id, length), ...]
+        terms: {word_id: value}
+        postings: 按(word_id, article_id)排序的[(word_id, article_id, weight, positions), ...]
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.search-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(b'\0' * HEADER.size)
+
+            # positions
+            entries = defaultdict(list)
+            for word_id, article_id, weight, positions in postings:
+                entries[word_id].append((article_id, weight, out.tell(), len(positions)))
+                out.write(positions)
+
+            # postings
+            postings_offsets = {}
+            for word_id, word_entries in entries.items():
+                postings_offsets[word_id] = out.tell()
+                for entry in word_entries:
+                    out.write(POSTING.pack(*entry))
+
+            # strings
+            records = []
+            for word_id, word_entries in entries.items():
+                value = terms[word_id].encode('utf-8')
+                records.append((value, out.tell(), len(word_entries), postings_offsets[word_id]))
+                out.write(value)
+
+            # terms
+            records.sort()
+            terms_offset = out.tell()
+            for value, strings_offset, df, postings_offset in records:
+                out.write(TERM.pack(strings_offset, len(value), df, postings_offset))
+
+            # docs
+            docs_offset = out.tell()
+            docs = list(docs)
+            for doc in docs:
+                out.write(DOC.pack(*doc))
+
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, len(docs), total_length, len(records),
+                                  terms_offset, docs_offset))
+            out.flush()
+            os.fsync(out.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def build_snapshot(path):
+    """从数据库读取当前索引并生成快照，完成后使搜索缓存失效"""
+    corpus = CorpusStats.get()
+    docs = db.session.query(ArticleStats.article_id, ArticleStats.length) \
+        .order_by(ArticleStats.article_id)
+    terms = dict(db.session.query(Words.id, Words.value).filter(Words.df > 0))
+    tombstones = Tombstone.all()
+    postings = db.session.query(Posting.word_id, Posting.article_id, Posting.segment_id,
+                                Posting.weight, Posting.positions) \
+        .order_by(Posting.word_id, Posting.article_id) \
+        .yield_per(1000)
+    postings = (
+        (word_id, article_id, weight, positions)
+        for word_id, article_id, segment_id, weight, positions in postings
+        if (segment_id, article_id) not in tombstones
+    )
+    write_snapshot(path, corpus.doc_count, corpus.total_length, docs, terms, postings)
+    search_cache.bump_generation()
+    return len(terms)
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load(path):
+    """ 返回path对应的SnapshotIndex，文件不存在时返回None
+    文件被替换后(inode或修改时间改变)自动重新加载
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != key:
+            cached = (key, SnapshotIndex(path))
+            _loaded[path] = cached
+        return cached[1]
@@ -0,0 +1,175 @@
+"""
+搜索结果摘要
+============
+
+根据查询词在正文中的位置选出命中最多的窗口，用建立索引时保存的位置到字符区间的映射
+(`ArticleStats.offsets`)换算出窗口在正文中的字符区间，只从数据库读取这一段正文，
+每篇文章读取的字符数不超过MAX_SNIPPET_CHARS。
+"""
+
+from collections import Counter
+
+from markupsafe import Markup, escape
+from sqlalchemy import func
+
+from app import db
+from app.models import Article, ArticleStats
+from app.utils.postings import iter_varints
+from app.utils.query_parser import parse
+from app.utils.searcher import get_index, lookup_words
+
+
+SNIPPET_POSITIONS = 40  # 摘要窗口包含的位置数
+CONTEXT_POSITIONS = 4  # 窗口第一个命中之前保留的位置数
+MAX_SNIPPET_CHARS = 160  # 每篇文章最多读取的正文字符数
+ELLIPSIS = '…'
+
+
+def best_window(hits, size):
+    """ 选出包含不同查询词最多(其次命中次数最多)的窗口
+    Args:
+        hits: [(position, term), ...]，按position排序
+        size: 窗口包含的位置数
+    Returns:
+        窗口的第一个位置，hits为空时返回None
+
+    Example:
+        >>> best_window([(1, 'a'), (3, 'a'), (20, 'a'), (22, 'b'), (50, 'a')], 5)
+        20
+    """
+    best, best_score = None, None
+    counts = Counter()
+    end = 0
+    for i, (start, _) in enumerate(hits):
+        while end < len(hits) and hits[end][0] < start + size:
+            counts[hits[end][1]] += 1
+            end += 1
+        score = (len(counts), end - i)
+        if best_score is None or score > best_score:
+            best, best_score = start, score
+        counts[hits[i][1]] -= 1
+        if not counts[hits[i][1]]:
+            del counts[hits[i][1]]
+    return best
+
+
+def decode_spans(data, stop):
+    """ 解码ArticleStats.offsets中前stop个位置的字符区间
+    Returns:
+        spans: [(start, end), ...]
+        more: 之后是否还有位置
+
+    Example:
+        >>> from app.utils.postings import encode_positions
+        >>> decode_spans(encode_positions([0, 2, 3, 5, 6, 9]), 2)
+        ([(0, 2), (3, 5)], True)
+    """
+    spans = []
+    offset = 0
+    start = None
+    for delta in iter_varints(data):
+        offset += delta
+        if start is None:
+            if len(spans) == stop:
+                return spans, True
+            start = offset
+        else:
+            spans.append((start, offset))
+            start = None
+    return spans, False
+
+
+def highlight(text, marks):
+    """ 转义text并用<mark>标出marks中的区间
+
+    Example:
+        >>> highlight('a<b>c', [(1, 4)])
+        Markup('a<mark>&lt;b&gt;</mark>c')
+    """
+    out = []
+    last = 0
+    for start, end in sorted(marks):
+        start = max(start, last)
+        if start >= end:
+            continue
+        out.append(escape(text[last:start]))
+        out.append(Markup('<mark>%s</mark>') % text[start:end])
+        last = end
+    out.append(escape(text[last:]))
+    return Markup('').join(out)
+
+
+def read_body(article_id, start, length):
+    """读取正文中从第start个字符开始的length个字符"""
+    return db.session.query(func.substr(Article.body, start + 1, length)) \
+        .filter(Article.id == article_id).scalar() or ''
+
+
+def make_snippet(article_id, stats, hits):
+    """ 生成一篇文章的摘要
+    Args:
+        stats: ArticleStats，没有保存offsets时从正文开头截取
+        hits: [(position, term), ...]，按position排序，position为相对正文开头的位置
+    """
+    start = best_window(hits, SNIPPET_POSITIONS) if stats is not None and stats.offsets else None
+    if start is None:
+        text = read_body(article_id, 0, MAX_SNIPPET_CHARS + 1)
+        if len(text) > MAX_SNIPPET_CHARS:
+            return escape(text[:MAX_SNIPPET_CHARS]) + ELLIPSIS
+        return escape(text)
+
+    first = max(start - CONTEXT_POSITIONS, 0)
+    spans, more = decode_spans(stats.offsets, first + SNIPPET_POSITIONS)
+    spans = spans[first:]
+    if not spans:
+        return escape(read_body(article_id, 0, MAX_SNIPPET_CHARS))
+    char_start = spans[0][0]
+    char_end = min(spans[-1][1], char_start + MAX_SNIPPET_CHARS)
+    text = read_body(article_id, char_start, char_end - char_start)
+
+    marks = [
+        (spans[position - first][0] - char_start, spans[position - first][1] - char_start)
+        for position, _ in hits if first <= position < first + len(spans)
+    ]
+    snippet = highlight(text, marks)
+    if char_start > 0:
+        snippet = ELLIPSIS + snippet
+    if more or char_end < spans[-1][1]:
+        snippet += ELLIPSIS
+    return snippet
+
+
+def make_snippets(q, article_ids, index=None):
+    """ 为搜索结果生成摘要
+    Args:
+        q: 查询
+        article_ids: 需要摘要的文章id
+    Returns:
+        {article_id: Markup}
+    """
+    article_ids = set(article_ids)
+    if not article_ids:
+        return {}
+    index = index or get_index()
+    stats = {stats.article_id: stats for stats in
+             ArticleStats.query.filter(ArticleStats.article_id.in_(article_ids))}
+
+    hits = {article_id: [] for article_id in article_ids}
+    for term, (word_id, _) in enumerate(lookup_words(parse(q).terms, index)):
+        for article_id, positions in index.positions(word_id, article_ids).items():
+            body_position = getattr(stats.get(article_id), 'body_position', None)
+            if body_position is None:
+                continue
+            hits[article_id].extend(
+                (position - body_position, term) for position in positions if position >= body_position
+            )
+
+    return {
+        article_id: make_snippet(article_id, stats.get(article_id), sorted(article_hits))
+        for article_id, article_hits in hits.items()
+    }
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
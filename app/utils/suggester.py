@@ -0,0 +1,85 @@
+"""
+搜索词前缀补全
+==============
+
+词典为按字典序排好的词列表(只包含df>0的词)，前缀对应列表中连续的一段，
+用二分查找定位后按文档频率取前k个。词典常驻内存，
+索引版本号(app.utils.search_cache)改变后重新从数据库加载。
+"""
+
+import heapq
+from bisect import bisect_left
+
+from app import db
+from app.models import Words
+from app.utils import search_cache
+
+
+# 前缀匹配的词超过该数量时缓存补全结果，避免短前缀每次都扫描一大段词典
+CACHE_RANGE_SIZE = 256
+
+
+class TermDictionary:
+    """按字典序排列的词与文档频率
+
+    Example:
+        >>> terms = TermDictionary([('进程', 3), ('进行', 5), ('调度', 2), ('进程调度', 1)])
+        >>> terms.complete('进')
+        ['进行', '进程', '进程调度']
+        >>> terms.complete('进程', limit=1)
+        ['进程']
+        >>> terms.complete('内存')
+        []
+    """
+
+    def __init__(self, terms):
+        terms = sorted(terms)
+        self.values = [value for value, _ in terms]
+        self.dfs = [df for _, df in terms]
+        self._cache = search_cache.LRUCache(search_cache.LOCAL_CACHE_SIZE)
+
+    def __len__(self):
+        return len(self.values)
+
+    def complete(self, prefix, limit=8):
+        """ 返回以prefix开头的词，按文档频率从高到低排列 """
+        lo = bisect_left(self.values, prefix)
+        hi = bisect_left(self.values, prefix + '\U0010ffff', lo)
+        if hi - lo <= CACHE_RANGE_SIZE:
+            return self._top(lo, hi, limit)
+        key = (prefix, limit)
+        result = self._cache.get(key)
+        if result is None:
+            result = self._top(lo, hi, limit)
+            self._cache.set(key, result)
+        return result
+
+    def _top(self, lo, hi, limit):
+        top = heapq.nlargest(limit, range(lo, hi), key=lambda i: (self.dfs[i], -i))
+        return [self.values[i] for i in top]
+
+    @classmethod
+    def load(cls):
+        return cls(db.session.query(Words.value, Words.df).filter(Words.df > 0))
+
+
+dictionary = search_cache.GenerationCache(TermDictionary.load)
+
+
+def suggest(prefix, limit=8):
+    """ 补全搜索词
+    Args:
+        prefix: 用户已输入的部分
+        limit: 返回数量上限
+    Returns:
+        [word, ...]
+    """
+    prefix = prefix.strip().lower()
+    if not prefix:
+        return []
+    return dictionary.get().complete(prefix, limit)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,249 @@
+"""
+文章相似度(TF-IDF)
+==================
+
+所有文章的词频(`Article.weights_of`，按字段加权)构成一个稀疏矩阵(CSR)，每行一篇文章，
+乘以各词的idf后将每行归一化为单位向量，两篇文章的余弦相似度即为对应两行的内积，
+所有文章两两之间的相似度由一次稀疏矩阵乘法`M * M.T`得到。
+
+为了限制内存，乘法按行分块进行，每块只保留每篇文章最相似的k篇。
+
+`SimilarityIndex`缓存所有文章的矩阵，一篇文章改变时只计算并替换对应的一行，
+再用一次矩阵与向量的乘法得到它与其他文章的相似度。
+idf与其他行的归一化在重新建立矩阵之前保持不变，新出现的词按只在一篇文章中出现计算idf。
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+BLOCK_SIZE = 1024  # 每次与整个矩阵相乘的行数
+
+
+class TfidfMatrix:
+    """ 归一化后的TF-IDF矩阵
+    Attributes:
+        matrix: scipy.sparse.csr_matrix，shape为(文章数, 词数)，各文章的词频乘以idf并归一化，
+            每行的模为1(全为0的行除外)
+        vocabulary: {word: 列号}，只增不减
+        idf: numpy数组，第i项为第i列的词的idf，建立矩阵时计算
+        changed: 建立矩阵之后替换或删除的行数
+    """
+
+    def __init__(self, tf, vocabulary):
+        self.vocabulary = vocabulary
+        self.changed = 0
+        self._weigh(tf)
+
+    @classmethod
+    def build(cls, weights):
+        """ 由各文章的词频建立矩阵
+        Args:
+            weights: [{word: weight}, ...]，第i项为第i行的文章的词频
+        """
+        vocabulary = {}
+        indptr, indices, data = [0], [], []
+        for doc in weights:
+            for word, weight in doc.items():
+                indices.append(vocabulary.setdefault(word, len(vocabulary)))
+                data.append(weight)
+            indptr.append(len(indices))
+        tf = sparse.csr_matrix((data, indices, indptr),
+                               shape=(len(weights), len(vocabulary)), dtype=np.float64)
+        return cls(tf, vocabulary)
+
+    def _weigh(self, tf):
+        # 平滑的idf，只在一篇文章中出现的词权重最大，在所有文章中出现的词权重为1
+        rows, columns = tf.shape
+        df = np.bincount(tf.indices, minlength=columns)
+        self.idf = np.log((1 + rows) / (1 + df)) + 1
+        self.new_word_idf = np.log((1 + rows) / 2) + 1
+        self.matrix = normalize(tf.multiply(self.idf).tocsr())
+
+    def _row(self, weights):
+        """词频为weights的一行，乘以idf并归一化，新出现的词加入vocabulary"""
+        indices = [self.vocabulary.setdefault(word, len(self.vocabulary)) for word in weights]
+        if len(self.vocabulary) > len(self.idf):
+            self.idf = np.concatenate([self.idf, np.full(len(self.vocabulary) - len(self.idf), self.new_word_idf)])
+        data = np.array(list(weights.values()), dtype=np.float64) * self.idf[indices]
+        row = sparse.csr_matrix((data, indices, [0, len(indices)]),
+                                shape=(1, len(self.vocabulary)), dtype=np.float64)
+        return normalize(row)
+
+    def replace(self, row, weights):
+        """将第row行替换为词频weights，row为行数时在最后增加一行"""
+        self.matrix = splice(self.matrix, row, min(row + 1, self.matrix.shape[0]), self._row(weights))
+        self.changed += 1
+
+    def delete(self, row):
+        """删除第row行，之后的行号减1"""
+        self.matrix = splice(self.matrix, row, row + 1)
+        self.changed += 1
+
+    def similar(self, row, candidates=None):
+        """ 第row行与其他各行的相似度
+        Args:
+            candidates: 只计算这些行，为None时计算所有行
+        Returns:
+            [(other_row, similarity), ...]，按相似度从大到小排列，不含自身与相似度为0的行
+        """
+        if candidates is None:
+            products = (self.matrix @ self.matrix[row].T).tocsc()
+            others, scores = products.indices, products.data
+        else:
+            others = np.array(sorted(candidates), dtype=np.int64)
+            scores = (self.matrix[others] @ self.matrix[row].T).toarray().ravel()
+        keep = others != row
+        return largest(others[keep], scores[keep], len(others))
+
+    def top_k(self, k, rows=None):
+        """ 每篇文章最相似的k篇文章
+        Args:
+            k: 每篇文章保留的数量
+            rows: 需要计算的行号，为None时计算所有行
+        Returns:
+            {row: [(other_row, similarity), ...]}，按相似度从大到小排列，不含自身与相似度为0的文章
+        """
+        rows = range(self.matrix.shape[0]) if rows is None else list(rows)
+        transposed = self.matrix.T.tocsc()
+        result = {}
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            products = (self.matrix[block] @ transposed).tocsr()
+            for i, row in enumerate(block):
+                begin, end = products.indptr[i], products.indptr[i + 1]
+                others = products.indices[begin:end]
+                scores = products.data[begin:end]
+                keep = others != row
+                result[row] = largest(others[keep], scores[keep], k)
+        return result
+
+
+class SimilarityIndex:
+    """ 以文章id为key的TF-IDF矩阵，用于增量计算一篇文章与其他文章的相似度
+    Attributes:
+        ids: 第i行的文章id
+        keys: {article_id: key}，key标识该行的文章内容(分词结果缓存的key)
+        bands: LSH桶(`app.utils.minhash.BandIndex`)，不为None时只计算候选文章的相似度
+    """
+
+    def __init__(self, ids, keys, tfidf, bands=None):
+        self.ids = ids
+        self.keys = keys
+        self.tfidf = tfidf
+        self.bands = bands
+        self._rows = {article_id: row for row, article_id in enumerate(ids)}
+
+    @classmethod
+    def build(cls, weights, keys, bands=None):
+        """ weights: {article_id: {word: weight}}，keys: {article_id: key} """
+        ids = list(weights)
+        return cls(ids, dict(keys), TfidfMatrix.build([weights[article_id] for article_id in ids]), bands)
+
+    def __contains__(self, article_id):
+        return article_id in self._rows
+
+    def update(self, article_id, weights, key):
+        """更新(或加入)一篇文章的词频"""
+        row = self._rows.get(article_id, len(self.ids))
+        if row == len(self.ids):
+            self.ids.append(article_id)
+            self._rows[article_id] = row
+        self.keys[article_id] = key
+        self.tfidf.replace(row, weights)
+        if self.bands is not None:
+            self.bands.add(article_id, weights)
+
+    def remove(self, article_id):
+        row = self._rows.pop(article_id, None)
+        if row is None:
+            return
+        del self.ids[row]
+        del self.keys[article_id]
+        for other_id in self.ids[row:]:
+            self._rows[other_id] -= 1
+        self.tfidf.delete(row)
+        if self.bands is not None:
+            self.bands.remove(article_id)
+
+    def similar(self, article_id):
+        """ 一篇文章与其他所有文章的相似度
+        Returns:
+            [(other_article_id, similarity), ...]，按相似度从大到小排列，不含相似度为0的文章
+        """
+        if article_id not in self._rows:
+            return []
+        candidates = None
+        if self.bands is not None:
+            candidates = [self._rows[other_id] for other_id in self.bands.candidates(article_id)]
+            if not candidates:
+                return []
+        return [(self.ids[row], score) for row, score in self.tfidf.similar(self._rows[article_id], candidates)]
+
+
+def normalize(matrix):
+    """ 将CSR矩阵的每行归一化为单位向量，全为0的行保持不变
+
+    Example:
+        >>> normalize(sparse.csr_matrix([[3.0, 4.0], [0.0, 0.0]])).toarray().round(4).tolist()
+        [[0.6, 0.8], [0.0, 0.0]]
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ matrix).tocsr()
+
+
+def splice(matrix, start, stop, rows=None):
+    """ 将CSR矩阵的第start到stop(不含)行替换为rows，只复制数组，不重新计算其他行
+
+    Example:
+        >>> m = sparse.csr_matrix([[1.0, 0.0], [0.0, 2.0], [3.0, 0.0]])
+        >>> splice(m, 1, 2, sparse.csr_matrix([[0.0, 5.0, 6.0]])).toarray().tolist()
+        [[1.0, 0.0, 0.0], [0.0, 5.0, 6.0], [3.0, 0.0, 0.0]]
+        >>> splice(m, 0, 1).toarray().tolist()
+        [[0.0, 2.0], [3.0, 0.0]]
+    """
+    if rows is None:
+        rows = sparse.csr_matrix((0, matrix.shape[1]))
+    begin, end = matrix.indptr[start], matrix.indptr[stop]
+    offset = rows.nnz - (end - begin)
+    data = np.concatenate([matrix.data[:begin], rows.data, matrix.data[end:]])
+    indices = np.concatenate([matrix.indices[:begin], rows.indices, matrix.indices[end:]])
+    indptr = np.concatenate([matrix.indptr[:start], begin + rows.indptr, matrix.indptr[stop + 1:] + offset])
+    shape = (matrix.shape[0] - (stop - start) + rows.shape[0], max(matrix.shape[1], rows.shape[1]))
+    return sparse.csr_matrix((data, indices, indptr), shape=shape)
+
+
+def largest(ids, scores, k):
+    """ scores中最大的k项，按从大到小排列
+
+    Example:
+        >>> largest(np.array([1, 2, 3]), np.array([0.2, 0.9, 0.5]), 2)
+        [(2, 0.9), (3, 0.5)]
+    """
+    if len(scores) > k:
+        selected = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[selected], scores[selected]
+    order = np.argsort(-scores, kind='stable')
+    return [(int(ids[i]), float(scores[i])) for i in order if scores[i] > 0]
+
+
+def similar_articles(weights, k):
+    """ 所有文章两两之间的余弦相似度中，每篇文章最大的k项
+    Args:
+        weights: {article_id: {word: weight}}
+        k: 每篇文章保留的数量
+    Returns:
+        {article_id: [(other_article_id, similarity), ...]}
+    """
+    ids = list(weights)
+    tfidf = TfidfMatrix.build([weights[article_id] for article_id in ids])
+    return {
+        ids[row]: [(ids[other], score) for other, score in neighbours]
+        for row, neighbours in tfidf.top_k(k).items()
+    }
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
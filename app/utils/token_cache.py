@@ -0,0 +1,127 @@
+"""
+分词结果缓存
+============
+
+文章的分词结果(`app.utils.analyzer.analyze`的返回值，包括按字段加权的词频、位置与字符区间)
+以各字段文本的md5为key保存在Redis中，前面有一层进程内的LRU缓存。
+建立索引、批量建立索引与文章相似度计算共用同一份分词结果，
+文章内容不变时不再重复分词，内容或用户词典、停用词表改变后key随之改变，旧的缓存过期后自动清除。
+Redis不可用时直接分词。
+"""
+
+import json
+import hashlib
+
+from redis.exceptions import RedisError
+
+from app import redis, logger
+from app.utils import analyzer
+from app.utils.search_cache import LRUCache
+from app.utils import tokenizer
+
+
+CACHE_TIMEOUT = 7 * 24 * 60 * 60  # Redis中缓存的过期时间(秒)
+LOCAL_CACHE_SIZE = 256  # 进程内缓存的文章数
+
+local_cache = LRUCache(LOCAL_CACHE_SIZE)
+
+
+def cache_key(fields):
+    """ 分词结果的key
+
+    Example:
+        >>> cache_key([('title', '进程'), ('body', '调度')])  # doctest: +ELLIPSIS
+        'tokens:...:c08637ce7d1724b39107da64a935300a'
+    """
+    data = json.dumps(fields, ensure_ascii=False, separators=(',', ':'))
+    return f'tokens:{tokenizer.DICTIONARY_VERSION}:' + hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def dumps(analysis):
+    return json.dumps(analysis, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(value):
+    """ 从json恢复analyze的返回值
+
+    Example:
+        >>> loads(dumps(({'a': (1.0, [0])}, 1.0, {'body': (0, [(0, 1)])})))
+        ({'a': (1.0, [0])}, 1.0, {'body': (0, [(0, 1)])})
+    """
+    terms, length, spans = json.loads(value)
+    terms = {word: (weight, positions) for word, (weight, positions) in terms.items()}
+    spans = {field: (offset, [tuple(span) for span in field_spans])
+             for field, (offset, field_spans) in spans.items()}
+    return terms, length, spans
+
+
+def get_many(keys):
+    """ 读取缓存的分词结果
+    Returns:
+        {key: analysis}，只包含命中的key
+    """
+    found = {}
+    missing = []
+    for key in keys:
+        analysis = local_cache.get(key)
+        if analysis is not None:
+            found[key] = analysis
+        else:
+            missing.append(key)
+    if missing:
+        try:
+            values = redis.mget(missing)
+        except RedisError as exc:
+            logger.warning(f'Token cache is disabled: {exc}')
+            values = [None] * len(missing)
+        for key, value in zip(missing, values):
+            if value is not None:
+                found[key] = loads(value)
+                local_cache.set(key, found[key])
+    return found
+
+
+def set_many(items):
+    """ 保存分词结果
+    Args:
+        items: {key: analysis}
+    """
+    if not items:
+        return
+    for key, analysis in items.items():
+        local_cache.set(key, analysis)
+    try:
+        with redis.pipeline(transaction=False) as pipe:
+            for key, analysis in items.items():
+                pipe.set(key, dumps(analysis), ex=CACHE_TIMEOUT)
+            pipe.execute()
+    except RedisError as exc:
+        logger.warning(f'Failed to cache tokens: {exc}')
+
+
+def analyze_many(fields_list):
+    """ 与analyzer.analyze相同，优先使用缓存
+    Args:
+        fields_list: [fields, ...]
+    Returns:
+        [analysis, ...]，顺序与fields_list一致
+    """
+    keys = [cache_key(fields) for fields in fields_list]
+    found = get_many(set(keys))
+    computed = {}
+    for key, fields in zip(keys, fields_list):
+        if key not in found and key not in computed:
+            computed[key] = analyzer.analyze(fields)
+    set_many(computed)
+    found.update(computed)
+    return [found[key] for key in keys]
+
+
+def analyze(fields):
+    """与analyzer.analyze相同，优先使用缓存"""
+    return analyze_many([fields])[0]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
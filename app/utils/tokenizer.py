@@ -0,0 +1,165 @@
+"""
+分词器初始化
+============
+
+jieba第一次分词时才加载词典(生成前缀词典约需1~2秒)，在每个请求或任务中首次分词时加载
+会使第一次调用变慢，并且每个进程各自持有一份词典。
+
+`init_tokenizer`在进程启动时显式加载词典：
+
+* 词典序列化后的缓存文件(jieba.cache)保存在配置项JIEBA_CACHE_DIR指定的目录下，
+  只有第一次启动时需要生成，之后直接从缓存文件读取
+* gunicorn(gunicorn.conf.py，preload_app)与celery worker(celery_worker.py)
+  在主进程中加载词典，fork出的子进程以copy-on-write方式共享词典所占的内存，
+  子进程中再次调用时不会重复加载
+
+每次加载的耗时记录在日志与Redis中(STARTUP_METRICS_KEY)，可以通过`/api/search/tokenizer`查看。
+
+用户词典(JIEBA_USER_DICT_PATH)与停用词表(STOP_WORDS_PATH)由`init_app`按应用的配置读取，
+用户词典在分词前加入jieba词典(`load_user_dict`)。两者的内容决定分词结果，
+DICTIONARY_VERSION随之改变，分词结果缓存的key中包含该版本。
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import hashlib
+import threading
+
+import jieba
+from redis.exceptions import RedisError
+
+from app import redis, logger
+
+
+STARTUP_METRICS_KEY = 'metrics:tokenizer:startup'
+
+# 当前进程中加载词典的情况
+startup = {}
+
+USER_DICT_PATTERN = re.compile(r'^(.+?)(?: ([0-9]+))?(?: ([a-z]+))?$')
+
+
+def read_lines(path):
+    """ 读取词表文件中的非空行，忽略#开头的注释，文件不存在时返回[] """
+    if not path or not os.path.isfile(path):
+        return []
+    with open(path, encoding='utf-8') as fd:
+        lines = (line.strip() for line in fd)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+def parse_user_dict(lines):
+    """ 解析用户词典，含大写字母的词同时返回其小写形式
+
+    Example:
+        >>> parse_user_dict(['RSA加密 n', '红黑树 10', 'Redis'])
+        [('RSA加密', None, 'n'), ('rsa加密', None, 'n'), ('红黑树', 10, None), ('Redis', None, None), ('redis', None, None)]
+    """
+    entries = []
+    for line in lines:
+        word, freq, tag = USER_DICT_PATTERN.match(line).groups()
+        freq = int(freq) if freq else None
+        entries.append((word, freq, tag))
+        if word.lower() != word:
+            entries.append((word.lower(), freq, tag))
+    return entries
+
+
+def dictionary_version(stop_words, user_dict):
+    """ 停用词表与用户词典内容的摘要 """
+    return hashlib.md5(
+        json.dumps([sorted(stop_words), user_dict], ensure_ascii=False).encode('utf-8')
+    ).hexdigest()[:8]
+
+
+# 由init_app原地修改，导入这些名称的模块总是看到当前的内容
+STOP_WORDS = set()
+USER_DICT = []
+DICTIONARY_VERSION = dictionary_version(STOP_WORDS, USER_DICT)
+
+_added_words = set()  # 已加入jieba词典的用户词典项
+_user_dict_version = None
+_user_dict_lock = threading.Lock()
+
+
+def load_dictionaries(stop_words_path, user_dict_path):
+    """ 读取停用词表与用户词典，替换当前的内容 """
+    global DICTIONARY_VERSION
+    stop_words = {word.lower() for word in read_lines(stop_words_path)}
+    user_dict = parse_user_dict(read_lines(user_dict_path))
+    with _user_dict_lock:
+        STOP_WORDS.clear()
+        STOP_WORDS.update(stop_words)
+        USER_DICT[:] = user_dict
+        DICTIONARY_VERSION = dictionary_version(STOP_WORDS, USER_DICT)
+
+
+def init_app(app):
+    """ 按应用的配置读取停用词表与用户词典 """
+    load_dictionaries(app.config['STOP_WORDS_PATH'], app.config['JIEBA_USER_DICT_PATH'])
+
+
+def load_user_dict():
+    """ 将用户词典加入jieba词典，每个进程中每项只加入一次，分词前调用 """
+    global _user_dict_version
+    if _user_dict_version == DICTIONARY_VERSION:
+        return
+    with _user_dict_lock:
+        for word, freq, tag in USER_DICT:
+            if (word, freq, tag) not in _added_words:
+                jieba.add_word(word, freq, tag)
+                _added_words.add((word, freq, tag))
+        _user_dict_version = DICTIONARY_VERSION
+
+
+def init_tokenizer(cache_dir=None, role='default'):
+    """ 加载jieba词典，返回本次调用的耗时(秒)，已加载时直接返回
+    Args:
+        cache_dir: 词典缓存文件所在目录，为None时使用系统临时目录
+        role: 调用者，如'gunicorn-master'、'celery-worker'，作为指标的名称
+    """
+    start = time.perf_counter()
+    loaded = jieba.dt.initialized
+    if not loaded:
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            jieba.dt.tmp_dir = cache_dir
+        jieba.initialize()
+    load_user_dict()
+    elapsed = time.perf_counter() - start
+
+    metric = {
+        'seconds': round(elapsed, 4),
+        'preloaded': loaded,
+        'pid': os.getpid(),
+        'host': socket.gethostname(),
+        'cache_dir': jieba.dt.tmp_dir,
+        'timestamp': int(time.time()),
+    }
+    startup[role] = metric
+    if loaded:
+        logger.info(f'Tokenizer already loaded for {role} (pid {metric["pid"]})')
+    else:
+        logger.info(f'Tokenizer loaded for {role} in {elapsed:.3f}s (pid {metric["pid"]})')
+    try:
+        redis.hset(STARTUP_METRICS_KEY, role, json.dumps(metric))
+    except RedisError as exc:
+        logger.warning(f'Failed to record tokenizer startup: {exc}')
+    return elapsed
+
+
+def startup_metrics():
+    """ 各角色最近一次加载词典的情况 {role: metric}，Redis不可用时只返回当前进程的记录 """
+    try:
+        metrics = redis.hgetall(STARTUP_METRICS_KEY)
+    except RedisError:
+        return dict(startup)
+    return {role: json.loads(metric) for role, metric in metrics.items()}
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -16,4 +16,6 @@ flask build index
 # nohup flask build similarity > /dev/null 2>&1 &
 flask build similarity
 
-exec gunicorn -b :5000 --access-logfile - --error-logfile - manage:app
+flask build item-model
+
+exec gunicorn -c gunicorn.conf.py manage:app
@@ -14,8 +14,19 @@ if env_path.is_file():
     load_dotenv(dotenv_path=env_path, verbose=True)
 
 
+from celery.signals import worker_process_init
+
 from app import celery, create_app
+from app.utils.tokenizer import init_tokenizer
 
 
 app = create_app(os.getenv('FLASK_ENV') or 'default')
 app.app_context().push()
+
+# 在主进程中加载jieba词典，worker子进程fork后共享
+init_tokenizer(app.config['JIEBA_CACHE_DIR'], role='celery-master')
+
+
+@worker_process_init.connect
+def warm_tokenizer(**kwargs):
+    init_tokenizer(app.config['JIEBA_CACHE_DIR'], role='celery-worker')
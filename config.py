@@ -25,6 +25,30 @@ class Config:
 
     ARTICLES_SOURCE_DIR = os.path.join(BASE_DIR, 'articles')
     ARTICLES_PER_PAGE = 7
+    SEARCH_RESULTS_PER_PAGE = 8
+    # 搜索索引快照文件，为空时直接查询数据库中的索引
+    SEARCH_SNAPSHOT_PATH = os.getenv('SEARCH_SNAPSHOT_PATH')
+    # 后台合并索引段的间隔(秒)
+    SEARCH_COMPACT_INTERVAL = int(os.getenv('SEARCH_COMPACT_INTERVAL', 10 * 60))
+    # jieba词典缓存文件所在目录
+    JIEBA_CACHE_DIR = os.getenv('JIEBA_CACHE_DIR', os.path.join(BASE_DIR, 'tmp'))
+    # 用户词典与停用词表，建立索引、查询与相似度计算共用，修改后需要重建索引
+    JIEBA_USER_DICT_PATH = os.getenv('JIEBA_USER_DICT_PATH',
+                                     os.path.join(BASE_DIR, 'app', 'utils', 'dict', 'user_dict.txt'))
+    STOP_WORDS_PATH = os.getenv('STOP_WORDS_PATH',
+                                os.path.join(BASE_DIR, 'app', 'utils', 'dict', 'stop_words.txt'))
+    # 每篇文章缓存的相似文章数
+    SIMILAR_ARTICLES = 10
+    # 文章数超过该值时用MinHash/LSH找出候选文章，只计算候选文章的相似度
+    SIMILARITY_LSH_THRESHOLD = int(os.getenv('SIMILARITY_LSH_THRESHOLD', 30000))
+    # 推荐模型中每篇文章保留的相似文章数，以及定期重新计算模型的间隔(秒)
+    RECOMMEND_SIMILAR_ITEMS = 10
+    RECOMMEND_REBUILD_INTERVAL = int(os.getenv('RECOMMEND_REBUILD_INTERVAL', 24 * 60 * 60))
+    # 模型还没有计算过时，该时间(秒)内最多提交一次计算任务
+    RECOMMEND_BUILD_LOCK_TTL = int(os.getenv('RECOMMEND_BUILD_LOCK_TTL', 10 * 60))
+    # 为每个用户缓存的推荐文章数与缓存时间(秒)
+    RECOMMEND_ITEMS = 5
+    RECOMMEND_CACHE_TTL = int(os.getenv('RECOMMEND_CACHE_TTL', 10 * 60))
     COMMENTS_PER_PAGE = 7
     MAX_ARTICLE_SIZE = 16 * 1024 * 1024
     ALLOWED_FILE_EXTENSIONS = set(['md', 'markdown'])
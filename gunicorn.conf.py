@@ -0,0 +1,38 @@
+"""
+gunicorn配置
+============
+
+preload_app: 在主进程中导入应用并加载jieba词典，fork出的worker以copy-on-write方式共享词典，
+不必在每个worker中重新加载。
+
+使用gevent worker(GUNICORN_WORKER_CLASS=gevent)时，应用、redis与SQLAlchemy的连接以及模块中的
+threading.Lock都在主进程中创建，因此在导入应用之前先打补丁。
+"""
+
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+
+bind = os.getenv('GUNICORN_BIND', ':5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+accesslog = '-'
+errorlog = '-'
+preload_app = True
+
+
+def on_starting(server):
+    """主进程启动时(preload_app下应用已导入)加载词典"""
+    from app.utils.tokenizer import init_tokenizer
+    app = server.app.wsgi()
+    init_tokenizer(app.config['JIEBA_CACHE_DIR'], role='gunicorn-master')
+
+
+def post_fork(server, worker):
+    """worker中的词典继承自主进程，这里只记录worker启动的情况"""
+    from app.utils.tokenizer import init_tokenizer
+    app = server.app.wsgi()
+    init_tokenizer(app.config['JIEBA_CACHE_DIR'], role='gunicorn-worker')
@@ -14,15 +14,26 @@ if env_path.is_file():
     load_dotenv(dotenv_path=env_path, verbose=True)
 
 
+import time
+from collections import Counter
 from itertools import combinations
 
+import click
 from flask.cli import AppGroup
 from flask_migrate import Migrate, upgrade
 
-from app import create_app, db, redis
+from app import create_app, db, binary_redis
 from app.models import (User, Role, Article, Category, Tag,
-                        Comment, Rating, Words, WordLocation)
-from app.utils.similarity import similarity
+                        Comment, Rating, Words, Posting, Segment, Tombstone,
+                        ArticleStats, CorpusStats, Fingerprint)
+from app.utils.analyzer import analyze, stop_word_counts
+from app.utils.tokenizer import STOP_WORDS
+from app.utils.indexer import build_index as bulk_build_index
+from app.utils.postings import encode_positions
+from app.utils.snapshot import build_snapshot
+from app.utils.tfidf import similar_articles
+from app.utils.minhash import approximate_similar_articles
+from app.utils import token_cache, related, item_model
 
 
 app = create_app(os.getenv('FLASK_ENV', 'default'))
@@ -34,7 +45,8 @@ def make_shell_context():
     return dict(db=db, User=User, Role=Role,
                 Article=Article, Category=Category, Tag=Tag,
                 Comment=Comment, Rating=Rating,
-                Words=Words, WordLocation=WordLocation)
+                Words=Words, Posting=Posting, Segment=Segment, Tombstone=Tombstone,
+                ArticleStats=ArticleStats, CorpusStats=CorpusStats, Fingerprint=Fingerprint)
 
 
 @app.cli.command()
@@ -65,10 +77,55 @@ build_cli = AppGroup('build')
 
 
 @build_cli.command('index')
-def build_index():
+@click.option('--workers', default=None, type=int, help='Tokenizer processes, default CPU count.')
+def build_index(workers):
     """ Build articles searcher engine index. """
-    for article in Article.query.all():
-        article._build_index()
+    start = time.perf_counter()
+
+    def progress(done, total):
+        elapsed = time.perf_counter() - start
+        print(f'Tokenized {done}/{total} articles, {done / elapsed:.1f} articles/s')
+
+    count = bulk_build_index(workers=workers, progress=progress)
+    print(f'Indexed {count} articles in {time.perf_counter() - start:.1f}s')
+
+
+@build_cli.command('search-snapshot')
+@click.option('--path', default=None, help='snapshot file, default SEARCH_SNAPSHOT_PATH')
+def build_search_snapshot(path):
+    """ Dump searcher engine index to a memory-mapped snapshot. """
+    path = path or app.config['SEARCH_SNAPSHOT_PATH']
+    if not path:
+        raise click.UsageError('--path or SEARCH_SNAPSHOT_PATH is required')
+    start = time.perf_counter()
+    term_count = build_snapshot(path)
+    elapsed = time.perf_counter() - start
+    print(f'{term_count} terms -> {path} ({os.path.getsize(path)} bytes, {elapsed:.2f}s)')
+
+
+@build_cli.command('fingerprints')
+def build_fingerprints():
+    """ Save SimHash fingerprints of articles that have none. """
+    articles = Article.query.outerjoin(Fingerprint, Fingerprint.article_id == Article.id) \
+        .filter(Fingerprint.article_id.is_(None)).all()
+    for article in articles:
+        article._save_fingerprint()
+    print(f'Saved fingerprints of {len(articles)} articles')
+
+
+@build_cli.command('related-backfill')
+def build_related_backfill():
+    """ Convert similarity sorted sets keyed by title into the related-articles store. """
+    count = related.backfill()
+    print(f'Converted similar articles of {count} articles')
+
+
+@build_cli.command('item-model')
+def build_item_model():
+    """ Compute the item similarity model used for recommendations. """
+    start = time.perf_counter()
+    version = item_model.build()
+    print(f'Built item model v{version} in {time.perf_counter() - start:.2f}s')
 
 
 @build_cli.command('critics')
@@ -95,17 +152,190 @@ def build_critics():
 
 
 @build_cli.command('similarity')
-def build_similarity():
+@click.option('--approximate/--exact', default=None,
+              help='Use MinHash/LSH candidates, default when there are more than SIMILARITY_LSH_THRESHOLD articles.')
+def build_similarity(approximate):
     """ Cache all articles similarities. """
-    for a, b in combinations(Article.query.all(), 2):
-        simi = similarity(a.content, b.content)
-        redis.zadd(a.title, {b.title: simi})
-        redis.zadd(b.title, {a.title: simi})
-        print(f'Cache similarity of {a.title} & {b.title} := {simi}')
+    start = time.perf_counter()
+    articles = Article.query.all()
+    fields = [article.fields for article in articles]
+    analyses = token_cache.analyze_many(fields)
+    weights = {article.id: Article.weights_of(analysis) for article, analysis in zip(articles, analyses)}
+    if approximate is None:
+        approximate = len(articles) > app.config['SIMILARITY_LSH_THRESHOLD']
+    compute = approximate_similar_articles if approximate else similar_articles
+    neighbours = compute(weights, app.config['SIMILAR_ARTICLES'])
+    related.store(neighbours, keys={article.id: token_cache.cache_key(f) for article, f in zip(articles, fields)})
+    print(f'Cached similarities of {len(articles)} articles in {time.perf_counter() - start:.2f}s')
 
 
 app.cli.add_command(build_cli)
 
 
+bench_cli = AppGroup('bench')
+
+
+def _index_per_row(article, terms):
+    """ 逐行建立索引：每个词单独查询、插入并提交，即批量写入之前的方式，作为`bench index`的基准 """
+    segment = Segment.current()
+    db.session.commit()
+    for value, (weight, locations) in terms.items():
+        word = Words.query.filter_by(value=value).first()
+        if word is None:
+            word = Words(value=value)
+            db.session.add(word)
+            db.session.commit()
+        db.session.add(Posting(word_id=word.id, article_id=article.id, segment_id=segment.id,
+                               frequency=len(locations), weight=weight,
+                               positions=encode_positions(locations)))
+        db.session.commit()
+    return len(terms)
+
+
+@bench_cli.command('index')
+@click.option('--repeat', default=5, help='Times the sample text is repeated.')
+@click.option('--per-row', is_flag=True, help='Also time the old per-row path as a baseline.')
+def bench_index(repeat, per_row):
+    """ Measure index building throughput (posting rows/second). """
+    sample = ' '.join(article.body for article in Article.query.limit(3)) \
+        or '进程调度是操作系统的核心功能之一，Redis 使用单线程处理请求。'
+    article = Article(title='__bench_index__', name='__bench_index__',
+                      body='\n'.join([sample] * repeat))
+    article.set_category('未分类')
+    db.session.add(article)
+    db.session.commit()
+    max_word_id = db.session.query(db.func.max(Words.id)).scalar() or 0
+
+    def clear_words():
+        Words.query.filter(Words.id > max_word_id).delete(synchronize_session=False)
+        db.session.commit()
+
+    print(f'Backend: {db.engine.dialect.name}')
+    try:
+        terms, _, _ = analyze(article.fields)
+        tokens = sum(len(locations) for _, locations in terms.values())
+        if per_row:
+            start = time.perf_counter()
+            rows = _index_per_row(article, terms)
+            elapsed = time.perf_counter() - start
+            print(f'Per-row: {rows} posting rows in {elapsed:.3f}s, {rows / elapsed:.0f} rows/s')
+            Posting.query.filter_by(article_id=article.id).delete(synchronize_session=False)
+            clear_words()
+
+        start = time.perf_counter()
+        article._build_index()
+        elapsed = time.perf_counter() - start
+        rows = article.postings.count()
+        print(f'Bulk: {tokens} tokens -> {rows} posting rows in {elapsed:.3f}s, '
+              f'{rows / elapsed:.0f} rows/s, {tokens / elapsed:.0f} tokens/s')
+        start = time.perf_counter()
+        article._rebuild_index()
+        print(f'Rebuild in {time.perf_counter() - start:.3f}s')
+    finally:
+        article.delete()
+        clear_words()
+
+
+@bench_cli.command('similarity')
+@click.option('--articles', default=300, help='Number of fake articles.')
+@click.option('--fake/--real', default=True, help='Use fakeredis or REDIS_URL.')
+def bench_similarity(articles, fake):
+    """ Measure similarity cache writes (pairs/second). """
+    if fake:
+        import fakeredis
+        client = fakeredis.FakeStrictRedis()
+    else:
+        client = binary_redis
+    titles = {i: f'__bench_similarity__{i}' for i in range(articles)}
+    neighbours = {i: [(j, 1 / (1 + abs(i - j))) for j in titles if j != i] for i in titles}
+    pairs = articles * (articles - 1) // 2
+
+    print(f'Backend: {"fakeredis" if fake else app.config["REDIS_URL"]}')
+    try:
+        start = time.perf_counter()
+        for a, b in combinations(titles, 2):
+            score = 1 / (1 + abs(a - b))
+            client.zadd(titles[a], {titles[b]: score})
+            client.zadd(titles[b], {titles[a]: score})
+        elapsed = time.perf_counter() - start
+        print(f'ZADD per pair: {pairs} pairs in {elapsed:.3f}s, {pairs / elapsed:.0f} pairs/s')
+
+        start = time.perf_counter()
+        related.store(neighbours, client=client, key='__bench_similarity__', floors_key='__bench_floors__')
+        elapsed = time.perf_counter() - start
+        print(f'Packed HSET per {related.PIPELINE_SIZE} articles: {pairs} pairs in {elapsed:.3f}s, '
+              f'{pairs / elapsed:.0f} pairs/s')
+        zset_memory = sum(client.memory_usage(title) or 0 for title in titles.values()) if not fake else None
+        hash_memory = client.memory_usage('__bench_similarity__') if not fake else None
+        if zset_memory:
+            print(f'Memory: {zset_memory} bytes in sorted sets, {hash_memory} bytes packed')
+    finally:
+        client.delete(*titles.values(), '__bench_similarity__', '__bench_floors__')
+
+
+@bench_cli.command('lsh')
+@click.option('--articles', default=2000, help='Number of fake articles.')
+@click.option('--topics', default=100, help='Number of topics the fake articles are drawn from.')
+def bench_lsh(articles, topics):
+    """ Measure MinHash/LSH recall and latency against exact similarities. """
+    import random
+    rng = random.Random(0)
+    k = app.config['SIMILAR_ARTICLES']
+    # 每篇文章的词大部分来自所属主题的词表，其余来自公共词表
+    vocabularies = [[f't{topic}w{i}' for i in range(50)] for topic in range(topics)]
+    common = [f'c{i}' for i in range(2000)]
+    weights = {}
+    for article_id in range(articles):
+        words = rng.sample(vocabularies[article_id % topics], 30) + rng.sample(common, 20)
+        weights[article_id] = {word: rng.randint(1, 5) for word in words}
+
+    start = time.perf_counter()
+    exact = similar_articles(weights, k)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    approximate = approximate_similar_articles(weights, k)
+    approximate_time = time.perf_counter() - start
+
+    found = sum(len({i for i, _ in approximate[a]} & {i for i, _ in exact[a]}) for a in weights)
+    total = sum(len(exact[a]) for a in weights)
+    print(f'{articles} articles, top {k}')
+    print(f'Exact:  {exact_time:.3f}s, {exact_time / articles * 1000:.2f}ms/article')
+    print(f'MinHash/LSH: {approximate_time:.3f}s, {approximate_time / articles * 1000:.2f}ms/article, '
+          f'recall {found / (total or 1):.3f}')
+
+
+app.cli.add_command(bench_cli)
+
+
+report_cli = AppGroup('report')
+
+
+@report_cli.command('stop-words')
+@click.option('--limit', default=30, help='Number of stop words to show.')
+def report_stop_words(limit):
+    """ Show postings and positions eliminated by each stop word. """
+    postings, positions = Counter(), Counter()
+    for article in Article.query.all():
+        counts = stop_word_counts(article.fields)
+        postings.update(counts.keys())
+        positions.update(counts)
+    indexed = Posting.query.count()
+
+    print(f'{"word":<8}{"postings":>10}{"positions":>12}')
+    for word, count in postings.most_common(limit):
+        print(f'{word:<8}{count:>10}{positions[word]:>12}')
+    total = sum(postings.values())
+    print(f'{len(STOP_WORDS)} stop words eliminated {total} postings '
+          f'({total / ((indexed + total) or 1):.1%}), {sum(positions.values())} positions')
+
+    # 停用词表修改前建立的索引
+    stale = Words.query.filter(Words.value.in_(STOP_WORDS), Words.df > 0).count()
+    if stale:
+        print(f'{stale} stop words are still indexed, rebuild the index to remove them')
+
+
+app.cli.add_command(report_cli)
+
+
 if __name__ == '__main__':
     app.run()
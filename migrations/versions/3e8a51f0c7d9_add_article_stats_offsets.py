@@ -0,0 +1,26 @@
+"""add article_stats offsets
+
+Revision ID: 3e8a51f0c7d9
+Revises: b91e4a7c05d2
+Create Date: 2026-10-18 15:20:11.318902
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e8a51f0c7d9'
+down_revision = 'b91e4a7c05d2'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # 已索引的文章没有位置到正文字符区间的映射，摘要从正文开头截取，重新建立索引后生效
+    op.add_column('article_stats', sa.Column('body_position', sa.Integer(), nullable=True))
+    op.add_column('article_stats', sa.Column('offsets', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('article_stats') as batch_op:
+        batch_op.drop_column('offsets')
+        batch_op.drop_column('body_position')
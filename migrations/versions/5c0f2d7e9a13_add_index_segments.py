@@ -0,0 +1,88 @@
+"""add index segments
+
+Revision ID: 5c0f2d7e9a13
+Revises: 3e8a51f0c7d9
+Create Date: 2026-10-18 17:42:35.120487
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c0f2d7e9a13'
+down_revision = '3e8a51f0c7d9'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def _create_postings(name, with_segment):
+    columns = [
+        sa.Column('word_id', sa.Integer(), nullable=False),
+        sa.Column('article_id', sa.Integer(), nullable=False),
+    ]
+    key = ['word_id', 'article_id']
+    if with_segment:
+        columns.append(sa.Column('segment_id', sa.Integer(), nullable=False))
+        key.append('segment_id')
+    op.create_table(name,
+    *columns,
+    sa.Column('frequency', sa.Integer(), nullable=True),
+    sa.Column('weight', sa.Float(), nullable=True),
+    sa.Column('positions', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ),
+    sa.ForeignKeyConstraint(['word_id'], ['words.id'], ),
+    *([sa.ForeignKeyConstraint(['segment_id'], ['segments.id'], )] if with_segment else []),
+    sa.PrimaryKeyConstraint(*key)
+    )
+
+
+def _replace_postings(with_segment, select):
+    # 主键改变，新建表后复制数据，兼容不支持修改主键的SQLite
+    _create_postings('postings_tmp', with_segment)
+    op.execute(f'INSERT INTO postings_tmp {select}')
+    op.drop_index(op.f('ix_postings_article_id'), table_name='postings')
+    op.drop_table('postings')
+    op.rename_table('postings_tmp', 'postings')
+    op.create_index(op.f('ix_postings_article_id'), 'postings', ['article_id'], unique=False)
+
+
+def upgrade():
+    op.create_table('segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('doc_count', sa.Integer(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('tombstones',
+    sa.Column('segment_id', sa.Integer(), nullable=False),
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['segment_id'], ['segments.id'], ),
+    sa.PrimaryKeyConstraint('segment_id', 'article_id')
+    )
+
+    # 已有的索引作为第一个段，之后新建立的索引追加到新的段中
+    op.execute(
+        'INSERT INTO segments (id, size, doc_count, timestamp) '
+        'SELECT 1, 1000000, COUNT(*), CURRENT_TIMESTAMP FROM article_stats'
+    )
+    _replace_postings(True, 'SELECT word_id, article_id, 1, frequency, weight, positions FROM postings')
+
+    with op.batch_alter_table('article_stats') as batch_op:
+        batch_op.add_column(sa.Column('segment_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_article_stats_segment_id', 'segments', ['segment_id'], ['id'])
+    op.execute('UPDATE article_stats SET segment_id = 1')
+
+
+def downgrade():
+    # 先删除已经失效的posting，每篇文章只保留一个版本
+    op.execute(
+        'DELETE FROM postings WHERE EXISTS (SELECT 1 FROM tombstones '
+        'WHERE tombstones.segment_id = postings.segment_id '
+        'AND tombstones.article_id = postings.article_id)'
+    )
+    with op.batch_alter_table('article_stats') as batch_op:
+        batch_op.drop_constraint('fk_article_stats_segment_id', type_='foreignkey')
+        batch_op.drop_column('segment_id')
+    _replace_postings(False, 'SELECT word_id, article_id, frequency, weight, positions FROM postings')
+    op.drop_table('tombstones')
+    op.drop_table('segments')
@@ -0,0 +1,108 @@
+"""replace wordlocation with postings
+
+Revision ID: 7d3f1c9a2b64
+Revises: 2c42d3d4591d
+Create Date: 2026-10-18 10:12:03.318264
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d3f1c9a2b64'
+down_revision = '2c42d3d4591d'
+
+from itertools import groupby
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.postings import encode_positions, decode_positions
+
+
+BATCH_SIZE = 1000
+
+wordlocation = sa.table(
+    'wordlocation',
+    sa.column('id', sa.Integer),
+    sa.column('location', sa.Integer),
+    sa.column('word_id', sa.Integer),
+    sa.column('article_id', sa.Integer),
+)
+
+postings = sa.table(
+    'postings',
+    sa.column('word_id', sa.Integer),
+    sa.column('article_id', sa.Integer),
+    sa.column('frequency', sa.Integer),
+    sa.column('positions', sa.LargeBinary),
+)
+
+
+def _insert_batches(conn, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def upgrade():
+    op.create_table('postings',
+    sa.Column('word_id', sa.Integer(), nullable=False),
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.Column('frequency', sa.Integer(), nullable=True),
+    sa.Column('positions', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ),
+    sa.ForeignKeyConstraint(['word_id'], ['words.id'], ),
+    sa.PrimaryKeyConstraint('word_id', 'article_id')
+    )
+    op.create_index(op.f('ix_postings_article_id'), 'postings', ['article_id'], unique=False)
+
+    # 将每个(词, 文章)的所有位置合并为一条posting
+    # PostgreSQL使用服务端游标逐批读取；MySQL的流式游标不允许同时执行INSERT
+    conn = op.get_bind()
+    reader = conn.execution_options(stream_results=conn.dialect.name == 'postgresql')
+    rows = reader.execute(
+        sa.select([wordlocation.c.word_id, wordlocation.c.article_id, wordlocation.c.location])
+        .where(wordlocation.c.word_id.isnot(None))
+        .where(wordlocation.c.article_id.isnot(None))
+        .order_by(wordlocation.c.word_id, wordlocation.c.article_id, wordlocation.c.location)
+    )
+    grouped = groupby(rows, key=lambda row: (row[0], row[1]))
+    _insert_batches(conn, postings, (
+        {
+            'word_id': word_id,
+            'article_id': article_id,
+            'frequency': len(locations),
+            'positions': encode_positions(locations),
+        }
+        for (word_id, article_id), group in grouped
+        for locations in [[row[2] for row in group]]
+    ))
+
+    op.drop_table('wordlocation')
+
+
+def downgrade():
+    op.create_table('wordlocation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('location', sa.Integer(), nullable=True),
+    sa.Column('word_id', sa.Integer(), nullable=True),
+    sa.Column('article_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ),
+    sa.ForeignKeyConstraint(['word_id'], ['words.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    conn = op.get_bind()
+    rows = conn.execute(sa.select([postings.c.word_id, postings.c.article_id, postings.c.positions]))
+    _insert_batches(conn, wordlocation, (
+        {'word_id': word_id, 'article_id': article_id, 'location': location}
+        for word_id, article_id, positions in rows.fetchall()
+        for location in decode_positions(positions)
+    ))
+
+    op.drop_index(op.f('ix_postings_article_id'), table_name='postings')
+    op.drop_table('postings')
@@ -0,0 +1,38 @@
+"""add article fingerprints
+
+Revision ID: 8f4b2d6c1a37
+Revises: 5c0f2d7e9a13
+Create Date: 2026-10-18 21:05:42.114250
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8f4b2d6c1a37'
+down_revision = '5c0f2d7e9a13'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # 已有文章的指纹由`flask build fingerprints`生成
+    op.create_table(
+        'article_fingerprints',
+        sa.Column('article_id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=True),
+        sa.Column('block_0', sa.Integer(), nullable=True),
+        sa.Column('block_1', sa.Integer(), nullable=True),
+        sa.Column('block_2', sa.Integer(), nullable=True),
+        sa.Column('block_3', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ),
+        sa.PrimaryKeyConstraint('article_id')
+    )
+    for i in range(4):
+        op.create_index(op.f(f'ix_article_fingerprints_block_{i}'), 'article_fingerprints',
+                        [f'block_{i}'], unique=False)
+
+
+def downgrade():
+    for i in range(4):
+        op.drop_index(op.f(f'ix_article_fingerprints_block_{i}'), table_name='article_fingerprints')
+    op.drop_table('article_fingerprints')
@@ -0,0 +1,53 @@
+"""add bm25 statistics
+
+Revision ID: b91e4a7c05d2
+Revises: 7d3f1c9a2b64
+Create Date: 2026-10-18 11:02:47.904511
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b91e4a7c05d2'
+down_revision = '7d3f1c9a2b64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('words', sa.Column('df', sa.Integer(), nullable=True))
+    op.add_column('postings', sa.Column('weight', sa.Float(), nullable=True))
+    op.create_table('article_stats',
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.Column('length', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ),
+    sa.PrimaryKeyConstraint('article_id')
+    )
+    op.create_table('corpus_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doc_count', sa.Integer(), nullable=True),
+    sa.Column('total_length', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # 由已有的posting计算统计量，升级后可以直接搜索；
+    # 旧索引没有区分字段，权重暂时等于词频，运行`flask build index`后按字段加权
+    op.execute('UPDATE postings SET weight = frequency')
+    op.execute('UPDATE words SET df = (SELECT COUNT(*) FROM postings WHERE postings.word_id = words.id)')
+    op.execute(
+        'INSERT INTO article_stats (article_id, length) '
+        'SELECT article_id, SUM(frequency) FROM postings GROUP BY article_id'
+    )
+    op.execute(
+        'INSERT INTO corpus_stats (id, doc_count, total_length) '
+        'SELECT 1, COUNT(*), COALESCE(SUM(length), 0) FROM article_stats'
+    )
+
+
+def downgrade():
+    op.drop_table('corpus_stats')
+    op.drop_table('article_stats')
+    with op.batch_alter_table('postings') as batch_op:
+        batch_op.drop_column('weight')
+    with op.batch_alter_table('words') as batch_op:
+        batch_op.drop_column('df')
@@ -1,5 +1,6 @@
 from app import create_app, db
-from app.models import Article, Role, User
+from app.exceptions import DuplicateError
+from app.models import Article, Role, User, Fingerprint
 from app.utils.markdown import MD
 from app.utils.convert import todatetime
 
@@ -15,6 +16,12 @@ def log_md(category_name, article_name, content):
         article_name <str>: 文件名
         content <str>: 文件内容
     """
+    try:
+        content_fingerprint = Article.check_duplicate(content)
+    except DuplicateError as exp:
+        print(exp)
+        return False
+
     article = Article()
 
     article.body = content
@@ -32,6 +39,8 @@ def log_md(category_name, article_name, content):
         article.change_category(category_name)
         article.add_tags(tag_names)
         db.session.add(article)
+        db.session.flush()
+        Fingerprint.save(article.id, content_fingerprint)
         db.session.commit()
     except Exception:
         db.session.rollback()
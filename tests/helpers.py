@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+from unittest import mock
+
+from app.utils import neighbours
+
+
+@contextmanager
+def concurrent_merge(write):
+    """ 第一次合并相似列表(`app.utils.neighbours.merge`)之前调用write，
+    模拟另一个worker在事务读取之后、提交之前修改了列表
+    Yields:
+        每次合并的参数组成的list，WATCH冲突后重新合并的调用也会记录
+    """
+    merge = neighbours.merge
+    calls = []
+
+    def side_effect(*args):
+        if not calls:
+            write()
+        calls.append(args)
+        return merge(*args)
+
+    with mock.patch.object(neighbours, 'merge', side_effect=side_effect):
+        yield calls
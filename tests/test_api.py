@@ -3,7 +3,8 @@ import json
 import re
 from base64 import b64encode
 from app import create_app, db
-from app.models import User, Role, Article, Comment
+from app.models import User, Role, Article, Comment, Fingerprint
+from tests.helpers import concurrent_merge
 
 
 class APITestCase(unittest.TestCase):
@@ -200,6 +201,43 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(json_response['body'], 'updated body')
         self.assertEqual(json_response['body_html'], '<p>updated body</p>')
 
+    def test_sync_duplicate(self):
+        a = Role.query.filter_by(name='Author').first()
+        u = User(email='john@example.com', password='cat', confirmed=True, role=a)
+        db.session.add(u)
+        db.session.commit()
+        body = (
+            '操作系统通过进程调度算法决定下一个运行的进程。常见的调度算法有先来先服务、短作业优先、优先级调度与时间片轮转。'
+            '先来先服务按照进程到达的顺序分配处理器，实现简单但是平均等待时间较长。'
+            '短作业优先每次选择估计运行时间最短的进程，可以使平均等待时间最小，但是长作业可能一直得不到运行。'
+            '时间片轮转为每个进程分配一个固定长度的时间片，时间片用完后进程回到就绪队列的末尾，适合分时系统。'
+        )
+
+        def sync(title, content):
+            return self.client.post(
+                '/api/sync-article/',
+                headers=self.get_api_headers('john@example.com', 'cat'),
+                data=json.dumps({
+                    'article_file_name': '2018-01-01-post.md',
+                    'category_name': 'Program',
+                    'content': f'title: {title}\n\n{content}',
+                })
+            )
+
+        response = sync('进程调度', body)
+        self.assertEqual(response.status_code, 201)
+        article = Article.query.filter_by(title='进程调度').first()
+        self.assertIsNotNone(Fingerprint.query.get(article.id))
+
+        # 标题不同、内容几乎相同的文章被拒绝，不写入数据库
+        response = sync('进程调度算法', body + '\n以上。')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(json.loads(response.get_data(as_text=True))['duplicates']), 1)
+        self.assertIsNone(Article.query.filter_by(title='进程调度算法').first())
+
+        response = sync('网络协议', 'TCP通过三次握手建立连接，通过滑动窗口进行流量控制与拥塞控制。')
+        self.assertEqual(response.status_code, 201)
+
     def test_users(self):
         # 增加两个普通用户
         r = Role.query.filter_by(name='User').first()
@@ -316,3 +354,174 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertEqual(json_response.get('count', 0), 2)
+
+    def test_recommendation(self):
+        from app import redis, binary_redis
+        from app.models import Rating
+        from app.utils import item_model
+        from app.utils.recommender import (person_prefs, transform_prefs,
+                                           calculate_similar_items, get_recommended_items)
+        redis.delete(item_model.VERSION_KEY, *redis.keys(item_model.USER_CACHE_KEY.format('*')))
+        binary_redis.delete(item_model.ITEM_MATCH_KEY)
+
+        r = Role.query.filter_by(name='User').first()
+        users = {name: User(email=f'{i}@example.com', username=f'user{i}', password='cat', confirmed=True, role=r)
+                 for i, name in enumerate(person_prefs)}
+        titles = sorted(transform_prefs(person_prefs))
+        articles = {title: Article(title=title, name=title, body=title) for title in titles}
+        db.session.add_all(list(users.values()) + list(articles.values()))
+        db.session.commit()
+        db.session.add_all([
+            Rating(user_id=users[name].id, article_id=articles[title].id, value=value * 2)
+            for name, prefs in person_prefs.items() for title, value in prefs.items()
+        ])
+        db.session.commit()
+
+        def expected(prefs, name):
+            item_match = calculate_similar_items(transform_prefs(prefs))
+            return get_recommended_items(prefs, item_match, name)
+
+        # 与直接使用person_prefs计算的推荐结果一致
+        prefs = {name: {title: value * 2 for title, value in ratings.items()} for name, ratings in person_prefs.items()}
+        self.assertEqual(item_model.build(), 1)
+        recommended = item_model.recommend(users['Toby'].id)
+        self.assertEqual([article_id for _, article_id in recommended],
+                         [articles[title].id for _, title in expected(prefs, 'Toby')])
+        for (score, _), (expected_score, _) in zip(recommended, expected(prefs, 'Toby')):
+            self.assertAlmostEqual(score, expected_score, places=5)
+
+        response = self.client.get(f'/api/users/{users["Toby"].id}/recommendation/')
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([item['title'] for item in json_response], [title for _, title in expected(prefs, 'Toby')])
+
+        # 增量更新后与重新计算的模型一致，版本号不变
+        db.session.add(Rating(user_id=users['Toby'].id, article_id=articles['Just My Luck'].id, value=2))
+        db.session.commit()
+        prefs['Toby']['Just My Luck'] = 2
+        item_model.update(articles['Just My Luck'].id)
+        self.assertEqual(item_model.version(), 1)
+        incremental = {title: item_model.unpack(binary_redis.hget(item_model.ITEM_MATCH_KEY, article.id))
+                       for title, article in articles.items()}
+        for title, similar in calculate_similar_items(transform_prefs(prefs)).items():
+            self.assertEqual({other_id: round(score, 5) for other_id, score in incremental[title]},
+                             {articles[other].id: round(score, 5) for score, other in similar})
+        self.assertEqual(item_model.recommend(users['Toby'].id)[0][1], articles['The Night Listener'].id)
+
+    def test_concurrent_item_model_update(self):
+        from unittest import mock
+        from app import redis, binary_redis
+        from app.models import Rating
+        from app.utils import item_model
+        redis.delete(item_model.VERSION_KEY, *redis.keys(item_model.USER_CACHE_KEY.format('*')))
+        binary_redis.delete(item_model.ITEM_MATCH_KEY, item_model.PENDING_KEY)
+
+        r = Role.query.filter_by(name='User').first()
+        u1 = User(email='john@example.com', username='john', password='cat', confirmed=True, role=r)
+        u2 = User(email='susan@example.com', username='susan', password='dog', confirmed=True, role=r)
+        a1, a2, a3, a4 = [Article(title=title, name=title, body=title) for title in ('a1', 'a2', 'a3', 'a4')]
+        db.session.add_all([u1, u2, a1, a2, a3, a4])
+        db.session.commit()
+        db.session.add_all([
+            Rating(user_id=u1.id, article_id=a1.id, value=4),
+            Rating(user_id=u1.id, article_id=a2.id, value=5),
+            Rating(user_id=u2.id, article_id=a1.id, value=4),
+        ])
+        db.session.commit()
+        item_model.build()
+
+        def get(article_id):
+            return dict(item_model.unpack(binary_redis.hget(item_model.ITEM_MATCH_KEY, article_id)))
+
+        # 另一个worker在读取之后、提交之前修改了a1的相似文章，冲突后重新读取并合并
+        def write():
+            binary_redis.hset(item_model.ITEM_MATCH_KEY, a1.id,
+                              item_model.pack(list(get(a1.id).items()) + [(999, 0.01)]))
+
+        db.session.add(Rating(user_id=u1.id, article_id=a3.id, value=5))
+        db.session.commit()
+        with concurrent_merge(write) as calls:
+            item_model.update(a3.id)
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(set(get(a1.id)), {a2.id, a3.id, 999})
+
+        # 计算期间增量更新的文章，替换模型后重新更新
+        calculate = item_model.calculate_similar_items
+
+        def concurrent_calculate(*args, **kwargs):
+            item_match = calculate(*args, **kwargs)
+            db.session.add(Rating(user_id=u2.id, article_id=a4.id, value=5))
+            db.session.commit()
+            item_model.update(a4.id)
+            return item_match
+
+        with mock.patch.object(item_model, 'calculate_similar_items', side_effect=concurrent_calculate):
+            item_model.build()
+        self.assertIn(a4.id, get(a1.id))
+        self.assertIn(a1.id, get(a4.id))
+
+    def test_recommendation_build_once(self):
+        from unittest import mock
+        from app import redis
+        from app.utils import item_model
+        redis.delete(item_model.VERSION_KEY, item_model.BUILD_LOCK_KEY)
+
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+
+        # 模型还没有计算过时，多个请求只提交一次计算任务
+        with mock.patch('app.api.users.build_item_model') as build_item_model:
+            for _ in range(2):
+                response = self.client.get(f'/api/users/{u.id}/recommendation/')
+                self.assertEqual(response.status_code, 200)
+        build_item_model.delay.assert_called_once_with()
+        redis.delete(item_model.BUILD_LOCK_KEY)
+
+    def test_recommendation_cache(self):
+        from app import redis, binary_redis
+        from app.models import Rating
+        from app.utils import item_model
+        redis.delete(item_model.VERSION_KEY, *redis.keys(item_model.USER_CACHE_KEY.format('*')))
+        binary_redis.delete(item_model.ITEM_MATCH_KEY)
+
+        r = Role.query.filter_by(name='User').first()
+        u1 = User(email='john@example.com', username='john', password='cat', confirmed=True, role=r)
+        u2 = User(email='susan@example.com', username='susan', password='dog', confirmed=True, role=r)
+        a1, a2, a3 = [Article(title=title, name=title, body=title) for title in ('a1', 'a2', 'a3')]
+        db.session.add_all([u1, u2, a1, a2, a3])
+        db.session.commit()
+        db.session.add_all([
+            Rating(user_id=u1.id, article_id=a1.id, value=4),
+            Rating(user_id=u1.id, article_id=a2.id, value=5),
+            Rating(user_id=u2.id, article_id=a1.id, value=4),
+        ])
+        db.session.commit()
+        item_model.build()
+
+        url = f'/api/users/{u2.id}/recommendation/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['title'] for item in json.loads(response.get_data(as_text=True))], ['a2'])
+        self.assertIsNotNone(redis.get(item_model.USER_CACHE_KEY.format(u2.id)))
+
+        # 未改变时浏览器可以用ETag验证
+        response = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        # 模型没有改变时使用缓存的结果
+        db.session.add(Rating(user_id=u1.id, article_id=a3.id, value=5))
+        db.session.commit()
+        item_model.update(a3.id)
+        self.assertEqual([article_id for _, article_id in item_model.cached_recommend(u2.id)], [a2.id])
+
+        # 用户评分后删除缓存
+        item_model.invalidate(u2.id)
+        self.assertEqual([article_id for _, article_id in item_model.cached_recommend(u2.id)], [a3.id, a2.id])
+
+        # 模型版本号改变后重新计算
+        Rating.query.filter_by(user_id=u1.id, article_id=a3.id).delete()
+        db.session.commit()
+        item_model.build()
+        self.assertEqual([article_id for _, article_id in item_model.cached_recommend(u2.id)], [a2.id])
@@ -0,0 +1,571 @@
+import os
+import math
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+from app import create_app, db, redis, binary_redis
+from app.models import Article, Words, Posting, ArticleStats, CorpusStats, Segment, Tombstone
+from app.utils import search_cache, snapshot
+from app.utils.snippets import make_snippets, MAX_SNIPPET_CHARS
+from app.utils.facets import Filters
+from app.utils import indexer, token_cache, tokenizer, related
+from app.utils.similarity import get_words_weight
+from app.utils.analyzer import tokenize, stop_word_counts
+from app.utils.query_parser import parse
+from app.utils.tfidf import TfidfMatrix, similar_articles
+from app.utils.minhash import approximate_similar_articles
+from app.utils.searcher import (query, search, paginate, get_query_words, get_matches,
+                                 top_k, bm25, idf, SqlIndex)
+from tests.helpers import concurrent_merge
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        # 每个测试使用新的数据库，之前缓存的查询结果不再有效
+        search_cache.bump_generation()
+        search_cache.local_cache.clear()
+        related._index = None
+        redis.delete(related.SIMILARITY_KEYS, related.RELATED_KEY, *redis.keys(related.FLOORS_KEY.format('*')))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_article(self, title, body, category='Program', tags=('test',)):
+        article = Article(title=title, name=title, body=body)
+        article.set_category(category)
+        article.add_tags(list(tags))
+        db.session.add(article)
+        db.session.commit()
+        return article
+
+    def test_build_index(self):
+        article = self.add_article('进程调度', '操作系统的进程调度算法，调度进程。')
+        article._build_index()
+        self.assertTrue(article._is_indexed())
+        values = {word.value for word in Words.query.all()}
+        self.assertIn('进程', values)
+        self.assertIn('调度', values)
+        self.assertNotIn('的', values)
+        # 每个(词, 文章)只有一条posting，记录所有出现位置
+        word = Words.query.filter_by(value='调度').first()
+        posting = Posting.query.filter_by(word_id=word.id, article_id=article.id).one()
+        self.assertEqual(posting.frequency, len(posting.locations))
+        self.assertGreater(posting.frequency, 1)
+        self.assertEqual(posting.locations, sorted(posting.locations))
+        # 重复建立索引不会产生新的记录
+        count = Posting.query.count()
+        article._build_index()
+        self.assertEqual(Posting.query.count(), count)
+
+    def test_build_index_reuses_words(self):
+        a = self.add_article('进程', '进程调度')
+        b = self.add_article('线程', '线程调度')
+        a._build_index()
+        b._build_index()
+        self.assertEqual(Words.query.filter_by(value='调度').count(), 1)
+        self.assertEqual(
+            {posting.article_id for posting in Words.query.filter_by(value='调度').first().postings},
+            {a.id, b.id}
+        )
+
+    def test_delete_index(self):
+        article = self.add_article('进程调度', '操作系统的进程调度算法')
+        article._build_index()
+        article._delete_index()
+        self.assertFalse(article._is_indexed())
+        self.assertIsNone(ArticleStats.query.get(article.id))
+        self.assertEqual(Words.query.filter_by(value='调度').first().df, 0)
+
+    def test_index_stats(self):
+        a = self.add_article('进程', '进程调度')
+        b = self.add_article('线程', '线程调度')
+        a._build_index()
+        b._build_index()
+        self.assertEqual(Words.query.filter_by(value='调度').first().df, 2)
+        self.assertEqual(Words.query.filter_by(value='线程').first().df, 1)
+        corpus = CorpusStats.get()
+        self.assertEqual(corpus.doc_count, 2)
+        self.assertAlmostEqual(
+            corpus.total_length,
+            ArticleStats.query.get(a.id).length + ArticleStats.query.get(b.id).length
+        )
+        b._delete_index()
+        corpus = CorpusStats.get()
+        self.assertEqual(corpus.doc_count, 1)
+        self.assertAlmostEqual(corpus.total_length, ArticleStats.query.get(a.id).length)
+
+    def test_bulk_build_index(self):
+        # 标签的添加顺序与名称顺序不同，两种建立方式中标签的位置应该相同
+        articles = [self.add_article(f'文章{i}', '进程调度 ' * (i + 1) + '内存', tags=('test', 'os', 'linux'))
+                    for i in range(5)]
+        articles[0]._build_index()
+        expected_lengths = {}
+        for article in articles:
+            article._rebuild_index()
+            expected_lengths[article.id] = ArticleStats.query.get(article.id).length
+        expected = query('进程 调度', limit=10)
+        expected_postings = {(p.word.value, p.article_id, p.frequency, p.weight, p.positions)
+                             for p in Posting.query}
+
+        for article in articles[1:]:
+            article._delete_index()
+        self.assertEqual(Article.index_fields('t', 'c', ['test', 'os', 'linux'], 'b'),
+                         Article.index_fields('t', 'c', ['linux', 'os', 'test'], 'b'))
+        self.assertEqual({article_id: token_cache.cache_key(fields)
+                          for article_id, fields in indexer._unindexed_articles()},
+                         {article.id: token_cache.cache_key(article.fields) for article in articles[1:]})
+        progress = []
+        with mock.patch.object(indexer, 'RUN_SIZE', 2):
+            self.assertEqual(indexer.build_index(workers=2, progress=lambda *args: progress.append(args)), 4)
+        self.assertEqual(progress, [(2, 4), (4, 4)])
+        self.assertEqual(indexer.build_index(workers=1), 0)
+
+        self.assertEqual({(p.word.value, p.article_id, p.frequency, p.weight, p.positions)
+                          for p in Posting.query if (p.segment_id, p.article_id) not in Tombstone.all()},
+                         expected_postings)
+        self.assertEqual({article.id: ArticleStats.query.get(article.id).length for article in articles},
+                         expected_lengths)
+        self.assertEqual(Words.query.filter_by(value='内存').first().df, 5)
+        self.assertEqual(CorpusStats.get().doc_count, 5)
+        self.assertEqual(query('进程 调度', limit=10), expected)
+
+    def test_token_cache(self):
+        article = self.add_article('进程调度', '操作系统的进程调度算法', tags=('os', 'test'))
+        self.assertEqual(article.term_weights, dict(get_words_weight(article.content)))
+        key = token_cache.cache_key(article.fields)
+        self.assertIsNotNone(token_cache.get_many([key]).get(key))
+
+        # 内容不变时不再分词
+        token_cache.local_cache.clear()
+        with mock.patch('app.utils.analyzer.analyze') as analyze:
+            article._build_index()
+            analyze.assert_not_called()
+        self.assertEqual([a for a, _ in query('进程 调度')], [article])
+
+        article.body = '内存分页'
+        self.assertNotEqual(token_cache.cache_key(article.fields), key)
+        article._rebuild_index()
+        self.assertEqual([a for a, _ in query('分页')], [article])
+
+    def test_segments(self):
+        a = self.add_article('进程', '进程调度')
+        b = self.add_article('线程', '线程调度')
+        a._build_index()
+        b._build_index()
+        # 当前段中的文章重建索引时直接替换
+        a.body = '协程调度'
+        a._rebuild_index()
+        self.assertEqual(Tombstone.query.count(), 0)
+        self.assertEqual({article for article, _ in query('协程')}, {a})
+
+        # 封存段中的文章重建或删除索引时只写入墓碑，查询跳过失效的posting
+        Segment.query.update({Segment.size: Segment.SEGMENT_SIZE})
+        db.session.commit()
+        a.body = '内存分页'
+        a._rebuild_index()
+        b._delete_index()
+        self.assertEqual(Tombstone.query.count(), 2)
+        self.assertEqual(Segment.query.count(), 2)
+        self.assertEqual(query('调度'), [])
+        self.assertEqual([article for article, _ in query('分页')], [a])
+        self.assertEqual(Words.query.filter_by(value='调度').first().df, 0)
+        self.assertEqual(Words.query.filter_by(value='分页').first().df, 1)
+        self.assertEqual(CorpusStats.get().doc_count, 1)
+
+        # 合并后墓碑与失效的posting被清除，查询结果不变
+        self.assertEqual(Segment.compact(), (2, 1))
+        self.assertEqual(Tombstone.query.count(), 0)
+        self.assertEqual({posting.article_id for posting in Posting.query}, {a.id})
+        self.assertEqual([article for article, _ in query('分页')], [a])
+
+        b._build_index()
+        self.assertEqual({article for article, _ in query('调度')}, {b})
+
+    def test_query(self):
+        a = self.add_article('进程调度', '操作系统的进程调度算法')
+        b = self.add_article('线程', '线程调度与锁')
+        a._build_index()
+        b._build_index()
+        self.assertEqual({article for article, _ in query('调度')}, {a, b})
+        self.assertEqual([article for article, _ in query('进程 调度')], [a])
+        self.assertEqual(query('不存在'), [])
+
+    def test_title_boost(self):
+        a = self.add_article('内存管理', '介绍分页与调度的关系')
+        b = self.add_article('调度算法', '介绍分页与内存的关系')
+        a._build_index()
+        b._build_index()
+        self.assertEqual([article for article, _ in query('调度')], [b, a])
+
+    def test_phrase_query(self):
+        a = self.add_article('笔记', '操作系统的进程调度算法')
+        b = self.add_article('杂记', '调度线程与进程')
+        c = self.add_article('随笔', '进程的调度')
+        for article in (a, b, c):
+            article._build_index()
+        self.assertEqual({article for article, _ in query('进程 调度')}, {a, b, c})
+        self.assertEqual([article for article, _ in query('"进程 调度"')], [a])
+        self.assertEqual([article for article, _ in query('"进程的调度"')], [c])
+        self.assertEqual(query('"调度 进程"'), [])
+        # 短语不跨字段匹配
+        self.assertEqual(query('"笔记 操作系统"'), [])
+
+    def test_near_query(self):
+        a = self.add_article('笔记', '内存 分页 机制')
+        b = self.add_article('杂记', '分页 的 实现 依赖 硬件 与 内存')
+        for article in (a, b):
+            article._build_index()
+        self.assertEqual({article for article, _ in query('内存 NEAR/1 分页')}, {a})
+        self.assertEqual({article for article, _ in query('内存 near/6 分页')}, {a, b})
+        self.assertEqual([article for article, _ in query('"分页 机制" NEAR/1 内存')], [a])
+
+    def test_top_k_matches_full_sort(self):
+        for i in range(12):
+            article = self.add_article(f'文章{i}', '调度 ' * (i % 5 + 1) + '内存 ' * i)
+            article._build_index()
+        index = SqlIndex()
+        words = get_query_words('调度 内存', index)
+        matches = get_matches(words, index)
+        corpus = CorpusStats.get()
+        idfs = [idf(df, corpus.doc_count) for _, df in words]
+        expected = sorted(
+            ((article_id, bm25(idfs, weights, ArticleStats.query.get(article_id).length, corpus.avg_length))
+             for article_id, weights in matches.items()),
+            key=lambda item: (item[1], item[0]),
+            reverse=True
+        )
+        for k in (1, 3, 11, 20):
+            ranked = top_k(matches, words, k, index, batch_size=2)
+            self.assertEqual([article_id for article_id, _ in ranked],
+                             [article_id for article_id, _ in expected[:k]])
+
+    def test_snapshot(self):
+        for i in range(6):
+            self.add_article(f'文章{i}', '调度 ' * (i + 1) + '内存 ' * (6 - i))._build_index()
+        self.add_article('进程调度', '进程')._build_index()
+        expected = query('调度 内存', limit=10)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'search.snapshot')
+            self.assertEqual(snapshot.build_snapshot(path), Words.query.filter(Words.df > 0).count())
+            index = snapshot.load(path)
+            self.assertIs(snapshot.load(path), index)
+            self.assertEqual(index.corpus(), SqlIndex().corpus())
+            self.assertEqual(index.lookup(['不存在']), {})
+
+            self.app.config['SEARCH_SNAPSHOT_PATH'] = path
+            self.assertEqual(query('调度 内存', limit=10), expected)
+            self.assertEqual([article.title for article, _ in query('进程')], ['进程调度'])
+            self.assertEqual(len(query('"调度 调度 调度 调度 调度"', limit=10)), 2)
+
+            # 重新生成快照后自动加载新文件
+            self.add_article('内存调度', '内存 调度')._build_index()
+            snapshot.build_snapshot(path)
+            self.assertIsNot(snapshot.load(path), index)
+            self.assertEqual(len(query('调度 内存', limit=10)), 7)
+
+    def test_paginate(self):
+        for i in range(5):
+            self.add_article(f'文章{i}', '调度 ' * (i + 1))._build_index()
+        everything = [article for article, _ in query('调度', limit=5)]
+        self.assertEqual(len(everything), 5)
+        self.assertEqual([article for article, _ in query('调度', limit=2, offset=2)], everything[2:4])
+        pagination = paginate('调度', page=3, per_page=2)
+        self.assertEqual(pagination.total, 5)
+        self.assertFalse(pagination.has_next)
+        self.assertEqual([article for article, _ in pagination.items], everything[4:])
+
+    def test_snippets(self):
+        body = '开头的介绍。' * 30 + '操作系统的进程调度算法<决定>下一个运行的进程。' + '结尾的总结。' * 30
+        article = self.add_article('笔记', body)
+        article._build_index()
+        snippet = make_snippets('进程 调度', [article.id])[article.id]
+        self.assertIn('<mark>进程</mark><mark>调度</mark>', snippet)
+        self.assertIn('&lt;决定&gt;', snippet)
+        self.assertTrue(snippet.startswith('…') and snippet.endswith('…'))
+        self.assertLessEqual(len(snippet.striptags()), MAX_SNIPPET_CHARS + 2)
+
+        # 只在标题中出现时从正文开头截取
+        snippet = make_snippets('笔记', [article.id])[article.id]
+        self.assertTrue(snippet.startswith('开头的介绍'))
+        self.assertNotIn('<mark>', snippet)
+
+    def test_facets(self):
+        a = self.add_article('进程', '进程调度', category='Program', tags=('os',))
+        b = self.add_article('线程', '线程调度', category='Program', tags=('os', 'thread'))
+        c = self.add_article('协程', '协程调度', category='Life', tags=('thread',))
+        c.timestamp = c.timestamp.replace(year=2015)
+        db.session.commit()
+        for article in (a, b, c):
+            article._build_index()
+
+        ranked, total, facets = search('调度', filters=Filters())
+        self.assertEqual(total, 3)
+        self.assertEqual(facets['category'], [['Program', 2], ['Life', 1]])
+        self.assertEqual(facets['tag'], [['os', 2], ['thread', 2]])
+        self.assertIn([2015, 1], facets['year'])
+
+        ranked, total, facets = search('调度', filters=Filters(tags=['thread']))
+        self.assertEqual({article_id for article_id, _ in ranked}, {b.id, c.id})
+        self.assertEqual(facets['category'], [['Life', 1], ['Program', 1]])
+        ranked, total, _ = search('调度', filters=Filters(category='Program', tags=['thread']))
+        self.assertEqual([article_id for article_id, _ in ranked], [b.id])
+        ranked, total, _ = search('调度', filters=Filters(year_from=2010, year_to=2016))
+        self.assertEqual([article_id for article_id, _ in ranked], [c.id])
+        self.assertEqual(search('调度', filters=Filters(category='不存在'))[:2], ([], 0))
+
+        client = self.app.test_client()
+        response = client.get('/search?query=调度&tag=thread&category=Life')
+        self.assertIn('协程', response.get_data(as_text=True))
+        self.assertNotIn('线程', response.get_data(as_text=True))
+        response = client.get('/api/search/?q=调度&tag=os')
+        self.assertEqual(response.get_json()['count'], 2)
+        self.assertEqual(response.get_json()['facets']['tag'], [['os', 2], ['thread', 1]])
+
+    def test_search_view(self):
+        self.add_article('进程调度', '操作系统的进程调度算法')._build_index()
+        client = self.app.test_client()
+        response = client.get('/search?query=调度&page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('进程调度', response.get_data(as_text=True))
+        self.assertIn('<mark>调度</mark>', response.get_data(as_text=True))
+        response = client.get('/search?query=调度&page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('无匹配结果', response.get_data(as_text=True))
+
+    def test_suggest(self):
+        self.add_article('进程调度', '进程 进程 进行')._build_index()
+        self.add_article('进程管理', '进程')._build_index()
+        client = self.app.test_client()
+        response = client.get('/api/search/suggest?q=进')
+        self.assertEqual(response.status_code, 200)
+        suggestions = response.get_json()['suggestions']
+        self.assertEqual(suggestions[0], '进程')
+        self.assertIn('进行', suggestions)
+        self.assertTrue(all(word.startswith('进') for word in suggestions))
+
+        # 删除索引后不再补全只在该文章中出现的词
+        Article.query.filter_by(title='进程调度').first()._delete_index()
+        suggestions = client.get('/api/search/suggest?q=进&limit=20').get_json()['suggestions']
+        self.assertIn('进程', suggestions)
+        self.assertNotIn('进行', suggestions)
+        self.assertEqual(client.get('/api/search/suggest?q=').get_json()['suggestions'], [])
+
+    def test_init_tokenizer(self):
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.object(tokenizer.jieba.dt, 'initialized', False), \
+                mock.patch.object(tokenizer.jieba.dt, 'tmp_dir', None), \
+                mock.patch.object(tokenizer.jieba, 'initialize') as initialize, \
+                mock.patch.object(tokenizer, 'load_user_dict'):
+            tokenizer.init_tokenizer(cache_dir, role='test')
+            initialize.assert_called_once_with()
+            self.assertEqual(tokenizer.jieba.dt.tmp_dir, cache_dir)
+        # 已加载时不再重复加载
+        tokenizer.jieba.initialize()
+        tokenizer.init_tokenizer(role='test')
+        metrics = self.app.test_client().get('/api/search/tokenizer').get_json()
+        self.assertTrue(metrics['test']['preloaded'])
+        self.assertEqual(metrics['test']['pid'], os.getpid())
+
+    def test_stop_words_and_user_dict(self):
+        words = [word for word, _ in tokenize('我们使用RSA加密与Redis')]
+        self.assertIn('rsa加密', words)
+        self.assertIn('redis', words)
+        self.assertNotIn('我们', words)
+        self.assertNotIn('与', words)
+        # 查询与相似度计算使用相同的分词结果
+        self.assertEqual(parse('RSA加密').terms, ['rsa加密'])
+        self.assertNotIn('我们', get_words_weight('我们使用RSA加密'))
+        self.assertEqual(stop_word_counts([('title', '我们的'), ('body', '我们与的')]),
+                         {'我们': 2, '的': 2, '与': 1})
+
+    def test_dictionaries_from_app_config(self):
+        key = token_cache.cache_key([('body', '进程调度')])
+        path = self.app.config['STOP_WORDS_PATH']
+        with tempfile.TemporaryDirectory() as directory:
+            stop_words_path = os.path.join(directory, 'stop_words.txt')
+            with open(stop_words_path, 'w', encoding='utf-8') as fd:
+                fd.write('# 测试\n进程\n')
+            self.app.config['STOP_WORDS_PATH'] = stop_words_path
+            try:
+                tokenizer.init_app(self.app)
+                self.assertEqual(tokenizer.STOP_WORDS, {'进程'})
+                self.assertNotIn('进程', [word for word, _ in tokenize('进程调度')])
+                # 词表改变后分词结果缓存的key随之改变
+                self.assertNotEqual(token_cache.cache_key([('body', '进程调度')]), key)
+            finally:
+                self.app.config['STOP_WORDS_PATH'] = path
+                tokenizer.init_app(self.app)
+        self.assertEqual(token_cache.cache_key([('body', '进程调度')]), key)
+
+    def test_tfidf_similarity(self):
+        weights = {
+            1: {'进程': 2, '调度': 1},
+            2: {'进程': 3, '内存': 4},
+            3: {'网络': 1},
+            4: {'进程': 1, '调度': 1, '内存': 1},
+        }
+        neighbours = similar_articles(weights, 2)
+        self.assertEqual([other for other, _ in neighbours[1]], [4, 2])
+        self.assertEqual(neighbours[3], [])
+        # 与直接按定义计算的TF-IDF余弦相似度相同
+        df = Counter(word for doc in weights.values() for word in doc)
+        vectors = {
+            article_id: {word: weight * (math.log((1 + len(weights)) / (1 + df[word])) + 1)
+                         for word, weight in doc.items()}
+            for article_id, doc in weights.items()
+        }
+
+        def cosine(a, b):
+            dot = sum(value * b.get(word, 0) for word, value in a.items())
+            return dot / math.sqrt(sum(v * v for v in a.values()) * sum(v * v for v in b.values()))
+
+        for article_id, similar in neighbours.items():
+            for other, score in similar:
+                self.assertAlmostEqual(score, cosine(vectors[article_id], vectors[other]))
+        self.assertAlmostEqual(dict(neighbours[2])[4], 0.7824, places=4)
+        # 分块计算的结果相同
+        tfidf = TfidfMatrix.build(list(weights.values()))
+        expected = tfidf.top_k(2)
+        with mock.patch('app.utils.tfidf.BLOCK_SIZE', 1):
+            self.assertEqual(tfidf.top_k(2), expected)
+
+    def test_incremental_similarity(self):
+        self.app.config['SIMILAR_ARTICLES'] = 1
+        a = self.add_article('进程调度', '进程 调度 算法', tags=())
+        b = self.add_article('进程管理', '进程 管理', tags=())
+        c = self.add_article('网络协议', '网络 协议 设计', tags=())
+        for article in (a, b, c):
+            article._cache_similar()
+        self.assertEqual([other_id for other_id, _ in related.get(a.id)], [b.id])
+        self.assertEqual([other_id for other_id, _ in related.get(b.id)], [a.id])
+        # 只保留最相似的一篇
+        self.assertEqual(len(related.get(c.id)), 1)
+
+        # 其他进程修改的文章按分词缓存key同步
+        related._index = None
+        self.app.config['SIMILAR_ARTICLES'] = 2
+        c.body = '进程 调度 算法 网络'
+        c._cache_similar()
+        self.assertEqual([other_id for other_id, _ in related.get(c.id)], [a.id, b.id])
+        self.assertEqual(dict(related.get(a.id))[c.id], dict(related.get(c.id))[a.id])
+
+        # 进程内缓存的行与Redis中记录的key不同时重新读取
+        related._index.update(b.id, {}, 'stale')
+        c._cache_similar()
+        self.assertEqual(related._index.keys[b.id], token_cache.cache_key(b.fields))
+        self.assertIn(b.id, dict(related.get(c.id)))
+
+        # 读取相似文章不依赖标题
+        a.title = '进程调度算法'
+        db.session.commit()
+        self.assertEqual(related.similar_articles(c.id, 1)[0][0].title, '进程调度算法')
+        response = self.app.test_client().get(f'/api/articles/{c.id}/similarities/')
+        self.assertEqual(response.get_json()[0]['id'], a.id)
+
+        c._delete_cache()
+        self.assertEqual(related.get(c.id), [])
+        self.assertNotIn(c.id, dict(related.get(a.id)))
+        self.assertNotIn(str(c.id), redis.hkeys(related.SIMILARITY_KEYS))
+
+    def test_incremental_tfidf(self):
+        tfidf = TfidfMatrix.build([{'进程': 2, '调度': 1}, {'进程': 3, '内存': 4}, {'网络': 1}])
+        others = tfidf.matrix[[0, 2]].toarray()
+        idf = tfidf.idf.copy()
+        # 只计算替换的一行，idf与其他行不变
+        tfidf.replace(1, {'进程': 1, '分页': 2})
+        self.assertTrue((tfidf.matrix[[0, 2]].toarray()[:, :others.shape[1]] == others).all())
+        self.assertTrue((tfidf.idf[:len(idf)] == idf).all())
+        self.assertAlmostEqual(tfidf.idf[tfidf.vocabulary['分页']], math.log(4 / 2) + 1)
+        self.assertAlmostEqual(float(tfidf.matrix[1].multiply(tfidf.matrix[1]).sum()), 1.0)
+        tfidf.replace(3, {'网络': 1})
+        self.assertEqual(tfidf.similar(3), [(2, 1.0)])
+        tfidf.delete(0)
+        self.assertEqual(tfidf.matrix.shape[0], 3)
+        self.assertEqual(tfidf.similar(2), [(1, 1.0)])
+        self.assertEqual(tfidf.changed, 3)
+
+        # 只修改之前包含这篇文章，或新的相似度高于其第SIMILAR_ARTICLES篇的文章
+        floors = {1: 0.5, 2: 0.5, 3: 0.5, 4: 0}
+        changed = related._changed_neighbours({1: 0.6, 2: 0.2}, {1: 0.3, 2: 0.1, 3: 0.7, 4: 0.1}, floors)
+        self.assertEqual(changed, {1: 0.3, 3: 0.7, 4: 0.1})
+        self.assertEqual(related._changed_neighbours({1: 0.6, 2: 0.2}, {}, {1: 0.5, 2: 0.5}), {1: None})
+
+    def test_concurrent_similarity_update(self):
+        a = self.add_article('进程调度', '进程 调度 算法', tags=())
+        c = self.add_article('调度算法', '进程 调度 网络', tags=())
+        for article in (a, c):
+            article._cache_similar()
+
+        def write():
+            # 另一个worker在读取之后、提交之前修改了a的相似文章
+            binary_redis.hset(related.RELATED_KEY, a.id, related.pack(related.get(a.id) + [(999, 0.01)]))
+
+        with concurrent_merge(write) as calls:
+            c.body = '进程 调度 算法'
+            c._cache_similar()
+        # 事务冲突后重新读取并合并，两个修改都保留
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(set(dict(related.get(a.id))), {c.id, 999})
+        self.assertAlmostEqual(dict(related.get(a.id))[c.id], dict(related.get(c.id))[a.id], places=3)
+
+    def test_store_similarity(self):
+        with mock.patch.object(related, 'PIPELINE_SIZE', 2):
+            related.store({1: [(2, 0.5), (3, 0.25)], 2: [(1, 0.5)], 3: []},
+                          keys={1: 'k1', 2: 'k2', 3: 'k3'})
+        self.assertEqual(related.get(1), [(2, 0.5), (3, 0.25)])
+        self.assertEqual(related.get(1, limit=1), [(2, 0.5)])
+        self.assertEqual(related.get(3), [])
+        self.assertEqual(redis.hget(related.SIMILARITY_KEYS, 3), 'k3')
+
+    def test_related_backfill(self):
+        a = self.add_article('进程调度', '进程 调度')
+        b = self.add_article('进程管理', '进程 管理')
+        redis.zadd(a.title, {b.title: 0.5, '已删除的文章': 0.75})
+        redis.zadd(b.title, {a.title: 0.5})
+        self.assertEqual(related.backfill(), 2)
+        self.assertEqual(related.get(a.id), [(b.id, 0.5)])
+        self.assertFalse(redis.exists(a.title, b.title))
+
+    def test_approximate_similarity(self):
+        topics = [['进程', '调度', '线程', '锁', '内存', '分页'],
+                  ['网络', '协议', '路由', '握手', '拥塞', '窗口']]
+        weights = {}
+        for article_id in range(20):
+            words = topics[article_id % 2][article_id % 3:article_id % 3 + 4]
+            weights[article_id] = {word: 1 + article_id % 4 for word in words}
+        weights[20] = {}
+        exact = similar_articles(weights, 3)
+        approximate = approximate_similar_articles(weights, 3)
+        self.assertEqual(approximate[20], [])
+        vectors = TfidfMatrix.build(list(weights.values())).matrix.toarray()
+        for article_id, similar in approximate.items():
+            # 候选文章的相似度为精确值，词完全相同的文章一定是候选文章
+            for other_id, score in similar:
+                self.assertAlmostEqual(score, float(vectors[article_id] @ vectors[other_id]))
+            if exact[article_id]:
+                self.assertAlmostEqual(similar[0][1], exact[article_id][0][1])
+
+        # 增量计算时用LSH桶中的候选文章代替所有文章
+        self.app.config['SIMILARITY_LSH_THRESHOLD'] = 0
+        a = self.add_article('进程调度', '进程 调度 线程 锁', tags=())
+        b = self.add_article('进程管理', '进程 调度 线程 内存', tags=())
+        c = self.add_article('网络协议', '网络 协议 路由 握手', tags=())
+        for article in (a, b, c):
+            article._cache_similar()
+        self.assertIsNotNone(related._index.bands)
+        self.assertIn(b.id, related._index.bands.candidates(a.id))
+        with mock.patch.object(related._index.tfidf, 'similar', wraps=related._index.tfidf.similar) as similar:
+            c.body = '网络 协议 路由 窗口'
+            c._cache_similar()
+        self.assertTrue(all(call.args[1] is not None for call in similar.call_args_list))
+        self.assertEqual(related.get(a.id)[0][0], b.id)
+        self.assertNotIn(c.id, related._index.bands.candidates(c.id))